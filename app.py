@@ -1,6 +1,9 @@
 import streamlit as st
+import itertools
+import json
 import sys
 import os
+import time
 
 # Add src to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
@@ -12,10 +15,21 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 st.set_page_config(page_title="HR Policy Assistant", layout="wide")
 
 @st.cache_resource
+def get_warm_start():
+    # Loads and warms the agent on background threads, shared by all sessions;
+    # the page renders immediately and polls its state
+    from startup import WarmStart
+    return WarmStart().start()
+
 def get_agent():
-    # Lazy import to speed up initial UI render
-    from agent import HRAgent
-    return HRAgent()
+    return get_warm_start().wait()
+
+def get_memory(agent):
+    # One rolling conversation summary per browser session
+    if "memory" not in st.session_state:
+        from conversation_memory import ConversationMemory
+        st.session_state.memory = ConversationMemory(agent.llm, idle_seconds=agent.idle_seconds)
+    return st.session_state.memory
 
 def main():
     st.title("🤖 Offline HR Policy Assistant")
@@ -25,17 +39,19 @@ def main():
     st.sidebar.header("System Status")
     status_placeholder = st.sidebar.empty()
     
-    # Check if agent is ready without blocking UI render immediately
-    if "agent_ready" not in st.session_state:
-        status_placeholder.info("⏳ Initializing AI Engine... Please wait.")
-        try:
-            get_agent()
-            st.session_state.agent_ready = True
-            status_placeholder.success("✅ System Ready (Local LLM Loaded)")
-        except Exception as e:
-            status_placeholder.error(f"❌ Error loading model: {e}")
-    else:
+    # Startup runs in the background; show its progress without blocking the page
+    warm = get_warm_start()
+    if warm.ready:
         status_placeholder.success("✅ System Ready (Local LLM Loaded)")
+    elif warm.state == 'failed':
+        status_placeholder.error(f"❌ Error loading model: {warm.error}")
+        if st.sidebar.button("Retry startup"):
+            get_warm_start.clear()
+            st.rerun()
+    else:
+        loading = ", ".join(sorted(warm.report.current)) or warm.state
+        status_placeholder.info(f"⏳ Initializing AI Engine ({warm.report.elapsed():.0f}s: {loading})... "
+                                "You can type your question meanwhile.")
 
     st.sidebar.markdown("---")
     st.sidebar.header("💡 What can I ask?")
@@ -56,6 +72,33 @@ def main():
 
     # --- DEV: Stress Test UI ---
     with st.sidebar.expander("🔧 Developer Diagnostics"):
+        if warm.state in ('ready', 'failed'):
+            st.caption(f"Startup: {warm.report.total:.1f}s (phases overlap)")
+            st.dataframe(warm.report.rows())
+        if warm.ready:
+            cache_stats = get_agent().tools.query_cache.stats()
+            st.caption(f"Query embedding cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                       f"({cache_stats['hit_rate']:.0%}), {cache_stats['size']}/{cache_stats['maxsize']} entries")
+            answer_stats = get_agent().answer_cache.stats()
+            st.caption(f"Answer cache: {answer_stats['hits']} hits / {answer_stats['misses']} misses "
+                       f"({answer_stats['hit_rate']:.0%}), {answer_stats['size']}/{answer_stats['max_entries']} entries")
+            prefetch = get_agent().prefetch_stats
+            st.caption(f"Speculative retrieval: {prefetch['hits']} used / {prefetch['misses']} re-queried "
+                       f"of {prefetch['started']} started")
+            prompt_stats = get_agent().tools.prompt_builder.stats()
+            st.caption(f"Prompt tokens: avg {prompt_stats['avg_prompt_tokens']:.0f}, max {prompt_stats['max_prompt_tokens']} "
+                       f"of {prompt_stats['budget']} budget; {prompt_stats['trimmed']}/{prompt_stats['requests']} prompts trimmed")
+            gen_stats = get_agent().llm.generation_stats()
+            st.caption(f"LLM decode: {gen_stats['tokens_generated']} tokens generated, {gen_stats['tokens_kept']} kept, "
+                       f"{gen_stats['early_stops']}/{gen_stats['calls']} calls cut by stop sequences")
+            if gen_stats.get('workers'):
+                st.caption("LLM pool workers")
+                st.dataframe(gen_stats['workers'])
+            prefix_cache = get_agent().llm.prefix_cache
+            if prefix_cache is not None:
+                prefix_stats = prefix_cache.stats()
+                st.caption(f"Prompt-prefix KV cache: {prefix_stats['hits']} hits / {prefix_stats['misses']} misses, "
+                           f"{prefix_stats['size']}/{prefix_stats['maxsize']} prefixes")
         if st.button("Run Stress Test (10 Qs)"):
             with st.spinner("Running system evaluation..."):
                 try:
@@ -70,7 +113,29 @@ def main():
                     st.success("Test Complete!")
                 except Exception as e:
                     st.error(f"Test failed: {e}")
-    
+
+        st.markdown("**Load test**")
+        load_users = st.number_input("Virtual users", min_value=1, max_value=64, value=4)
+        load_rate = st.number_input("Target requests/s (0 = unpaced)", min_value=0.0, value=0.0)
+        load_ramp = st.number_input("Ramp-up (s)", min_value=0.0, value=5.0)
+        load_duration = st.number_input("Duration (s)", min_value=5.0, value=30.0)
+        question_files = st.file_uploader("Question files (.txt / .json)", type=["txt", "json"],
+                                          accept_multiple_files=True)
+        load_use_cache = st.checkbox("Use answer cache", value=False,
+                                     help="Off: cache lookups miss during the test (also for other sessions).")
+        if st.button("Run Load Test"):
+            with st.spinner(f"Running {load_users} virtual users for {load_duration:.0f}s..."):
+                try:
+                    sys.path.append(os.getcwd())
+                    from stress_test import run_load_test, parse_questions
+                    question_sets = {f.name: parse_questions(f.getvalue().decode("utf-8")) for f in question_files or []}
+                    st.session_state.load_results = run_load_test(
+                        get_agent(), {name: qs for name, qs in question_sets.items() if qs} or None,
+                        users=int(load_users), rate=load_rate or None, ramp_up=load_ramp, duration=load_duration,
+                        use_cache=load_use_cache)
+                except Exception as e:
+                    st.error(f"Load test failed: {e}")
+
     if "stress_results" in st.session_state:
         st.subheader("📊 System Verification Results")
         res_data = st.session_state.stress_results
@@ -79,6 +144,26 @@ def main():
             del st.session_state.stress_results
             st.rerun()
 
+    if "load_results" in st.session_state:
+        st.subheader("📈 Load Test Results")
+        load = st.session_state.load_results
+        summary = load["summary"]
+        cols = st.columns(6)
+        cols[0].metric("Throughput", f"{summary['throughput_rps']:.2f} req/s")
+        cols[1].metric("Error rate", f"{summary['error_rate']:.1%}")
+        for col, p in zip(cols[2:5], ("p50", "p95", "p99")):
+            value = summary["latency_s"][p]
+            col.metric(f"Latency {p}", f"{value:.2f}s" if value is not None else "-")
+        ttft = summary["ttft_s"]["p95"]
+        cols[5].metric("TTFT p95", f"{ttft:.2f}s" if ttft is not None else "-")
+        st.json(summary, expanded=False)
+        st.dataframe(load["requests"])
+        st.download_button("Download JSON", json.dumps(load, indent=2), file_name="load_test.json",
+                           mime="application/json")
+        if st.button("Close Load Test"):
+            del st.session_state.load_results
+            st.rerun()
+
     # Display chat messages
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -95,18 +180,37 @@ def main():
         with st.chat_message("assistant"):
             try:
                 agent = get_agent()
+                topic_placeholder = st.empty()
+                answer_placeholder = st.empty()
+                result = None
+                streamed = []
+
                 with st.spinner("Analyzing policies..."):
-                    result = agent.handle_query(prompt, st.session_state.messages[:-1])
-                
+                    # Summary of older turns plus the last few verbatim, not the whole transcript
+                    memory = get_memory(agent)
+                    events = agent.handle_query_stream(prompt, memory.history(st.session_state.messages[1:-1]))
+                    # Intent classification happens before the first event
+                    first_event = next(events)
+
+                for event in itertools.chain([first_event], events):
+                    if event["type"] == "intent":
+                        # Show intent only for policy queries
+                        if event["intent"] != "chitchat":
+                            topic_placeholder.markdown(f"*Detected Topic: `{event['intent']}`*")
+                    elif event["type"] == "token":
+                        # Render tokens as they arrive
+                        streamed.append(event["text"])
+                        answer_placeholder.markdown("".join(streamed) + "▌")
+                    elif event["type"] == "done":
+                        result = event
+
                 response_text = result["answer"]
                 intent = result["intent"]
                 sources = result["sources"]
-                
-                # Show intent only for policy queries
-                if intent != "chitchat":
-                    st.markdown(f"*Detected Topic: `{intent}`*")
-                
-                st.markdown(response_text)
+
+                if intent != "chitchat" and result.get("cached"):
+                    topic_placeholder.markdown(f"*Detected Topic: `{intent}` · ⚡ cached answer*")
+                answer_placeholder.markdown(response_text)
                 
                 # Only show sources if they exist
                 if sources:
@@ -116,9 +220,16 @@ def main():
                 
                 # Add assistant response to history
                 st.session_state.messages.append({"role": "assistant", "content": response_text})
+                # Summarize turns that left the window in the background, after the answer is shown
+                memory.update(st.session_state.messages[1:])
                 
             except Exception as e:
                 st.error(f"An error occurred: {e}")
 
+    # Poll until the background startup finishes
+    if warm.state in ('pending', 'loading', 'warming'):
+        time.sleep(1)
+        st.rerun()
+
 if __name__ == "__main__":
     main()
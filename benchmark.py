@@ -0,0 +1,279 @@
+"""
+Offline performance benchmarks. Needs the cached embedding model but not the
+GGUF file: the LLM is StubLLM (deterministic text, simulated latency).
+
+    python benchmark.py --scale 10                  # one corpus scale
+    python benchmark.py --scale 10,100,1000         # each scale in its own process, merged
+    python benchmark.py --compare old.json new.json # diff two result files
+
+Results are JSON (data/bench/results/ by default) so runs can be diffed
+between versions.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+# No settings read at import, unlike the modules run_scale loads after configure()
+from latency_stats import latency_summary
+from sample_questions import POLICY_QUESTIONS, STRESS_TEST_QUESTIONS
+
+BENCH_DIR = os.path.join(ROOT, 'data', 'bench')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+TOKEN_LATENCY_MS = 5
+# Documents extracted/chunked and chunks embedded for the rate measurements
+SAMPLE_DOCS = 200
+SAMPLE_CHUNKS = 1024
+RETRIEVAL_ROUNDS = 3
+
+
+def configure(scale, token_latency_ms):
+    """Points every component at the benchmark corpus/index; must run before src imports."""
+    os.environ.update({
+        'HR_LLM_BACKEND': 'stub',
+        'HR_LLM_WORKERS': '1',
+        'HR_STUB_TOKEN_LATENCY_MS': str(token_latency_ms),
+        'HR_POLICY_DIR': corpus_dir(scale),
+        'HR_CHROMA_PATH': os.path.join(BENCH_DIR, f'index_{scale}x'),
+        'HR_CACHE_DIR': os.path.join(BENCH_DIR, f'cache_{scale}x'),
+        # Every handle_query call does the full work; no replayed answers
+        'HR_ANSWER_CACHE_THRESHOLD': '2.0',
+    })
+
+
+def corpus_dir(scale):
+    return os.path.join(BENCH_DIR, f'corpus_{scale}x')
+
+
+def summarize(samples):
+    """Latency percentiles (nearest rank, same as stress_test) in milliseconds."""
+    summary = latency_summary(samples)
+    if not summary['n']:
+        return {'n': 0}
+    return dict({'n': summary['n']}, **{f'{key}_ms': round(summary[key] * 1000, 3)
+                                        for key in ('mean', 'p50', 'p95', 'p99', 'max')})
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ensure_corpus(scale):
+    import generate_dummy_pdfs
+    expected = scale * len(generate_dummy_pdfs.POLICIES)
+    folder = corpus_dir(scale)
+    found = sum(len([f for f in files if f.endswith('.pdf')]) for _, _, files in os.walk(folder))
+    if found < expected:
+        print(f"Generating {expected} PDFs for the {scale}x corpus...")
+        generate_dummy_pdfs.generate_synthetic(scale, folder)
+    return expected
+
+
+def bench_chunking(sample_docs=SAMPLE_DOCS):
+    from ingest_policies import DATA_DIR, scan_pdfs, load_document, get_chunker
+    from embeddings import get_embedding_service
+
+    pdfs = sorted(scan_pdfs(DATA_DIR).items())[:sample_docs]
+    chunker = get_chunker(get_embedding_service())
+
+    start = time.perf_counter()
+    docs = [load_document(filepath, category) for _, (filepath, category) in pdfs]
+    extract_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    spans = [list(chunker.split_spans(doc['text'])) for doc in docs]
+    chunk_s = time.perf_counter() - start
+
+    chunks = sum(len(s) for s in spans)
+    pages = sum(doc['metadata']['page_count'] for doc in docs)
+    chars = sum(len(doc['text']) for doc in docs)
+    texts = [doc['text'][a:b] for doc, doc_spans in zip(docs, spans) for a, b, _ in doc_spans]
+    return {
+        'documents': len(docs),
+        'extract_pages_per_s': round(pages / extract_s, 1) if extract_s else None,
+        'chunks': chunks,
+        'chunks_per_s': round(chunks / chunk_s, 1) if chunk_s else None,
+        'chars_per_s': round(chars / chunk_s, 1) if chunk_s else None,
+        'tokens_per_chunk': round(sum(t for s in spans for _, _, t in s) / chunks, 1) if chunks else None,
+    }, texts
+
+
+def bench_embedding(texts, sample_chunks=SAMPLE_CHUNKS):
+    from embeddings import get_embedding_service, ENCODE_BATCH_SIZE
+
+    service = get_embedding_service()
+    texts = (texts * (sample_chunks // max(1, len(texts)) + 1))[:sample_chunks]
+    service.encode_batch(texts[:ENCODE_BATCH_SIZE])  # load + warm up
+    start = time.perf_counter()
+    service.encode_batch(texts)
+    seconds = time.perf_counter() - start
+
+    single = []
+    for text in texts[:32]:
+        start = time.perf_counter()
+        service.encode(text[:120])
+        single.append(time.perf_counter() - start)
+    return {
+        'backend': service.backend,
+        'texts': len(texts),
+        'batch_size': ENCODE_BATCH_SIZE,
+        'texts_per_s': round(len(texts) / seconds, 1),
+        'single_query': summarize(single),
+    }
+
+
+def bench_ingest():
+    import ingest_policies
+
+    start = time.perf_counter()
+    ingest_policies.main(['--full'])
+    seconds = time.perf_counter() - start
+    files = ingest_policies.load_manifest().get('files', {})
+    chunks = sum(entry.get('chunk_count', 0) for entry in files.values())
+    return {
+        'seconds': round(seconds, 3),
+        'files': len(files),
+        'chunks': chunks,
+        'files_per_s': round(len(files) / seconds, 2),
+        'chunks_per_s': round(chunks / seconds, 2),
+    }
+
+
+def benchmark_queries():
+    return POLICY_QUESTIONS + STRESS_TEST_QUESTIONS
+
+
+def bench_retrieval(queries, rounds=RETRIEVAL_ROUNDS):
+    from tools import RAGTools
+    from llm_client import get_llm
+
+    tools = RAGTools(llm=get_llm())
+    categories = [None, "leave", "salary", "offboarding"]
+    cold, warm = [], []
+    for r in range(rounds):
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            tools._retrieve(query, category=categories[i % len(categories)])
+            # The first round embeds every query; later rounds hit the query cache
+            (cold if r == 0 else warm).append(time.perf_counter() - start)
+    return {'with_query_embedding': summarize(cold), 'cached_query_embedding': summarize(warm)}
+
+
+def bench_handle_query(queries):
+    from agent import HRAgent
+
+    agent = HRAgent()
+    llm = agent.llm
+    wall, overhead, paths = [], [], {}
+    for query in queries:
+        busy_before = llm.generation_stats()['busy_seconds']
+        start = time.perf_counter()
+        result = agent.handle_query(query, [])
+        seconds = time.perf_counter() - start
+        wall.append(seconds)
+        # Everything that is not (simulated) LLM prefill/decode
+        overhead.append(max(0.0, seconds - (llm.generation_stats()['busy_seconds'] - busy_before)))
+        paths[result['intent_path']] = paths.get(result['intent_path'], 0) + 1
+    return {
+        'agent_startup_s': round(agent.startup_report.total, 3),
+        'latency': summarize(wall),
+        'overhead': summarize(overhead),
+        'intent_paths': paths,
+    }
+
+
+def run_scale(scale, token_latency_ms):
+    configure(scale, token_latency_ms)
+    files = ensure_corpus(scale)
+    queries = benchmark_queries()
+
+    results = {
+        'version': git_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'scale': scale,
+        'corpus_files': files,
+        'config': {key: os.environ[key] for key in sorted(os.environ) if key.startswith('HR_')},
+    }
+    results['chunking'], texts = bench_chunking()
+    results['embedding'] = bench_embedding(texts)
+    results['ingest'] = bench_ingest()
+    results['retrieval'] = bench_retrieval(queries)
+    results['handle_query'] = bench_handle_query(queries)
+    return results
+
+
+def flatten(data, prefix=""):
+    """{'a': {'b': 1}} -> {'a.b': 1}, numeric leaves only."""
+    out = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            out.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        out[prefix[:-1]] = data
+    return out
+
+
+def compare(old_path, new_path):
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    old_runs = {run['scale']: run for run in old.get('runs', [old])}
+    new_runs = {run['scale']: run for run in new.get('runs', [new])}
+    print(f"{'metric':<52} {'old':>12} {'new':>12} {'change':>8}")
+    for scale in sorted(set(old_runs) & set(new_runs)):
+        a, b = flatten(old_runs[scale]), flatten(new_runs[scale])
+        for key in sorted(set(a) & set(b)):
+            if key.startswith('config.') or key in ('scale', 'corpus_files'):
+                continue
+            change = f"{(b[key] - a[key]) / a[key] * 100:+.1f}%" if a[key] else ""
+            print(f"{f'{scale}x ' + key:<52} {a[key]:>12} {b[key]:>12} {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with a stub LLM.")
+    parser.add_argument('--scale', default='10', help="Corpus scale(s), comma separated (e.g. 10,100,1000).")
+    parser.add_argument('--token-latency-ms', type=float, default=TOKEN_LATENCY_MS,
+                        help=f"Stub LLM decode latency per token (default: {TOKEN_LATENCY_MS}).")
+    parser.add_argument('--output', help="Result JSON path (default: data/bench/results/<time>.json).")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Diff two result files.")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scales = [int(s) for s in args.scale.split(',')]
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    if len(scales) == 1:
+        results = run_scale(scales[0], args.token_latency_ms)
+    else:
+        # Module-level settings are read at import, so each scale gets a fresh process
+        runs = []
+        for scale in scales:
+            part = f"{output}.{scale}x.json"
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), '--scale', str(scale),
+                                   '--token-latency-ms', str(args.token_latency_ms), '--output', part])
+            with open(part, 'r', encoding='utf-8') as f:
+                runs.append(json.load(f))
+            os.remove(part)
+        results = {'version': git_version(), 'runs': runs}
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Benchmark results written to {output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
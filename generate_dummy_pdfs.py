@@ -1,7 +1,11 @@
 from fpdf import FPDF
 import os
+import re
+import sys
+import random
+import argparse
 
-def create_pdf(text, filename, folder):
+def create_pdf(text, filename, folder, verbose=True):
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", size=11)
@@ -13,9 +17,12 @@ def create_pdf(text, filename, folder):
     os.makedirs(folder, exist_ok=True)
     filepath = os.path.join(folder, filename)
     pdf.output(filepath)
-    print(f"Created {filepath}")
+    if verbose:
+        print(f"Created {filepath}")
 
 base_dir = "data/hr_policies"
+# (text, filename, category folder) of every template below
+POLICIES = []
 
 # 1. Employee Handbook
 handbook_text = """EMPLOYEE HANDBOOK - COMPANY X
@@ -47,7 +54,7 @@ Training: We support continuous learning through workshops and online courses.
 VI. Safety
 We are committed to a safe workplace. Report any hazards immediately. In emergencies, follow the posted evacuation routes.
 """
-create_pdf(handbook_text, "sample_handbook_companyX.pdf", os.path.join(base_dir, "handbook"))
+POLICIES.append((handbook_text, "sample_handbook_companyX.pdf", "handbook"))
 
 # 2. Leave Policy
 leave_text = """LEAVE POLICY 2024
@@ -83,7 +90,7 @@ Total 10 paid public holidays per year as per the published calendar.
 4. Unpaid Leave (LOP)
 Leaves taken beyond entitlement will be treated as Loss of Pay.
 """
-create_pdf(leave_text, "leave_policy_template.pdf", os.path.join(base_dir, "leave"))
+POLICIES.append((leave_text, "leave_policy_template.pdf", "leave"))
 
 # 3. Reimbursement Policy
 reimbursement_text = """TRAVEL AND EXPENSE REIMBURSEMENT POLICY
@@ -118,7 +125,7 @@ Applies to all employees traveling for official business.
 7. Non-Reimbursable
 Alcohol, personal entertainment, traffic fines, laundry (unless trip > 7 days).
 """
-create_pdf(reimbursement_text, "travel_reimbursement_policy.pdf", os.path.join(base_dir, "reimbursement"))
+POLICIES.append((reimbursement_text, "travel_reimbursement_policy.pdf", "reimbursement"))
 
 # 4. Onboarding Policy
 onboarding_text = """EMPLOYEE ONBOARDING PROCESS CHECKLIST
@@ -148,7 +155,7 @@ Phase 4: First Month
 - Completion of department-specific training.
 - 30-day feedback conversation.
 """
-create_pdf(onboarding_text, "onboarding_policy_v1.pdf", os.path.join(base_dir, "onboarding"))
+POLICIES.append((onboarding_text, "onboarding_policy_v1.pdf", "onboarding"))
 
 # 5. Offboarding Policy
 offboarding_text = """EMPLOYEE EXIT AND OFFBOARDING POLICY
@@ -177,7 +184,7 @@ HR will conduct a confidential exit interview to gather feedback.
 - Includes unpaid salary, leave encashment (EL only), and bonus (if applicable).
 - Relieving Letter and Experience Certificate issued post FNF settlement.
 """
-create_pdf(offboarding_text, "exit_policy.pdf", os.path.join(base_dir, "offboarding"))
+POLICIES.append((offboarding_text, "exit_policy.pdf", "offboarding"))
 
 # 6. Performance Policy
 performance_text = """PERFORMANCE APPRAISAL POLICY
@@ -214,7 +221,7 @@ To evaluate contribution, provide feedback, and align goals.
 - Goal: Specific, measurable targets to restore performance.
 - Outcome: Improvement or termination.
 """
-create_pdf(performance_text, "performance_appraisal_policy.pdf", os.path.join(base_dir, "performance"))
+POLICIES.append((performance_text, "performance_appraisal_policy.pdf", "performance"))
 
 # 7. Code of Conduct
 code_text = """CODE OF CONDUCT AND ETHICS POLICY
@@ -242,7 +249,7 @@ Integrity, Respect, Accountability, Compliance.
 - Whistleblower policy protects reporters.
 - Contact ethics@company.com.
 """
-create_pdf(code_text, "code_of_conduct_template.pdf", os.path.join(base_dir, "code_of_conduct"))
+POLICIES.append((code_text, "code_of_conduct_template.pdf", "code_of_conduct"))
 
 # 8. Grievance & POSH
 grievance_text = """PREVENTION OF SEXUAL HARASSMENT (POSH) & GRIEVANCE POLICY
@@ -266,7 +273,7 @@ grievance_text = """PREVENTION OF SEXUAL HARASSMENT (POSH) & GRIEVANCE POLICY
 - Fire Drills conducted bi-annually.
 - Late Night Transport: Cabs provided for female employees leaving after 8 PM effective security guard escort.
 """
-create_pdf(grievance_text, "posh_policy.pdf", os.path.join(base_dir, "grievance"))
+POLICIES.append((grievance_text, "posh_policy.pdf", "grievance"))
 
 # ================= NEW CONTENT =================
 
@@ -298,7 +305,7 @@ c. Retirals
 3. Reimbursements (Flexible Benefit Plan)
 Employees can opt for Food coupons, Fuel, and Driver allowance components to optimize tax.
 """
-create_pdf(salary_text, "salary_policy.pdf", os.path.join(base_dir, "salary"))
+POLICIES.append((salary_text, "salary_policy.pdf", "salary"))
 
 # 10. Governance & Compliance
 compliance_text = """CORPORATE GOVERNANCE AND STATUTORY COMPLIANCE FRAMEWORK
@@ -320,7 +327,7 @@ The company strictly adheres to:
 - Protected Disclosure: Identity of whistleblower is kept confidential.
 - Reports go directly to the Audit Committee Chairman.
 """
-create_pdf(compliance_text, "governance_framework.pdf", os.path.join(base_dir, "compliance"))
+POLICIES.append((compliance_text, "governance_framework.pdf", "compliance"))
 
 # 11. Employee Welfare
 welfare_text = """EMPLOYEE WELLNESS AND WELFARE BENEFITS
@@ -344,7 +351,7 @@ welfare_text = """EMPLOYEE WELLNESS AND WELFARE BENEFITS
 - 24/7 Counseling Hotline for mental health support.
 - Free psychological counseling sessions (up to 6 per year).
 """
-create_pdf(welfare_text, "welfare_benefits.pdf", os.path.join(base_dir, "welfare"))
+POLICIES.append((welfare_text, "welfare_benefits.pdf", "welfare"))
 
 # 12. Women's Welfare & Rights (Consolidated)
 women_rights_text = """WOMEN'S WELFARE, RIGHTS, AND MANDATES POLICY
@@ -373,6 +380,53 @@ women_rights_text = """WOMEN'S WELFARE, RIGHTS, AND MANDATES POLICY
 - Sabbatical: Unpaid career break option for 1 year for childcare/eldercare.
 - Mentorship: 'Women in Tech' leadership program.
 """
-create_pdf(women_rights_text, "women_welfare_rights.pdf", os.path.join(base_dir, "welfare"))
-
-print("All authentic detailed PDF templates (Handbook, Salary, Compliance, Welfare, Women's Rights etc.) created.")
+POLICIES.append((women_rights_text, "women_welfare_rights.pdf", "welfare"))
+
+
+def generate_base(out_dir=base_dir):
+    for text, filename, category in POLICIES:
+        create_pdf(text, filename, os.path.join(out_dir, category))
+    print("All authentic detailed PDF templates (Handbook, Salary, Compliance, Welfare, Women's Rights etc.) created.")
+
+def synthetic_variant(text, copy, rng):
+    """
+    A plausible, distinct copy of a template: numbered sections shuffled
+    (title kept first), company and unit names changed, so chunks and
+    embeddings differ across copies while the vocabulary stays realistic.
+    """
+    sections = re.split(r"\n(?=\d+\.\s|[IVX]+\.\s)", text)
+    head, body = sections[0], sections[1:]
+    rng.shuffle(body)
+    variant = "\n".join([head.replace("\n", f" - UNIT {copy}\n", 1)] + body)
+    return variant.replace("Company X", f"Company X{copy}")
+
+def generate_synthetic(scale, out_dir, seed=0):
+    """scale copies of every template (len(POLICIES) x scale PDFs), deterministic for a given seed."""
+    rng = random.Random(seed)
+    count = 0
+    for copy in range(scale):
+        for text, filename, category in POLICIES:
+            stem, ext = os.path.splitext(filename)
+            create_pdf(synthetic_variant(text, copy, rng), f"{stem}_{copy:04d}{ext}",
+                       os.path.join(out_dir, category), verbose=False)
+            count += 1
+        if (copy + 1) % 10 == 0 or copy + 1 == scale:
+            print(f"Synthetic corpus: {count} PDFs written to {out_dir}")
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create the sample HR policy PDFs.")
+    parser.add_argument('--scale', type=int, default=0,
+                        help="Write a synthetic corpus with this many copies of every template instead (e.g. 10, 100, 1000).")
+    parser.add_argument('--out', default=None,
+                        help="Output folder (default: data/hr_policies, or data/bench/corpus_<scale>x with --scale).")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.scale:
+        generate_synthetic(args.scale, args.out or os.path.join("data", "bench", f"corpus_{args.scale}x"), seed=args.seed)
+    else:
+        generate_base(args.out or base_dir)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,28 +1,27 @@
 import argparse
 import chromadb
-from chromadb.utils import embedding_functions
-from sentence_transformers import SentenceTransformer
 import os
 import sys
 
 # Add src to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 from llm_client import get_llm
+from embeddings import get_embedding_function
 
 CHROMA_PATH = os.path.join(os.path.dirname(__file__), 'data', 'chroma_db')
-EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 
-class LocalEmbeddingFunction(chromadb.EmbeddingFunction):
-    def __init__(self, model_name):
-        self.model = SentenceTransformer(model_name)
+_collection = None
 
-    def __call__(self, input):
-        return self.model.encode(input).tolist()
+def get_collection():
+    # Open the client and collection once per process, not once per question
+    global _collection
+    if _collection is None:
+        client = chromadb.PersistentClient(path=CHROMA_PATH)
+        _collection = client.get_collection(name="hr_policies", embedding_function=get_embedding_function())
+    return _collection
 
 def retrieve_context(query, n_results=3):
-    client = chromadb.PersistentClient(path=CHROMA_PATH)
-    embedding_func = LocalEmbeddingFunction(EMBEDDING_MODEL_NAME)
-    collection = client.get_collection(name="hr_policies", embedding_function=embedding_func)
+    collection = get_collection()
     
     results = collection.query(
         query_texts=[query],
@@ -0,0 +1,6 @@
+@echo off
+echo Starting HR Agent API server...
+echo POST questions to http://127.0.0.1:8000/query
+echo.
+python src/server.py
+pause
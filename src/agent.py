@@ -1,11 +1,81 @@
-from llm_client import get_llm
-from tools import RAGTools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from llm_client import get_llm, ERROR_RESPONSE
+from tools import RAGTools, RAG_INTENT_CATEGORIES, NON_RAG_INTENTS, open_collection
+from embeddings import get_embedding_function
+from startup import StartupReport, WarmStart
+from answer_cache import AnswerCache, UNCACHEABLE_INTENTS
+from intent_classifier import EmbeddingIntentClassifier
+import tracing
+import os
 import re
+import time
+import threading
+import contextlib
+
+# Speculative retrieval: while the embedding/LLM classifier runs, fetch an
+# unfiltered top-N and narrow it to the chosen category afterwards
+SPECULATIVE_RETRIEVAL = os.environ.get('HR_SPECULATIVE_RETRIEVAL', '1') == '1'
+PREFETCH_K = int(os.environ.get('HR_PREFETCH_K', 20))
+RETRIEVAL_K = 3
+
+# A question that leans on the conversation ("what about interns?", "is it
+# paid?"): its answer depends on the history, so it bypasses the answer cache
+FOLLOW_UP_PATTERN = re.compile(
+    r"^(and|but|also|so|then|what about|how about|what if)\b"
+    r"|\b(it|its|that|this|those|these|they|them|their|he|she|his|her|same|above|previous|earlier|else)\b")
+FOLLOW_UP_MAX_WORDS = 3
+
+# Static head of the LLM classification prompt; only history and query vary
+CLASSIFY_PROMPT_PREFIX = """You are a classification model.
+Available categories:
+- leave_policy
+- reimbursement
+- onboarding
+- offboarding
+- performance
+- code_of_conduct
+- grievance_safety
+- salary_policy
+- compliance_policy
+- welfare_benefits
+- general_hr_info
+- chitchat
+- general_knowledge
+
+Task: Classify the Current Query into exactly one category.
+- If it's about common sense, facts, or logic (e.g. "Sky color", "Math"), choose 'general_knowledge'.
+- If it's general chat, choose 'chitchat'.
+- If it's HR/Company Policy, choose specific category.
+"""
 
 class HRAgent:
-    def __init__(self):
-        self.llm = get_llm()
-        self.tools = RAGTools()
+    def __init__(self, report=None):
+        # Independent startup phases load in parallel; each is timed in the report
+        self.startup_report = report or StartupReport()
+        timed = self.startup_report.timed
+        embedding_func = get_embedding_function()
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="startup") as pool:
+            llm = pool.submit(timed, 'llm_load', get_llm)
+            embedding_model = pool.submit(timed, 'embedding_model_load', lambda: embedding_func.model)
+            collection = pool.submit(timed, 'vector_store_open', open_collection, embedding_func)
+            answer_cache = pool.submit(timed, 'answer_cache_open', AnswerCache)
+            # Prototypes need the embedding model and the indexed chunks, not the LLM
+            classifier = pool.submit(timed, 'intent_classifier_build', self._build_classifier,
+                                     embedding_model, collection, embedding_func.service)
+
+            self.llm = llm.result()
+            self.tools = RAGTools(llm=self.llm, collection=collection.result())
+            self.answer_cache = answer_cache.result()
+            self.intent_classifier = classifier.result()
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+        self.prefetch_stats = {'started': 0, 'hits': 0, 'misses': 0}
+        self._prefetch_stats_lock = threading.Lock()
+        # Queries in progress and when the last one ended; background work
+        # (conversation summaries) waits for idle_seconds()
+        self._active_queries = 0
+        self._last_query_at = time.monotonic()
+        self._activity_lock = threading.Lock()
         self.categories = [
             "leave_policy",
             "reimbursement",
@@ -21,7 +91,41 @@ class HRAgent:
             "general_knowledge"
         ]
 
+    @staticmethod
+    def _build_classifier(embedding_model, collection, service):
+        embedding_model.result()
+        classifier = EmbeddingIntentClassifier(service, collection.result())
+        classifier.build()
+        return classifier
+
     def classify_intent(self, query, history=[]):
+        return self.classify_intent_with_path(query, history)[0]
+
+    def classify_intent_with_path(self, query, history=[]):
+        """
+        Returns (intent, path) where path names the stage that decided:
+        "rules" (regex/keywords), "embedding" (nearest prototype) or "llm".
+        """
+        with tracing.span('classify_rules'):
+            intent = self._rule_intent(query)
+        if intent:
+            return intent, "rules"
+
+        # 3. Embedding classifier; only low-confidence queries go on to the LLM
+        try:
+            with tracing.span('classify_embedding'):
+                intent, similarity, margin = self.intent_classifier.predict(self.tools.query_cache.get(query))
+        except Exception as e:
+            print(f"Embedding intent classifier failed: {e}")
+            intent = None
+        if intent:
+            print(f"Embedding classifier: {intent} (similarity {similarity:.2f}, margin {margin:.2f})")
+            return intent, "embedding"
+
+        with tracing.span('classify_llm'):
+            return self._llm_intent(query, history), "llm"
+
+    def _rule_intent(self, query):
         # 1. Regex Overrides for Greetings (Robust Chitchat)
         # Match greetings at start, or specific keywords anywhere
         chat_pattern = r"^(h+i+|h+e+y+a?|h+e+l+o+|good\s*(morning|evening|afternoon)|who\s+are\s+you|what\s+is\s+your\s+name|help)|(\b(thanks?|joke)\b)"
@@ -61,52 +165,39 @@ class HRAgent:
         if any(w in q_lower for w in ["apple", "sky", "sun", "moon", "president", "capital", "weather", "color", "pasta", "mars", "earth", "math", "history"]):
              return "general_knowledge"
 
-        # 3. Context-Aware Classification via LLM
+        return None
+
+    def _llm_intent(self, query, history=[]):
+        # 4. Context-Aware Classification via LLM
         context_str = ""
         if history:
-            last_turns = history[-2:] if len(history) >= 2 else history
+            # A leading system message is the ConversationMemory summary of older turns
+            summaries = [msg['content'] for msg in history if msg['role'] == 'system']
+            last_turns = [msg for msg in history if msg['role'] != 'system'][-2:]
             context_str = "\nConversation History:\n"
+            if summaries:
+                context_str += f"Summary: {summaries[-1][:200]}\n"
             for msg in last_turns:
                  role = "User" if msg['role'] == 'user' else "Assistant"
                  content = msg['content'][:100] # truncate
                  context_str += f"{role}: {content}\n"
         
         messages = [
-            {"role": "user", "content": f"""You are a classification model.
-Available categories:
-- leave_policy
-- reimbursement
-- onboarding
-- offboarding
-- performance
-- code_of_conduct
-- grievance_safety
-- salary_policy
-- compliance_policy
-- welfare_benefits
-- general_hr_info
-- chitchat
-- general_knowledge
-
-{context_str}
+            {"role": "user", "content": f"""{CLASSIFY_PROMPT_PREFIX}{context_str}
 Current Query: "{query}"
 
-Task: Classify the Current Query into exactly one category.
-- If it's about common sense, facts, or logic (e.g. "Sky color", "Math"), choose 'general_knowledge'.
-- If it's general chat, choose 'chitchat'.
-- If it's HR/Company Policy, choose specific category.
-
 Output ONLY the category name."""}
         ]
         
-        response = self.llm.chat(messages, max_tokens=20).strip().lower()
+        # The instructions are a fixed prefix, so their prefilled state is reused across queries
+        response = self.llm.chat(messages, max_tokens=20, prefix=CLASSIFY_PROMPT_PREFIX).strip().lower()
         
-        # 4. Response Matching
+        # 5. Response Matching
         for cat in self.categories + ["chitchat"]:
             if cat in response:
                 return cat
             
-        # 5. Fuzzy matching
+        # 6. Fuzzy matching
         if "leave" in response: return "leave_policy"
         if "claim" in response or "reimburse" in response: return "reimbursement"
         if "conduct" in response: return "code_of_conduct"
@@ -114,58 +205,254 @@ Output ONLY the category name."""}
         
         return "general_hr_info"
 
+    def _tool_for(self, intent):
+        tools = {
+            "leave_policy": self.tools.lookup_leave_policy,
+            "reimbursement": self.tools.generate_reimbursement_checklist,
+            "onboarding": self.tools.lookup_onboarding_steps,
+            "offboarding": self.tools.lookup_offboarding_policy,
+            "performance": self.tools.summarize_performance_guidelines,
+            "code_of_conduct": self.tools.extract_conduct_rule,
+            "grievance_safety": self.tools.grievance_and_safety_steps,
+            "salary_policy": self.tools.lookup_salary_policy,
+            "compliance_policy": self.tools.lookup_compliance_policy,
+            "welfare_benefits": self.tools.lookup_welfare_benefits,
+            "chitchat": self.tools.handle_chitchat,
+            "general_knowledge": self.tools.handle_general_knowledge,
+        }
+        return tools.get(intent, self.tools.generic_rag_answer)
+
+    def _check_cache(self, query, intent, history):
+        """
+        Returns (query_embedding, cached_hit) for cacheable intents, else (None, None).
+        Follow-ups ("what about interns?") depend on the conversation, which the
+        cache key does not capture, so they are neither looked up nor stored.
+        """
+        if intent in UNCACHEABLE_INTENTS or (history and self._is_follow_up(query)):
+            return None, None
+        # Semantic answer cache: same intent, near-identical question, same corpus version
+        with tracing.span('answer_cache_lookup'):
+            query_embedding = self.tools.query_cache.get(query)
+            cached = self.answer_cache.lookup(query_embedding, intent)
+        if cached:
+            print(f"Answer cache hit (similarity {cached['similarity']:.3f}): {cached['query']}")
+        return query_embedding, cached
+
+    @staticmethod
+    def _is_follow_up(query):
+        q_lower = query.lower().strip()
+        return len(q_lower.split()) <= FOLLOW_UP_MAX_WORDS or FOLLOW_UP_PATTERN.search(q_lower) is not None
+
+    def _store_answer(self, query, query_embedding, intent, answer, sources):
+        if query_embedding is not None and answer and answer != ERROR_RESPONSE:
+            self.answer_cache.put(query, query_embedding, intent, answer, sources)
+
+    def _classify_with_prefetch(self, query, history):
+        """
+        Classifies the query; when the cheap rules don't decide, an unfiltered
+        retrieval is started in parallel with the embedding/LLM classifier.
+        Returns (intent, intent_path, prefetch future or None).
+        """
+        with tracing.span('classify_rules'):
+            intent = self._rule_intent(query)
+        if intent:
+            return intent, "rules", None
+
+        prefetch = None
+        if SPECULATIVE_RETRIEVAL:
+            self._count_prefetch('started')
+            prefetch = self._prefetch_executor.submit(tracing.propagate(self._prefetch), query)
+        intent, intent_path = self.classify_intent_with_path(query, history)
+        return intent, intent_path, prefetch
+
+    def _count_prefetch(self, key):
+        # Queries from several server/load-test threads update the counters
+        with self._prefetch_stats_lock:
+            self.prefetch_stats[key] += 1
+
+    def _prefetch(self, query):
+        with tracing.span('prefetch'):
+            return self.tools.search_candidates([query], n=self.tools.candidate_count(PREFETCH_K))[0]
+
+    def _resolve_prefetch(self, query, prefetch, intent):
+        """Narrows prefetched hits to the intent's category; None means the tool must query itself."""
+        if prefetch is None or intent in NON_RAG_INTENTS:
+            return None
+        try:
+            with tracing.span('prefetch_wait'):
+                prefetched = prefetch.result()
+        except Exception as e:
+            print(f"Speculative retrieval failed: {e}")
+            return None
+        retrieved = self.tools.narrow_hits(query, prefetched, RAG_INTENT_CATEGORIES.get(intent), k=RETRIEVAL_K)
+        self._count_prefetch('hits' if retrieved else 'misses')
+        return retrieved
+
+    @contextlib.contextmanager
+    def _query_activity(self):
+        with self._activity_lock:
+            self._active_queries += 1
+        try:
+            yield
+        finally:
+            with self._activity_lock:
+                self._active_queries -= 1
+                self._last_query_at = time.monotonic()
+
+    def idle_seconds(self):
+        """Seconds since the last query finished; 0 while one is being handled."""
+        with self._activity_lock:
+            if self._active_queries:
+                return 0.0
+            return time.monotonic() - self._last_query_at
+
     def handle_query(self, query, history=[]):
+        # Stage timings and LLM token counts go to the trace file and metrics (see tracing.py)
+        with self._query_activity(), tracing.trace('handle_query', streaming=False):
+            return self._handle_query(query, history)
+
+    def _handle_query(self, query, history):
         print(f"Agent received query: {query}")
-        intent = self.classify_intent(query, history)
-        print(f"Detected Intent: {intent}")
-        
-        answer = ""
-        sources = []
-
-        if intent == "leave_policy":
-            answer, sources = self.tools.lookup_leave_policy(query, history)
-        elif intent == "reimbursement":
-            answer, sources = self.tools.generate_reimbursement_checklist(query, history)
-        elif intent == "onboarding":
-            answer, sources = self.tools.lookup_onboarding_steps(query, history)
-        elif intent == "offboarding":
-            answer, sources = self.tools.lookup_offboarding_policy(query, history)
-        elif intent == "performance":
-            answer, sources = self.tools.summarize_performance_guidelines(query, history)
-        elif intent == "code_of_conduct":
-            answer, sources = self.tools.extract_conduct_rule(query, history)
-        elif intent == "grievance_safety":
-            answer, sources = self.tools.grievance_and_safety_steps(query, history)
-        elif intent == "salary_policy":
-            answer, sources = self.tools.lookup_salary_policy(query, history)
-        elif intent == "compliance_policy":
-            answer, sources = self.tools.lookup_compliance_policy(query, history)
-        elif intent == "welfare_benefits":
-            answer, sources = self.tools.lookup_welfare_benefits(query, history)
-        elif intent == "chitchat":
-            answer, sources = self.tools.handle_chitchat(query, history)
-        elif intent == "general_knowledge":
-            answer, sources = self.tools.handle_general_knowledge(query, history)
-        else:
-            answer, sources = self.tools.generic_rag_answer(query, history)
+        intent, intent_path, prefetch = self._classify_with_prefetch(query, history)
+        print(f"Detected Intent: {intent} (via {intent_path})")
+        tracing.annotate(intent=intent, intent_path=intent_path, cached=False)
+
+        query_embedding, cached = self._check_cache(query, intent, history)
+        if cached:
+            tracing.annotate(cached=True)
+            return {
+                "intent": intent,
+                "intent_path": intent_path,
+                "answer": cached["answer"],
+                "sources": cached["sources"],
+                "cached": True
+            }
+
+        retrieved = self._resolve_prefetch(query, prefetch, intent)
+        with tracing.span('tool'):
+            answer, sources = self._tool_for(intent)(query, history, retrieved=retrieved)
+        self._store_answer(query, query_embedding, intent, answer, sources)
             
         return {
             "intent": intent,
+            "intent_path": intent_path,
             "answer": answer,
-            "sources": sources
+            "sources": sources,
+            "cached": False
         }
 
+    def handle_queries(self, queries, histories=None, k=3):
+        """
+        Batch counterpart of handle_query for offline evaluation / FAQ generation.
+
+        All queries are embedded in one batch, classified, checked against the
+        answer cache, retrieved with one collection.query per category, and
+        then generated concurrently (one at a time per model instance).
+        Returns one handle_query-style dict per query, in order; a failed query
+        gets intent "ERROR" and the error message as its answer.
+        """
+        with self._query_activity():
+            return self._handle_queries(queries, histories or [[] for _ in queries], k)
+
+    def _handle_queries(self, queries, histories, k):
+        results = [None] * len(queries)
+
+        # 1. One embedding batch; classification and cache lookups then hit the LRU
+        self.tools.query_cache.get_many(queries)
+        plans = []
+        for i, (query, history) in enumerate(zip(queries, histories)):
+            intent, intent_path = self.classify_intent_with_path(query, history)
+            query_embedding, cached = self._check_cache(query, intent, history)
+            if cached:
+                results[i] = {"intent": intent, "intent_path": intent_path, "answer": cached["answer"],
+                              "sources": cached["sources"], "cached": True}
+            else:
+                plans.append((i, intent, intent_path, query_embedding))
+        print(f"Batch: {len(queries)} queries, {len(queries) - len(plans)} answered from cache.")
+
+        # 2. Grouped retrieval: one collection.query per category
+        retrieved = {}
+        groups = defaultdict(list)
+        for i, intent, _, _ in plans:
+            if intent not in NON_RAG_INTENTS:
+                # Unknown intents fall through to generic_rag_answer (unfiltered)
+                groups[RAG_INTENT_CATEGORIES.get(intent)].append(i)
+        for category, indexes in groups.items():
+            for i, pair in zip(indexes, self.tools.retrieve_many([queries[i] for i in indexes], category=category, k=k)):
+                retrieved[i] = pair
+
+        # 3. Generation, scheduled across the available model instances
+        def generate(plan):
+            i, intent, intent_path, query_embedding = plan
+            try:
+                answer, sources = self._tool_for(intent)(queries[i], histories[i], retrieved=retrieved.get(i))
+                self._store_answer(queries[i], query_embedding, intent, answer, sources)
+                return i, {"intent": intent, "intent_path": intent_path, "answer": answer,
+                           "sources": sources, "cached": False}
+            except Exception as e:
+                return i, {"intent": "ERROR", "intent_path": intent_path, "answer": str(e),
+                           "sources": [], "cached": False}
+
+        with ThreadPoolExecutor(max_workers=max(1, getattr(self.llm, 'size', 1))) as executor:
+            for i, result in executor.map(generate, plans):
+                results[i] = result
+        return results
+
+    def handle_query_stream(self, query, history=[]):
+        """
+        Streaming counterpart of handle_query. Yields events:
+          {"type": "intent", "intent", "intent_path"}       once, before generation
+          {"type": "token", "text": ...}                    for each piece of the answer
+          {"type": "done", "intent", "intent_path", "answer", "sources", "cached"}   once, at the end
+        """
+        with self._query_activity():
+            yield from tracing.trace_stream('handle_query', self._handle_query_stream(query, history), streaming=True)
+
+    def _handle_query_stream(self, query, history):
+        started = time.perf_counter()
+        print(f"Agent received query (streaming): {query}")
+        intent, intent_path, prefetch = self._classify_with_prefetch(query, history)
+        print(f"Detected Intent: {intent} (via {intent_path})")
+        tracing.annotate(intent=intent, intent_path=intent_path, cached=False)
+        yield {"type": "intent", "intent": intent, "intent_path": intent_path}
+
+        query_embedding, cached = self._check_cache(query, intent, history)
+        if cached:
+            tracing.annotate(cached=True, ttft_s=round(time.perf_counter() - started, 4))
+            yield {"type": "token", "text": cached["answer"]}
+            yield {"type": "done", "intent": intent, "intent_path": intent_path, "answer": cached["answer"],
+                   "sources": cached["sources"], "cached": True}
+            return
+
+        retrieved = self._resolve_prefetch(query, prefetch, intent)
+        pieces = []
+        # Includes the time the caller spends between pieces
+        with tracing.span('tool'):
+            token_stream, sources = self._tool_for(intent)(query, history, stream=True, retrieved=retrieved)
+            for piece in token_stream:
+                if not pieces:
+                    tracing.annotate(ttft_s=round(time.perf_counter() - started, 4))
+                pieces.append(piece)
+                yield {"type": "token", "text": piece}
+
+        answer = "".join(pieces).strip()
+        self._store_answer(query, query_embedding, intent, answer, sources)
+        yield {"type": "done", "intent": intent, "intent_path": intent_path, "answer": answer,
+               "sources": sources, "cached": False}
+
 if __name__ == "__main__":
     import sys
-    
+    from conversation_memory import ConversationMemory
+
     print("\n------------------------------------------------")
     print("      Offline HR Policy Assistant (CLI)      ")
     print("------------------------------------------------")
     print("System initializing... Both Llama-3 and Vectors are loading...")
     
     try:
-        agent = HRAgent()
+        agent = WarmStart().start().wait()
         history = []
+        memory = ConversationMemory(agent.llm, idle_seconds=agent.idle_seconds)
         
         print("\n" + "="*50)
         print("🤖  OFFLINE HR ASSISTANT READY")
@@ -187,10 +474,15 @@ if __name__ == "__main__":
                     print("Goodbye!")
                     break
                     
-                result = agent.handle_query(q, history)
-                
-                print(f"\n>> Intent: {result['intent']}")
-                print(f"\n{result['answer']}\n")
+                result = None
+                for event in agent.handle_query_stream(q, memory.history(history)):
+                    if event["type"] == "intent":
+                        print(f"\n>> Intent: {event['intent']} (via {event['intent_path']})\n")
+                    elif event["type"] == "token":
+                        print(event["text"], end="", flush=True)
+                    else:
+                        result = event
+                print("\n")
                 if result['sources']:
                     print("--- Sources ---")
                     for s in result['sources']:
@@ -200,6 +492,8 @@ if __name__ == "__main__":
                 # Append to history
                 history.append({"role": "user", "content": q})
                 history.append({"role": "assistant", "content": result['answer']})
+                # Fold turns that left the verbatim window into the summary, in the background
+                memory.update(history)
                 
             except KeyboardInterrupt:
                 print("\nGoodbye!")
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+from vector_math import normalize
+
+# Config
+CACHE_DIR = os.environ.get('HR_CACHE_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'cache'))
+ANSWER_CACHE_PATH = os.path.join(CACHE_DIR, 'answer_cache.sqlite')
+CORPUS_VERSION_PATH = os.path.join(os.environ.get('HR_CHROMA_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'chroma_db')), 'corpus_version.txt')
+SIMILARITY_THRESHOLD = float(os.environ.get('HR_ANSWER_CACHE_THRESHOLD', 0.95))
+TTL_SECONDS = int(os.environ.get('HR_ANSWER_CACHE_TTL', 7 * 24 * 3600))
+MAX_ENTRIES = int(os.environ.get('HR_ANSWER_CACHE_MAX_ENTRIES', 5000))
+
+# Chitchat depends on the conversation, not on the policies; never replay it
+UNCACHEABLE_INTENTS = {"chitchat"}
+
+
+def write_corpus_version(manifest, path=CORPUS_VERSION_PATH):
+    """Called at the end of ingest: a stamp that changes whenever the indexed corpus does."""
+    stamp = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(stamp)
+    return stamp
+
+def read_corpus_version(path=CORPUS_VERSION_PATH):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip() or "unversioned"
+    except OSError:
+        return "unversioned"
+
+
+class AnswerCache:
+    """
+    Disk-backed (SQLite) cache of final answers, matched by query-embedding
+    similarity within the same intent. Entries written against an older
+    corpus version are dropped on the next lookup after a re-ingest.
+    """
+    def __init__(self, path=ANSWER_CACHE_PATH, threshold=SIMILARITY_THRESHOLD,
+                 ttl_seconds=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = {}  # intent -> (row ids, normalized embedding matrix)
+        self._version = None
+        self._version_mtime = None
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                intent TEXT NOT NULL,
+                query TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                corpus_version TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_intent ON answers (intent, corpus_version)")
+        self.conn.commit()
+
+    def _current_version(self):
+        # Re-read the stamp only when ingest has touched the file
+        try:
+            mtime = os.path.getmtime(CORPUS_VERSION_PATH)
+        except OSError:
+            mtime = None
+        if self._version is None or mtime != self._version_mtime:
+            version = read_corpus_version()
+            if self._version is not None and version != self._version:
+                print(f"Corpus changed ({self._version} -> {version}), invalidating answer cache.")
+            self._version, self._version_mtime = version, mtime
+            self.conn.execute("DELETE FROM answers WHERE corpus_version != ?", (version,))
+            self.conn.commit()
+            self._index.clear()
+        return self._version
+
+    def _load_intent(self, intent, version):
+        if intent not in self._index:
+            rows = self.conn.execute(
+                "SELECT id, embedding FROM answers WHERE intent = ? AND corpus_version = ?",
+                (intent, version)).fetchall()
+            ids = [row[0] for row in rows]
+            if rows:
+                matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            self._index[intent] = (ids, matrix)
+        return self._index[intent]
+
+    def lookup(self, query_embedding, intent):
+        """Returns {'answer', 'sources', 'query', 'similarity'} for the closest fresh entry, or None."""
+        if intent in UNCACHEABLE_INTENTS:
+            return None
+        with self._lock:
+            version = self._current_version()
+            ids, matrix = self._load_intent(intent, version)
+            if not ids:
+                self.misses += 1
+                return None
+
+            similarities = matrix @ normalize(query_embedding)
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            row = None
+            if similarity >= self.threshold:
+                row = self.conn.execute(
+                    "SELECT query, answer, sources, created_at FROM answers WHERE id = ?",
+                    (ids[best],)).fetchone()
+            now = time.time()
+            if row is None or now - row[3] > self.ttl_seconds:
+                self.misses += 1
+                return None
+
+            self.conn.execute("UPDATE answers SET last_used_at = ?, hit_count = hit_count + 1 WHERE id = ?",
+                              (now, ids[best]))
+            self.conn.commit()
+            self.hits += 1
+            return {'query': row[0], 'answer': row[1], 'sources': json.loads(row[2]), 'similarity': similarity}
+
+    def put(self, query, query_embedding, intent, answer, sources):
+        if intent in UNCACHEABLE_INTENTS:
+            return
+        now = time.time()
+        with self._lock:
+            version = self._current_version()
+            self.conn.execute(
+                "INSERT INTO answers (intent, query, embedding, answer, sources, corpus_version, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (intent, query, normalize(query_embedding).tobytes(), answer,
+                 json.dumps(sources), version, now, now))
+            self._evict(now)
+            self.conn.commit()
+            self._index.pop(intent, None)
+
+    def _evict(self, now):
+        expired = self.conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        # Least recently used beyond the size cap
+        overflow = self.conn.execute(
+            "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)).rowcount
+        if expired or overflow:
+            self._index.clear()
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM answers")
+            self.conn.commit()
+            self._index.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            size = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': size,
+                'max_entries': self.max_entries,
+                'corpus_version': self._version,
+            }
@@ -0,0 +1,113 @@
+import re
+
+# Sentence ends, blank lines, and line breaks that start a bullet or numbered item.
+# Plain line breaks are not boundaries: PDF extraction wraps sentences across lines.
+_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n+|\n(?=[ \t]*(?:[-*•]|\d+(?:\.\d+)*\.?[ \t]|[IVX]+\.[ \t]))")
+
+# Section headings: "2.1 Casual Leave", "IV. Compensation", "LEAVE POLICY 2024"
+_HEADING = re.compile(r"[ \t]*(?:\d+(?:\.\d+)*\.?|[IVX]+\.)[ \t]+\S|[ \t]*[A-Z][A-Z0-9 '&,/()-]{3,}$", re.M)
+
+# A numbering token that the sentence rule split off from its heading ("2." / "IV.")
+_ENUMERATOR = re.compile(r"(?:\d+(?:\.\d+)*\.?|[IVX]+\.)")
+
+# Don't start a new chunk at a heading until the current one is at least this full
+MIN_FILL_BEFORE_SECTION_BREAK = 0.5
+
+
+class TokenChunker:
+    """
+    Packs sentences into chunks that fit the embedding model's input window.
+
+    Length is measured with the model's own tokenizer, so no chunk is silently
+    truncated at embedding time. Chunks end at sentence boundaries, prefer to
+    start at section headings, and consecutive chunks within a section share up
+    to `overlap_tokens` tokens of whole trailing sentences.
+    """
+    def __init__(self, tokenizer, max_tokens=254, overlap_tokens=32):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def count_tokens(self, texts):
+        if not texts:
+            return []
+        encoded = self.tokenizer(texts, add_special_tokens=False)['input_ids']
+        return [len(ids) for ids in encoded]
+
+    def _units(self, text):
+        """Returns [(start, end, is_heading)] sentence-like spans with surrounding whitespace trimmed."""
+        units = []
+        pos = 0
+        carry_start = None
+        for match in list(_BOUNDARY.finditer(text)) + [None]:
+            end = match.start() if match else len(text)
+            segment = text[pos:end]
+            stripped = segment.strip()
+            if stripped:
+                start = pos + (len(segment) - len(segment.lstrip()))
+                if _ENUMERATOR.fullmatch(stripped) and match:
+                    # Glue "2." back onto "Types of Leave"
+                    carry_start = start if carry_start is None else carry_start
+                else:
+                    if carry_start is not None:
+                        start, carry_start = carry_start, None
+                    unit_end = start + len(text[start:end].strip())
+                    units.append((start, unit_end, bool(_HEADING.match(text[start:unit_end]))))
+            pos = match.end() if match else len(text)
+        return units
+
+    def _split_long(self, text, start, end):
+        """Cuts a single over-long sentence into token windows, returning spans."""
+        encoded = self.tokenizer(text[start:end], add_special_tokens=False, return_offsets_mapping=True)
+        offsets = encoded['offset_mapping']
+        step = self.max_tokens - self.overlap_tokens
+        spans = []
+        for i in range(0, len(offsets), step):
+            window = offsets[i:i + self.max_tokens]
+            spans.append((start + window[0][0], start + window[-1][1], len(window)))
+            if i + self.max_tokens >= len(offsets):
+                break
+        return spans
+
+    def split_spans(self, text):
+        """Returns [(start, end, token_count)] character spans of each chunk of `text`."""
+        units = self._units(text)
+        tokens = self.count_tokens([text[s:e] for s, e, _ in units])
+
+        spans = []
+        current = []  # indexes into units
+        current_tokens = 0
+
+        def flush():
+            if current:
+                spans.append((units[current[0]][0], units[current[-1]][1], current_tokens))
+
+        for i, (start, end, is_heading) in enumerate(units):
+            if tokens[i] > self.max_tokens:
+                flush()
+                spans.extend(self._split_long(text, start, end))
+                current, current_tokens = [], 0
+                continue
+
+            section_break = is_heading and current_tokens >= self.max_tokens * MIN_FILL_BEFORE_SECTION_BREAK
+            if current and (current_tokens + tokens[i] > self.max_tokens or section_break):
+                flush()
+                # Carry whole trailing sentences as overlap, but never across a section break
+                carried = []
+                carried_tokens = 0
+                if not section_break:
+                    for j in reversed(current[1:]):
+                        if carried_tokens + tokens[j] > self.overlap_tokens or carried_tokens + tokens[j] + tokens[i] > self.max_tokens:
+                            break
+                        carried.insert(0, j)
+                        carried_tokens += tokens[j]
+                current, current_tokens = carried, carried_tokens
+
+            current.append(i)
+            current_tokens += tokens[i]
+
+        flush()
+        return spans
+
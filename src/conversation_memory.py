@@ -0,0 +1,122 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from llm_client import ERROR_RESPONSE
+
+# Config
+# Messages passed verbatim to the prompt; older ones live only in the summary
+MEMORY_WINDOW = int(os.environ.get('HR_MEMORY_WINDOW', 2))
+# Fold once this many messages (3 exchanges) have left the window (batches LLM calls)
+FOLD_EVERY = int(os.environ.get('HR_MEMORY_FOLD_EVERY', 6))
+# A fold starts only after no query has run for this long, and gives the
+# model back (the summary is retried after the next answer) when one arrives
+FOLD_IDLE_SECONDS = float(os.environ.get('HR_MEMORY_FOLD_IDLE', 2.0))
+IDLE_POLL_SECONDS = 0.25
+SUMMARY_MAX_TOKENS = 120
+# Per-message characters fed to the summarizer
+FOLD_MESSAGE_CHARS = 600
+
+# Static head of the summarizer prompt, so its prefilled state is reused
+SUMMARIZE_PROMPT_PREFIX = """You maintain a running summary of a conversation between an employee and an HR assistant.
+Merge the new messages into the summary. Keep the employee's situation, the topics asked about and any facts or numbers the assistant gave.
+Write at most 4 short sentences. Output ONLY the updated summary.
+"""
+
+# One background summarizer for every session: folds run one at a time, after answers
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-fold")
+
+
+class ConversationMemory:
+    """
+    Per-session chat memory: a rolling LLM-written summary of older turns plus
+    the last few messages verbatim.
+
+    history() returns the list to pass to HRAgent: a leading
+    {"role": "system"} summary message (when there is one), then every
+    message the summary does not cover yet, which is at least the window.
+    update() is called after each answer and folds messages that left the
+    window into the summary on a background thread, so the summary never
+    delays the answer being shown. idle_seconds (HRAgent.idle_seconds)
+    keeps folds off the model while queries are being answered.
+    """
+    def __init__(self, llm, window=MEMORY_WINDOW, fold_every=FOLD_EVERY, idle_seconds=None):
+        self.llm = llm
+        self.window = window
+        self.fold_every = fold_every
+        self.idle_seconds = idle_seconds
+        self.summary = ""
+        self.summarized = 0  # messages already folded into the summary
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def history(self, messages):
+        messages = [m for m in messages if m['role'] != 'system']
+        with self._lock:
+            summary, summarized = self.summary, self.summarized
+        # Messages that left the window but are not folded yet stay verbatim
+        recent = messages[min(summarized, max(0, len(messages) - self.window)):]
+        if summary:
+            return [{"role": "system", "content": summary}] + recent
+        return recent
+
+    def update(self, messages):
+        """Schedules a fold of messages that left the verbatim window; returns immediately."""
+        messages = [m for m in messages if m['role'] != 'system']
+        with self._lock:
+            if len(messages) - self.window - self.summarized < self.fold_every:
+                return None
+            if self._pending is not None and not self._pending.done():
+                return self._pending
+            self._pending = _executor.submit(self._fold, messages)
+            return self._pending
+
+    def _fold(self, messages):
+        upto = len(messages) - self.window
+        with self._lock:
+            start, summary = self.summarized, self.summary
+        if upto <= start:
+            return summary
+
+        transcript = "\n".join(
+            f"{'Employee' if m['role'] == 'user' else 'Assistant'}: {m['content'][:FOLD_MESSAGE_CHARS]}"
+            for m in messages[start:upto])
+        prompt = (f"{SUMMARIZE_PROMPT_PREFIX}\nCurrent summary: {summary or '(empty)'}\n\n"
+                  f"New messages:\n{transcript}\n\nUpdated summary:")
+        self._wait_for_idle()
+        pieces = []
+        stream = None
+        try:
+            stream = self.llm.chat_stream([{"role": "user", "content": prompt}], max_tokens=SUMMARY_MAX_TOKENS,
+                                          temperature=0.0, prefix=SUMMARIZE_PROMPT_PREFIX)
+            for piece in stream:
+                if self.idle_seconds is not None and self.idle_seconds() == 0:
+                    # A query arrived: stop decoding so it gets the model
+                    print("Conversation summary update deferred: a query is waiting.")
+                    return summary
+                pieces.append(piece)
+        except Exception as e:
+            print(f"Conversation summary update failed: {e}")
+            return summary
+        finally:
+            if stream is not None:
+                stream.close()
+        updated = "".join(pieces).strip()
+
+        with self._lock:
+            if updated and updated != ERROR_RESPONSE and self.summarized == start:
+                self.summary, self.summarized = updated, upto
+            return self.summary
+
+    def _wait_for_idle(self):
+        while self.idle_seconds is not None:
+            idle = self.idle_seconds()
+            if idle >= FOLD_IDLE_SECONDS:
+                return
+            time.sleep(max(IDLE_POLL_SECONDS, FOLD_IDLE_SECONDS - idle))
+
+    def wait(self, timeout=None):
+        """Blocks until a pending fold is finished (CLI exit, tests)."""
+        pending = self._pending
+        if pending is not None:
+            pending.result(timeout)
@@ -0,0 +1,90 @@
+import numpy as np
+
+from vector_math import normalize
+
+# Relevance vs novelty trade-off for maximal marginal relevance (1.0 = pure relevance)
+MMR_LAMBDA = 0.7
+# Candidates this similar to an already selected chunk are dropped outright
+# (the same text indexed twice, e.g. a policy copied into another category)
+DUPLICATE_SIMILARITY = 0.95
+
+
+def mmr_order(query_embedding, embeddings, lambda_mult=MMR_LAMBDA, duplicate_similarity=DUPLICATE_SIMILARITY):
+    """
+    Orders candidates by maximal marginal relevance and yields their positions.
+    Near-duplicates of an already yielded candidate are skipped. A generator,
+    so callers can stop once they have enough distinct chunks.
+    """
+    if len(embeddings) == 0:
+        return
+    vectors = normalize(embeddings)
+    relevance = vectors @ normalize(query_embedding)
+    redundancy = np.full(len(vectors), -np.inf)
+    remaining = set(range(len(vectors)))
+    while remaining:
+        candidates = sorted(remaining)
+        novelty = np.where(np.isinf(redundancy[candidates]), 0.0, redundancy[candidates])
+        scores = lambda_mult * relevance[candidates] - (1 - lambda_mult) * novelty
+        best = candidates[int(np.argmax(scores))]
+        remaining.discard(best)
+        similarity = vectors @ vectors[best]
+        redundancy = np.maximum(redundancy, similarity)
+        for i in list(remaining):
+            if similarity[i] >= duplicate_similarity:
+                remaining.discard(i)
+        yield best
+
+
+def _adjacent(a, b):
+    return (a.get('filepath') == b.get('filepath')
+            and a.get('chunk_index') is not None and b.get('chunk_index') == a['chunk_index'] + 1
+            and a.get('char_end') is not None and b.get('char_start') is not None)
+
+
+def _join(first, second):
+    """
+    Merges two consecutive chunks of one file, dropping the overlapping
+    characters. Chunks that don't overlap (section breaks) were separated by
+    whitespace the chunker left out, so they are joined with a newline.
+    """
+    (text_a, meta_a), (text_b, meta_b) = first, second
+    overlap = max(0, meta_a['char_end'] - meta_b['char_start'])
+    separator = "\n" if meta_b['char_start'] > meta_a['char_end'] else ""
+    meta = dict(meta_a)
+    meta['chunk_index'] = meta_b['chunk_index']
+    meta['char_end'] = meta_b['char_end']
+    meta['page_end'] = meta_b.get('page_end', meta_a.get('page_end'))
+    meta['token_count'] = meta_a.get('token_count', 0) + meta_b.get('token_count', 0)
+    meta['first_chunk_index'] = meta_a.get('first_chunk_index', meta_a['chunk_index'])
+    return text_a + separator + text_b[overlap:], meta
+
+
+def merge_adjacent(hits):
+    """
+    Merges selected chunks that are neighbours in the same file into one
+    passage, so the overlap between them is sent to the LLM once. Hits are
+    grouped by file and sorted by chunk index, and each run of consecutive
+    chunks becomes one passage, whatever order they were selected in. A
+    passage keeps the rank of its best-placed piece.
+    """
+    passages = []  # (rank, document, metadata)
+    by_file = {}
+    for rank, (doc, meta) in enumerate(hits):
+        if meta.get('filepath') is None or meta.get('chunk_index') is None:
+            passages.append((rank, doc, dict(meta)))
+        else:
+            by_file.setdefault(meta['filepath'], {}).setdefault(meta['chunk_index'], (rank, doc, meta))
+    for chunks in by_file.values():
+        run = None
+        previous = None
+        for index in sorted(chunks):
+            rank, doc, meta = chunks[index]
+            if run is not None and _adjacent(previous, meta):
+                run = (min(run[0], rank),) + _join(run[1:], (doc, meta))
+            else:
+                if run is not None:
+                    passages.append(run)
+                run = (rank, doc, dict(meta))
+            previous = meta
+        passages.append(run)
+    return [(doc, meta) for _, doc, meta in sorted(passages, key=lambda passage: passage[0])]
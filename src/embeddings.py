@@ -0,0 +1,195 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+import chromadb
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+ENCODE_BATCH_SIZE = 64
+QUERY_CACHE_SIZE = 1024
+# 'torch' (SentenceTransformer, fp32) or 'onnx' (int8 ONNX Runtime export, see onnx_embedder.py).
+# Use the same backend for ingest and queries, or check `onnx_embedder.py parity` first.
+EMBEDDING_BACKEND = os.environ.get('HR_EMBEDDING_BACKEND', 'torch')
+
+
+class EmbeddingService:
+    """
+    One SentenceTransformer per process, loaded on first use.
+    Shared by ingestion, RAGTools and rag_qa so the model is only loaded once.
+    """
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, backend=EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    if self.backend == 'onnx':
+                        self._model = self._load_onnx()
+                    if self._model is None:
+                        from sentence_transformers import SentenceTransformer
+                        print(f"Loading embedding model {self.model_name}...")
+                        self._model = SentenceTransformer(self.model_name)
+                        self.backend = 'torch'
+        return self._model
+
+    @property
+    def effective_backend(self):
+        """The backend vectors actually come from; ONNX may fall back to torch, so that needs a load."""
+        if self.backend != 'torch':
+            self.model
+        return self.backend
+
+    def _load_onnx(self):
+        try:
+            from onnx_embedder import OnnxEmbeddingModel
+            model = OnnxEmbeddingModel()
+            print(f"Loaded embedding model {self.model_name} (ONNX int8: {model.path}).")
+            return model
+        except Exception as e:
+            print(f"ONNX embedder unavailable ({e}); using SentenceTransformer.")
+            return None
+
+    @property
+    def tokenizer(self):
+        return self.model.tokenizer
+
+    @property
+    def max_seq_length(self):
+        return self.model.max_seq_length
+
+    def encode_batch(self, texts, batch_size=ENCODE_BATCH_SIZE):
+        """Embeds a list of texts, returning one list of floats per text."""
+        if not texts:
+            return []
+        return self.model.encode(list(texts), batch_size=batch_size).tolist()
+
+    def encode(self, text):
+        return self.encode_batch([text])[0]
+
+
+class LocalEmbeddingFunction(chromadb.EmbeddingFunction):
+    """Chroma adapter over the shared EmbeddingService."""
+    def __init__(self, service=None):
+        self.service = service or get_embedding_service()
+
+    @property
+    def model(self):
+        return self.service.model
+
+    def __call__(self, input):
+        return self.service.encode_batch(input)
+
+
+def normalize_query(text):
+    # "Notice period?" / "notice  period" share one cache entry
+    return re.sub(r"\s+", " ", text.lower()).strip().rstrip("?!. ")
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU of query vectors keyed by normalized query text. Concurrent
+    misses on one key are single-flight: the first caller embeds, the others
+    wait for its vector (e.g. speculative retrieval and the intent classifier
+    asking for the same fresh query at once).
+    """
+    def __init__(self, service=None, maxsize=QUERY_CACHE_SIZE):
+        self.service = service or get_embedding_service()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._pending = {}  # key -> Event set once the embedding is stored
+        self._lock = threading.Lock()
+
+    def _claim(self, keys):
+        """Under the lock: splits keys into {key: vector} hits, keys to embed, and Events to wait for."""
+        found, owned, waiting = {}, [], {}
+        for key in keys:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                found[key] = self._cache[key]
+            elif key in self._pending:
+                self.hits += 1
+                waiting[key] = self._pending[key]
+            else:
+                self.misses += 1
+                self._pending[key] = threading.Event()
+                owned.append(key)
+        return found, owned, waiting
+
+    def _store(self, keys, vectors):
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._cache[key] = vector
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def _release(self, keys):
+        with self._lock:
+            for key in keys:
+                event = self._pending.pop(key, None)
+                if event is not None:
+                    event.set()
+
+    def _resolve(self, key, event, query):
+        """Vector another caller is embedding; embeds itself if that caller failed or it was evicted."""
+        event.wait()
+        with self._lock:
+            vector = self._cache.get(key)
+        return vector if vector is not None else self.service.encode(query)
+
+    def get(self, query):
+        return self.get_many([query])[0]
+
+    def get_many(self, queries):
+        """Like get() for a list, embedding all misses in one batch."""
+        keys = [normalize_query(query) for query in queries]
+        first = {}
+        for i, key in enumerate(keys):
+            first.setdefault(key, i)
+        with self._lock:
+            found, owned, waiting = self._claim(list(first))
+
+        if owned:
+            try:
+                encoded = self.service.encode_batch([queries[first[key]] for key in owned])
+                self._store(owned, encoded)
+                found.update(zip(owned, encoded))
+            finally:
+                self._release(owned)
+        for key, event in waiting.items():
+            found[key] = self._resolve(key, event, queries[first[key]])
+        return [found[key] for key in keys]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+_service_instance = None
+_service_lock = threading.Lock()
+
+def get_embedding_service():
+    global _service_instance
+    if _service_instance is None:
+        with _service_lock:
+            if _service_instance is None:
+                _service_instance = EmbeddingService()
+    return _service_instance
+
+def get_embedding_function():
+    return LocalEmbeddingFunction(get_embedding_service())
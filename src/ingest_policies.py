@@ -1,106 +1,397 @@
 import os
+import sys
+import json
+import hashlib
+import bisect
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import chromadb
-from chromadb.utils import embedding_functions
-from sentence_transformers import SentenceTransformer
 from pypdf import PdfReader
-import uuid
+from chunker import TokenChunker
+from embeddings import EMBEDDING_MODEL_NAME, get_embedding_function
+from answer_cache import write_corpus_version
+from lexical_index import LEXICAL_INDEX_PATH, BM25Index
+from vector_index import VECTOR_INDEX_DIR, NumpyVectorIndex, write_vector_index, update_vector_index, vector_index_rows
 
 # Configuration
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'hr_policies')
-CHROMA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'chroma_db')
-EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+DATA_DIR = os.environ.get('HR_POLICY_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'hr_policies'))
+CHROMA_PATH = os.environ.get('HR_CHROMA_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'chroma_db'))
+MANIFEST_PATH = os.path.join(CHROMA_PATH, 'ingest_manifest.json')
+# Chunk length in embedding-model tokens; all-MiniLM-L6-v2 reads at most 256
+# word-pieces including [CLS]/[SEP], so anything longer is truncated when embedded
+CHUNK_TOKENS = 254
+CHUNK_OVERLAP_TOKENS = 32
+# Bump when the stored chunk metadata changes shape so old indexes get rebuilt
+INDEX_SCHEMA_VERSION = 5
+# PDF extraction is CPU bound; fan it out over processes (1 = run inline)
+EXTRACT_WORKERS = int(os.environ.get('HR_INGEST_WORKERS', os.cpu_count() or 1))
+# Chunks embedded and written to Chroma per call; bounds peak memory
+BATCH_SIZE = int(os.environ.get('HR_INGEST_BATCH_SIZE', 64))
 
-class LocalEmbeddingFunction(chromadb.EmbeddingFunction):
-    def __init__(self, model_name):
-        self.model = SentenceTransformer(model_name)
-
-    def __call__(self, input):
-        return self.model.encode(input).tolist()
-
-def load_documents(data_dir):
-    documents = []
-    print(f"Scanning {data_dir}...")
+def scan_pdfs(data_dir):
+    """Returns {relative_path: (filepath, category)} for every PDF under data_dir."""
+    pdfs = {}
     for root, dirs, files in os.walk(data_dir):
         for file in files:
             if file.endswith('.pdf'):
-                category = os.path.basename(root)
                 filepath = os.path.join(root, file)
-                print(f"Processing: {filepath} (Category: {category})")
-                
-                try:
-                    reader = PdfReader(filepath)
-                    text = ""
-                    for page in reader.pages:
-                        text += page.extract_text() + "\n"
-                    
-                    documents.append({
-                        'text': text,
-                        'metadata': {
-                            'source': file,
-                            'category': category,
-                            'filepath': filepath
-                        }
-                    })
-                except Exception as e:
-                    print(f"Error reading {file}: {e}")
-    return documents
-
-def split_text(text, chunk_size=1000, overlap=200):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start += (chunk_size - overlap)
-    return chunks
-
-def main():
+                rel_path = os.path.relpath(filepath, data_dir).replace(os.sep, '/')
+                pdfs[rel_path] = (filepath, os.path.basename(root))
+    return pdfs
+
+def file_hash(filepath):
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def extract_pages(filepath):
+    """Returns the text of every page, in order. Runs inside the extraction pool."""
+    reader = PdfReader(filepath)
+    return [page.extract_text() or "" for page in reader.pages]
+
+def load_document(filepath, category):
+    pages = extract_pages(filepath)
+
+    # Join once instead of `text += ...` per page (quadratic on long PDFs),
+    # remembering where each page starts so chunks can be mapped back to pages
+    page_starts = []
+    offset = 0
+    for page_text in pages:
+        page_starts.append(offset)
+        offset += len(page_text) + 1
+    text = "\n".join(pages) + "\n" if pages else ""
+
+    return {
+        'text': text,
+        'page_starts': page_starts,
+        'metadata': {
+            'source': os.path.basename(filepath),
+            'category': category,
+            'filepath': filepath,
+            'page_count': len(pages)
+        }
+    }
+
+def _load_document_safe(args):
+    rel_path, filepath, category = args
+    try:
+        return rel_path, load_document(filepath, category), None
+    except Exception as e:
+        return rel_path, None, e
+
+def iter_documents(items, workers=EXTRACT_WORKERS, max_pending=None):
+    """
+    Extracts documents in parallel over a process pool.
+    items: iterable of (rel_path, filepath, category)
+    Yields (rel_path, doc, error) in input order; exactly one of doc/error is set.
+
+    At most `max_pending` documents are in flight (queued, extracting or waiting
+    to be consumed), so a slow consumer throttles extraction instead of letting
+    extracted text pile up in memory.
+    """
+    if workers <= 1:
+        for item in items:
+            yield _load_document_safe(item)
+        return
+
+    max_pending = max_pending or workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(_load_document_safe, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def page_range(page_starts, start, end):
+    """Maps a [start, end) character span of a document to 1-based (first_page, last_page)."""
+    if not page_starts:
+        return 1, 1
+    first = bisect.bisect_right(page_starts, start)
+    last = bisect.bisect_right(page_starts, max(start, end - 1))
+    return first, last
+
+def get_chunker(service):
+    # Never exceed what the model actually reads (max_seq_length includes [CLS]/[SEP])
+    max_tokens = min(CHUNK_TOKENS, service.max_seq_length - 2)
+    return TokenChunker(service.tokenizer, max_tokens=max_tokens, overlap_tokens=CHUNK_OVERLAP_TOKENS)
+
+def chunker_settings(embedding_backend):
+    # Any change here invalidates every manifest entry and forces a full re-index
+    return {
+        'schema': INDEX_SCHEMA_VERSION,
+        'embedding_model': EMBEDDING_MODEL_NAME,
+        # The backend that actually embedded the chunks (EmbeddingService.effective_backend);
+        # int8 ONNX vectors are close to, not equal to, the fp32 ones
+        'embedding_backend': embedding_backend,
+        'chunker': 'sentence-token',
+        'chunk_tokens': CHUNK_TOKENS,
+        'chunk_overlap_tokens': CHUNK_OVERLAP_TOKENS,
+    }
+
+def chunk_id(rel_path, index):
+    # Deterministic: re-ingesting the same file overwrites instead of duplicating
+    return f"{rel_path}#{index}"
+
+def chunk_ids(rel_path, chunk_count):
+    return [chunk_id(rel_path, i) for i in range(chunk_count)]
+
+def iter_chunks(documents, chunker):
+    """
+    Turns a stream of (rel_path, doc, error) into a stream of chunk records.
+    Every document ends with a record whose 'text' is None marking it complete,
+    so files with no extractable text are still tracked in the manifest.
+    """
+    for rel_path, doc, error in documents:
+        if error is not None:
+            print(f"Error reading {rel_path}: {error}")
+            continue
+
+        count = 0
+        for i, (start, end, token_count) in enumerate(chunker.split_spans(doc['text'])):
+            # Add chunk index, token count, character and page span to metadata
+            meta = doc['metadata'].copy()
+            meta['chunk_index'] = i
+            meta['token_count'] = token_count
+            meta['char_start'], meta['char_end'] = start, end
+            meta['page_start'], meta['page_end'] = page_range(doc['page_starts'], start, end)
+            yield {'rel_path': rel_path, 'id': chunk_id(rel_path, i), 'text': doc['text'][start:end], 'metadata': meta}
+            count += 1
+        yield {'rel_path': rel_path, 'id': None, 'text': None, 'chunk_count': count,
+               'page_count': doc['metadata']['page_count']}
+
+def batched(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class IngestProgress:
+    """Prints running totals and throughput at most every `interval` seconds."""
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.started = time.time()
+        self.last_report = 0.0
+        self.files = 0
+        self.pages = 0
+        self.chunks = 0
+        self.tokens = 0
+
+    def update(self, chunks=0, tokens=0, files=0, pages=0):
+        self.chunks += chunks
+        self.tokens += tokens
+        self.files += files
+        self.pages += pages
+        if time.time() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self, final=False):
+        self.last_report = time.time()
+        elapsed = max(self.last_report - self.started, 1e-6)
+        label = "Done" if final else "Progress"
+        avg_tokens = self.tokens / self.chunks if self.chunks else 0
+        print(f"{label}: {self.files} files, {self.pages} pages, {self.chunks} chunks, {self.tokens} tokens "
+              f"(avg {avg_tokens:.0f} tokens/chunk) in {elapsed:.1f}s "
+              f"({self.chunks / elapsed:.1f} chunks/s, {self.pages / elapsed:.1f} pages/s)")
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {'settings': None, 'files': {}}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {path}: {e}")
+        return {'settings': None, 'files': {}}
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def plan_ingest(pdfs, manifest, settings, full=False):
+    """
+    Compares the PDFs on disk with the manifest.
+    Returns (rebuild, to_index, to_remove, hashes):
+    - rebuild: the collection must be dropped (forced, no manifest yet, or chunker settings changed)
+    - to_index: relative paths that are new or changed
+    - to_remove: relative paths whose old chunks must be deleted (removed or changed files)
+    """
+    known = manifest.get('files', {})
+    hashes = {rel_path: file_hash(filepath) for rel_path, (filepath, _) in pdfs.items()}
+
+    if full or manifest.get('settings') != settings:
+        return True, sorted(pdfs), [], hashes
+
+    to_index = [p for p in sorted(pdfs) if known.get(p, {}).get('sha256') != hashes[p]]
+    to_remove = [p for p in sorted(known) if p not in pdfs or p in to_index]
+    return False, to_index, to_remove, hashes
+
+def iter_collection(collection, ids=None, page_size=1000):
+    """Chunks of the collection (all, or just `ids`) as (ids, embeddings, documents, metadatas) pages."""
+    include = ["documents", "metadatas", "embeddings"]
+    if ids is not None:
+        pages = (collection.get(ids=id_batch, include=include) for id_batch in batched(ids, page_size))
+    else:
+        pages = (collection.get(include=include, limit=page_size, offset=offset)
+                 for offset in range(0, collection.count(), page_size))
+    for page in pages:
+        if page['ids']:
+            yield (page['ids'], page['embeddings'], [text or "" for text in page['documents']],
+                   [meta or {} for meta in page['metadatas']])
+
+def _index_lexical(lexical, pages):
+    """Adds each page to the BM25 index on its way to the vector index writer."""
+    for page in pages:
+        ids, _, documents, metadatas = page
+        lexical.add((chunk_id, text, meta.get('category')) for chunk_id, text, meta in zip(ids, documents, metadatas))
+        yield page
+
+def write_side_indexes(collection, removed_ids=None, added_ids=None):
+    """
+    Brings the files served next to Chroma (the BM25 inverted index and the
+    memory-mapped vector index) in line with the collection. With
+    removed_ids/added_ids only those chunks are dropped and read back;
+    otherwise, or when the update does not match the collection, both are
+    rebuilt page by page.
+    """
+    start = time.time()
+    rows = collection.count()
+    if added_ids is not None and os.path.exists(LEXICAL_INDEX_PATH) and NumpyVectorIndex.exists(VECTOR_INDEX_DIR):
+        try:
+            lexical = BM25Index.load(LEXICAL_INDEX_PATH)
+            lexical.remove(removed_ids or [])
+            update_vector_index(_index_lexical(lexical, iter_collection(collection, added_ids)),
+                                len(added_ids), removed_ids or [])
+            if len(lexical) != rows or vector_index_rows(VECTOR_INDEX_DIR) != rows:
+                raise ValueError(f"side indexes hold {len(lexical)} chunks, the collection {rows}")
+            lexical.save(LEXICAL_INDEX_PATH)
+            print(f"BM25/vector indexes updated: -{len(removed_ids or [])} +{len(added_ids)} chunks, "
+                  f"{len(lexical)} total ({time.time() - start:.1f}s).")
+            return
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Rebuilding side indexes ({e}).")
+
+    lexical = BM25Index.build(())
+    vector_bytes = write_vector_index(_index_lexical(lexical, iter_collection(collection)), rows)
+    lexical.save(LEXICAL_INDEX_PATH)
+    print(f"BM25 index: {len(lexical)} chunks, {len(lexical.postings)} terms; "
+          f"vector index: {vector_bytes / 1e6:.1f} MB ({time.time() - start:.1f}s).")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index HR policy PDFs into ChromaDB.")
+    parser.add_argument('--full', action='store_true',
+                        help="Drop the manifest and re-index every PDF.")
+    parser.add_argument('--workers', type=int, default=EXTRACT_WORKERS,
+                        help=f"PDF extraction processes (default: {EXTRACT_WORKERS}).")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f"Chunks embedded and added per batch (default: {BATCH_SIZE}).")
+    args = parser.parse_args(argv)
+
     # 1. Setup ChromaDB
     print("Initializing ChromaDB...")
     client = chromadb.PersistentClient(path=CHROMA_PATH)
-    
-    # Use SentenceTransformer for embeddings
-    embedding_func = LocalEmbeddingFunction(EMBEDDING_MODEL_NAME)
-    
+
+    # Shared embedding model; only loaded up front if ONNX was asked for and may fall back
+    embedding_func = get_embedding_function()
+    settings = chunker_settings(embedding_func.service.effective_backend)
+
+    # 2. Work out what changed since the last run
+    pdfs = scan_pdfs(DATA_DIR)
+    manifest = load_manifest()
+    rebuild, to_index, to_remove, hashes = plan_ingest(pdfs, manifest, settings, full=args.full)
+    if rebuild:
+        print(f"Full re-index of {len(pdfs)} PDFs (forced, first run, or chunker settings changed).")
+    else:
+        print(f"Found {len(pdfs)} PDFs: {len(to_index)} new/changed, "
+              f"{len([p for p in to_remove if p not in pdfs])} removed.")
+
+    if not rebuild and not to_index and not to_remove:
+        print("Index is up to date.")
+        collection = client.get_collection(name="hr_policies")
+        # Missing, or left behind by an interrupted run
+        if not os.path.exists(LEXICAL_INDEX_PATH) or vector_index_rows(VECTOR_INDEX_DIR) != collection.count():
+            write_side_indexes(collection)
+        return
+
+    if rebuild:
+        # Also clears chunks left behind by older, non-deterministic ingests
+        try:
+            client.delete_collection(name="hr_policies")
+        except Exception:
+            pass
+        files = {}
+    else:
+        files = dict(manifest.get('files', {}))
+
     # Get or create collection
     collection = client.get_or_create_collection(
         name="hr_policies",
         embedding_function=embedding_func
     )
 
-    # 2. Load and Chunk Documents
-    docs = load_documents(DATA_DIR)
-    
-    ids = []
-    documents = []
-    metadatas = []
-    
-    print("Chunking and Indexing...")
-    for doc in docs:
-        chunks = split_text(doc['text'])
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{doc['metadata']['source']}_{i}_{str(uuid.uuid4())[:8]}"
-            
-            ids.append(chunk_id)
-            documents.append(chunk)
-            # Add chunk index to metadata
-            meta = doc['metadata'].copy()
-            meta['chunk_index'] = i
-            metadatas.append(meta)
-
-    # 3. Add to Chroma
-    if documents:
-        # Chroma handles batching, but let's do it if it's huge. 
-        # For this scale, it's fine.
-        collection.add(
-            ids=ids,
-            documents=documents,
-            metadatas=metadatas
-        )
-        print(f"Successfully added {len(documents)} chunks to the database.")
+    # 3. Delete chunks for removed or changed files
+    removed_ids = []
+    for rel_path in to_remove:
+        old_ids = chunk_ids(rel_path, files.pop(rel_path, {}).get('chunk_count', 0))
+        removed_ids.extend(old_ids)
+        for id_batch in batched(old_ids, args.batch_size):
+            collection.delete(ids=id_batch)
+    if to_remove:
+        print(f"Removed stale chunks for {len(to_remove)} files.")
+
+    # 4. Stream new/changed documents: extract -> chunk -> embed -> add, one batch at a time
+    print(f"Chunking and Indexing (batch size {args.batch_size}, {args.workers} extraction workers)...")
+    items = ((rel_path, pdfs[rel_path][0], pdfs[rel_path][1]) for rel_path in to_index)
+    chunker = get_chunker(embedding_func.service)
+    records = iter_chunks(iter_documents(items, args.workers), chunker)
+    progress = IngestProgress()
+
+    for batch in batched(records, args.batch_size):
+        chunks = [r for r in batch if r['text'] is not None]
+        if chunks:
+            texts = [r['text'] for r in chunks]
+            collection.upsert(
+                ids=[r['id'] for r in chunks],
+                embeddings=embedding_func(texts),
+                documents=texts,
+                metadatas=[r['metadata'] for r in chunks]
+            )
+
+        # A file is only recorded once its last chunk is in the collection,
+        # so an interrupted run resumes where it stopped
+        done = [r for r in batch if r['text'] is None]
+        for r in done:
+            files[r['rel_path']] = {'sha256': hashes[r['rel_path']], 'chunk_count': r['chunk_count']}
+        if done:
+            save_manifest({'settings': settings, 'files': files})
+
+        progress.update(chunks=len(chunks), tokens=sum(r['metadata']['token_count'] for r in chunks),
+                        files=len(done), pages=sum(r['page_count'] for r in done))
+
+    manifest = {'settings': settings, 'files': files}
+    save_manifest(manifest)
+    if rebuild:
+        write_side_indexes(collection)
     else:
-        print("No documents found to ingest.")
+        # Only the chunks of changed files are read back from the collection
+        added_ids = [cid for rel_path in to_index if rel_path in files
+                     for cid in chunk_ids(rel_path, files[rel_path]['chunk_count'])]
+        write_side_indexes(collection, removed_ids, added_ids)
+    # New stamp invalidates answers cached against the previous corpus
+    print(f"Corpus version: {write_corpus_version(manifest)}")
+    progress.report(final=True)
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
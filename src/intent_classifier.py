@@ -0,0 +1,150 @@
+import os
+import numpy as np
+
+from tools import RAG_INTENT_CATEGORIES
+from vector_math import normalize
+
+# Below either threshold the embedding classifier abstains and the LLM decides
+MIN_SIMILARITY = float(os.environ.get('HR_INTENT_MIN_SIMILARITY', 0.35))
+MIN_MARGIN = float(os.environ.get('HR_INTENT_MIN_MARGIN', 0.05))
+
+# Weight of the seed-question prototype vs the indexed-chunk prototype.
+# Seeds look like user questions; chunks cover the policy vocabulary.
+SEED_WEIGHT = 0.7
+
+# Labeled seed questions per intent
+SEED_EXAMPLES = {
+    "leave_policy": [
+        "How many sick leaves do I get?", "Can I carry forward my earned leave?",
+        "What is the casual leave policy?", "How do I apply for leave?",
+        "Is there bereavement leave?", "How many vacation days per year?",
+    ],
+    "reimbursement": [
+        "How do I claim travel expenses?", "What is the food allowance on business trips?",
+        "Which documents are needed for a reimbursement?", "Who approves my expense claim?",
+        "Can I get my hotel bill reimbursed?", "What is the mileage rate for local travel?",
+    ],
+    "onboarding": [
+        "What do I need to bring on my first day?", "What happens during induction?",
+        "Which documents are required before joining?", "When will I get my laptop as a new joiner?",
+        "Who is my buddy during onboarding?",
+    ],
+    "offboarding": [
+        "What is the notice period?", "How do I resign?", "When will I get my full and final settlement?",
+        "What is the exit clearance process?", "Can I buy out my notice period?",
+    ],
+    "performance": [
+        "When is the appraisal cycle?", "How are performance ratings decided?",
+        "What is the rating scale for reviews?", "How do I set my goals for the year?",
+        "What happens if I get a low rating?",
+    ],
+    "code_of_conduct": [
+        "Can I do freelance work?", "Am I allowed to accept gifts from vendors?",
+        "What is the dress code?", "Can I use the company laptop for personal work?",
+        "What counts as a conflict of interest?",
+    ],
+    "grievance_safety": [
+        "How do I report harassment?", "Who do I contact about a workplace safety issue?",
+        "How do I raise a complaint against my manager?", "Is my grievance kept confidential?",
+        "What is the POSH committee?",
+    ],
+    "salary_policy": [
+        "Explain my salary structure", "When is salary credited?", "What is my CTC breakup?",
+        "How is PF deducted?", "What is HRA?", "When are bonuses paid?",
+    ],
+    "compliance_policy": [
+        "What labour laws does the company follow?", "What is the data privacy policy?",
+        "Is the company compliant with minimum wage rules?", "What statutory acts apply to us?",
+    ],
+    "welfare_benefits": [
+        "Do we have health insurance?", "Is there a gym membership benefit?",
+        "What wellness programs are available?", "Is there a creche facility?",
+        "What is the maternity benefit?", "Do we have an employee assistance program?",
+    ],
+    "general_hr_info": [
+        "What are the office working hours?", "How many public holidays do we have?",
+        "What are the company values?", "Where can I find the employee handbook?",
+    ],
+    "chitchat": [
+        "Hello there", "How are you?", "Thank you so much", "Good night", "Nice to meet you",
+        "Tell me something fun",
+    ],
+    "general_knowledge": [
+        "What is the capital of France?", "What is 12 times 8?", "Why is the sky blue?",
+        "Who wrote Hamlet?", "How far is the moon?", "What is the boiling point of water?",
+    ],
+}
+
+
+class EmbeddingIntentClassifier:
+    """
+    Nearest-centroid intent classifier over MiniLM query embeddings.
+
+    Each intent gets one prototype: the (normalized) mean of its seed question
+    embeddings, blended with the mean embedding of its indexed policy chunks
+    when the collection has any. predict() abstains (returns None) when the
+    best match is weak or too close to the runner-up.
+    """
+    def __init__(self, service, collection=None, min_similarity=MIN_SIMILARITY, min_margin=MIN_MARGIN):
+        self.service = service
+        self.collection = collection
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.intents = None
+        self.prototypes = None
+
+    def _chunk_centroid(self, category, page_size=1000):
+        """Mean embedding of a category's indexed chunks, paged to keep memory bounded."""
+        total = None
+        count = 0
+        offset = 0
+        while True:
+            page = self.collection.get(where={"category": category}, include=["embeddings"],
+                                       limit=page_size, offset=offset)
+            embeddings = page.get("embeddings")
+            if embeddings is None or len(embeddings) == 0:
+                break
+            embeddings = normalize(embeddings)
+            total = embeddings.sum(axis=0) if total is None else total + embeddings.sum(axis=0)
+            count += len(embeddings)
+            offset += page_size
+        return total / count if count else None
+
+    def build(self):
+        intents = list(SEED_EXAMPLES)
+        seed_texts = [text for intent in intents for text in SEED_EXAMPLES[intent]]
+        seed_vectors = normalize(self.service.encode_batch(seed_texts))
+
+        prototypes = []
+        start = 0
+        for intent in intents:
+            n = len(SEED_EXAMPLES[intent])
+            prototype = normalize(seed_vectors[start:start + n].mean(axis=0))
+            start += n
+
+            category = RAG_INTENT_CATEGORIES.get(intent)
+            if self.collection is not None and category:
+                try:
+                    chunk_centroid = self._chunk_centroid(category)
+                except Exception as e:
+                    print(f"Could not read chunks for '{category}': {e}")
+                    chunk_centroid = None
+                if chunk_centroid is not None:
+                    prototype = normalize(SEED_WEIGHT * prototype + (1 - SEED_WEIGHT) * normalize(chunk_centroid))
+            prototypes.append(prototype)
+
+        self.intents = intents
+        self.prototypes = np.vstack(prototypes)
+        print(f"Intent classifier ready ({len(intents)} intent prototypes).")
+
+    def predict(self, query_embedding):
+        """Returns (intent or None, similarity, margin)."""
+        if self.prototypes is None:
+            self.build()
+        scores = self.prototypes @ normalize(query_embedding)
+        order = np.argsort(scores)[::-1]
+        best, runner_up = float(scores[order[0]]), float(scores[order[1]])
+        margin = best - runner_up
+        if best < self.min_similarity or margin < self.min_margin:
+            return None, best, margin
+        return self.intents[order[0]], best, margin
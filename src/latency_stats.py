@@ -0,0 +1,13 @@
+import math
+
+
+def latency_summary(samples):
+    """Count, mean, nearest-rank p50/p95/p99 and max of durations in seconds (None when empty)."""
+    if not samples:
+        return {'n': 0, 'mean': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+    return {'n': len(ordered), 'mean': sum(ordered) / len(ordered),
+            'p50': pct(50), 'p95': pct(95), 'p99': pct(99), 'max': ordered[-1]}
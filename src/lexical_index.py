@@ -0,0 +1,146 @@
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter
+
+# Config
+CHROMA_PATH = os.environ.get('HR_CHROMA_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'chroma_db'))
+LEXICAL_INDEX_PATH = os.path.join(CHROMA_PATH, 'bm25_index.json')
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Words that carry no policy meaning; acronyms (CTC, PF, POSH) are kept as-is
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from have how i if in is it its me my of on or our
+should the their there this to was we what when where which who will with you your
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inverted index over the chunk IDs stored in Chroma, scored with Okapi BM25.
+
+    Written to disk as JSON by ingest_policies (rebuilt, or updated in place
+    for changed files) and loaded read-only by RAGTools. Postings hold (chunk number, term frequency); each chunk's
+    category is kept so searches can be filtered like the Chroma query.
+    """
+    def __init__(self, ids, categories, lengths, postings):
+        self.ids = ids
+        self.categories = categories
+        self.lengths = lengths
+        self.postings = postings
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    @classmethod
+    def build(cls, records):
+        """records: iterable of (chunk id, text, category)."""
+        index = cls([], [], [], {})
+        index.add(records)
+        return index
+
+    def add(self, records):
+        """Appends chunks; records: iterable of (chunk id, text, category)."""
+        for chunk_id, text, category in records:
+            doc = len(self.ids)
+            terms = Counter(tokenize(text))
+            self.ids.append(chunk_id)
+            self.categories.append(category)
+            self.lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append([doc, tf])
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def remove(self, chunk_ids):
+        """Drops chunks by ID and renumbers the rest."""
+        removed = set(chunk_ids)
+        keep = [doc for doc, chunk_id in enumerate(self.ids) if chunk_id not in removed]
+        if len(keep) == len(self.ids):
+            return
+        renumber = {doc: new for new, doc in enumerate(keep)}
+        self.ids = [self.ids[doc] for doc in keep]
+        self.categories = [self.categories[doc] for doc in keep]
+        self.lengths = [self.lengths[doc] for doc in keep]
+        postings = {}
+        for term, entries in self.postings.items():
+            kept = [[renumber[doc], tf] for doc, tf in entries if doc in renumber]
+            if kept:
+                postings[term] = kept
+        self.postings = postings
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def save(self, path=LEXICAL_INDEX_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'ids': self.ids, 'categories': self.categories,
+                       'lengths': self.lengths, 'postings': self.postings},
+                      f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=LEXICAL_INDEX_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['ids'], data['categories'], data['lengths'], data['postings'])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=10, category=None):
+        """Returns up to k (chunk id, score) pairs, best first."""
+        n = len(self.ids)
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings:
+                if category and self.categories[doc] != category:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / self.avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[doc], score) for doc, score in best]
+
+
+class LexicalIndexLoader:
+    """Loads the on-disk index lazily and reloads it when ingest rewrites the file."""
+    def __init__(self, path=LEXICAL_INDEX_PATH):
+        self.path = path
+        self._index = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        with self._lock:
+            if self._index is None or mtime != self._mtime:
+                try:
+                    self._index = BM25Index.load(self.path)
+                    self._mtime = mtime
+                    print(f"Loaded BM25 index ({len(self._index)} chunks).")
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Could not load BM25 index {self.path}: {e}")
+                    return None
+            return self._index
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses ranked lists of IDs; returns IDs ordered by sum of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
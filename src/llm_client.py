@@ -1,6 +1,16 @@
 from gpt4all import GPT4All
 import os
 import sys
+import queue
+import ctypes
+import inspect
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+
+import tracing
+from prompt_builder import PromptTokenizer, CONTEXT_WINDOW_TOKENS
 
 # Path to the downloaded model
 MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'models')
@@ -10,6 +20,155 @@ MODEL_PATH = os.path.join(MODEL_DIR, MODEL_FILENAME)
 import sys
 import contextlib
 
+ERROR_RESPONSE = "I apologize, but I encountered an error generating the response."
+
+# Stop at eot_id if the model didn't stop
+STOP_TOKENS = ["<|eot_id|>", "<|start_header_id|>"]
+# Aggressive safety stops for hallucinated conversations
+# Llama 3 sometimes leaks "User:" or "assistant:" patterns textually
+HEURISTIC_STOPS = ["\nUser:", "\nuser:", "\nAssistant:", "\nassistant:", "User:", "user:"]
+
+# Reuse prefilled KV state for static prompt prefixes (system prompts, classifier instructions)
+PREFIX_CACHE_ENABLED = os.environ.get('HR_LLM_PREFIX_CACHE', '1') == '1'
+PREFIX_CACHE_SIZE = int(os.environ.get('HR_LLM_PREFIX_CACHE_SIZE', 16))
+
+# Pool mode: N model processes with a fixed thread count each (see llm_pool.py)
+LLM_WORKERS = int(os.environ.get('HR_LLM_WORKERS', 1))
+LLM_THREADS = int(os.environ['HR_LLM_THREADS']) if os.environ.get('HR_LLM_THREADS') else None
+
+# 'gpt4all' (the GGUF model) or 'stub' (StubLLM: no model file, deterministic
+# text with simulated latency; for benchmarks and load tests)
+LLM_BACKEND = os.environ.get('HR_LLM_BACKEND', 'gpt4all')
+STUB_TOKEN_LATENCY_MS = float(os.environ.get('HR_STUB_TOKEN_LATENCY_MS', 20))
+STUB_PREFILL_MS_PER_TOKEN = float(os.environ.get('HR_STUB_PREFILL_MS_PER_TOKEN', 0.5))
+STUB_ANSWER_TOKENS = int(os.environ.get('HR_STUB_ANSWER_TOKENS', 64))
+
+# Sampling defaults of GPT4All.generate, repeated for the low-level prefix path
+SAMPLING_DEFAULTS = dict(top_k=40, top_p=0.4, min_p=0.0, repeat_penalty=1.18, repeat_last_n=64, n_batch=8)
+
+class StopSequenceWatcher:
+    """
+    Token callback for GPT4All.generate(callback=...). Returning False aborts
+    decoding, so generation ends on the token that completes a stop string
+    instead of running on to max_tokens. Also counts tokens generated vs kept.
+    """
+    def __init__(self, stops):
+        self.stops = stops
+        self.window = max(len(stop) for stop in stops) - 1
+        self.tail = ""
+        self.chars = 0
+        self.token_ends = []  # cumulative character offset after each token
+        self.stop_offset = None
+        # perf_counter() marks for tracing: model acquired, first and last token
+        self.started_at = None
+        self.first_token_at = None
+        self.last_token_at = None
+
+    def __call__(self, token_id, response):
+        self.last_token_at = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = self.last_token_at
+        text = self.tail + response
+        tail_start = self.chars - len(self.tail)
+        self.chars += len(response)
+        self.token_ends.append(self.chars)
+
+        cut = _find_stop(text, self.stops)
+        if cut is not None:
+            self.stop_offset = tail_start + cut
+            return False
+        self.tail = text[-self.window:] if self.window else ""
+        return True
+
+    @property
+    def tokens_generated(self):
+        return len(self.token_ends)
+
+    @property
+    def tokens_kept(self):
+        if self.stop_offset is None:
+            return self.tokens_generated
+        # Tokens that start before the stop string
+        token_starts = [0] + self.token_ends[:-1]
+        return sum(1 for start in token_starts if start < self.stop_offset)
+
+class PrefixStateCache:
+    """
+    LRU of llama.cpp states captured right after prefilling a static prompt
+    prefix. Restoring one lets a request prefill only its variable suffix
+    (retrieved context, history, query) instead of the whole prompt.
+
+    Uses the llmodel save/restore-state C API and the prompt context of the
+    gpt4all 2.x bindings; if those are not available it reports itself
+    unsupported and LocalLLM falls back to plain generate().
+    """
+    def __init__(self, gpt4all_model, maxsize=PREFIX_CACHE_SIZE):
+        from gpt4all import _pyllmodel
+        self.backend = gpt4all_model.model
+        self.lib = _pyllmodel.llmodel
+        self.lib.llmodel_get_state_size.argtypes = [ctypes.c_void_p]
+        self.lib.llmodel_get_state_size.restype = ctypes.c_uint64
+        self.lib.llmodel_save_state_data.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+        self.lib.llmodel_save_state_data.restype = ctypes.c_uint64
+        self.lib.llmodel_restore_state_data.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+        self.lib.llmodel_restore_state_data.restype = ctypes.c_uint64
+        self.maxsize = maxsize
+        self.states = OrderedDict()  # prefix text -> (state buffer, n_past)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def supported(gpt4all_model):
+        try:
+            from gpt4all import _pyllmodel
+            backend = gpt4all_model.model
+            params = inspect.signature(backend.prompt_model).parameters
+            return (hasattr(_pyllmodel.llmodel, 'llmodel_save_state_data')
+                    and hasattr(_pyllmodel.llmodel, 'llmodel_restore_state_data')
+                    and 'reset_context' in params and 'special' in params)
+        except Exception:
+            return False
+
+    def _prompt(self, text, callback, n_predict, reset_context, **sampling):
+        self.backend.prompt_model(text, "%1", callback, n_predict=n_predict,
+                                  reset_context=reset_context, special=True, **sampling)
+
+    def load(self, prefix):
+        """Puts the model in the state 'prefix has just been prefilled', from cache or by prefilling it."""
+        handle = self.backend.model
+        if prefix in self.states:
+            state, n_past = self.states[prefix]
+            self.states.move_to_end(prefix)
+            self.lib.llmodel_restore_state_data(handle, state)
+            self.backend.context.n_past = n_past
+            self.hits += 1
+            return
+
+        self.misses += 1
+        self._prompt(prefix, lambda token_id, response: False, n_predict=0, reset_context=True)
+        size = self.lib.llmodel_get_state_size(handle)
+        state = (ctypes.c_uint8 * size)()
+        self.lib.llmodel_save_state_data(handle, state)
+        self.states[prefix] = (state, self.backend.context.n_past)
+        while len(self.states) > self.maxsize:
+            self.states.popitem(last=False)
+
+    def generate(self, prefix, suffix, callback, max_tokens, temperature):
+        """Prefills only `suffix` on top of the cached `prefix` state, streaming tokens via callback."""
+        self.load(prefix)
+        self._prompt(suffix, callback, n_predict=max_tokens, reset_context=False,
+                     temp=temperature, **SAMPLING_DEFAULTS)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self.states),
+            'maxsize': self.maxsize,
+        }
+
 @contextlib.contextmanager
 def suppress_stderr():
     with open(os.devnull, "w") as devnull:
@@ -21,7 +180,7 @@ def suppress_stderr():
             sys.stderr = old_stderr
 
 class LocalLLM:
-    def __init__(self):
+    def __init__(self, n_threads=None):
         if not os.path.exists(MODEL_PATH):
             raise FileNotFoundError(f"Model file not found at {MODEL_PATH}. Please run download_model.py first.")
         
@@ -30,53 +189,367 @@ class LocalLLM:
         # Suppress the "Failed to load llamamodel..." CPU warnings
         with suppress_stderr():
             # allow_download=False ensures offline mode
-            self.llm = GPT4All(model_name=MODEL_FILENAME, model_path=MODEL_DIR, allow_download=False, device='cpu')
+            # n_threads=None lets GPT4All pick; pool workers pin it to split the cores
+            self.llm = GPT4All(model_name=MODEL_FILENAME, model_path=MODEL_DIR, allow_download=False, device='cpu',
+                               n_threads=n_threads, n_ctx=CONTEXT_WINDOW_TOKENS)
         print("Model loaded successfully.")
 
-    def chat(self, messages, max_tokens=1024, temperature=0.1):
+        # The model holds one KV cache; generations must not interleave
+        self._model_lock = threading.Lock()
+        self.prefix_cache = None
+        if PREFIX_CACHE_ENABLED:
+            if PrefixStateCache.supported(self.llm):
+                self.prefix_cache = PrefixStateCache(self.llm)
+            else:
+                print("Prompt-prefix cache unavailable with this gpt4all version; prefilling full prompts.")
+
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            'calls': 0,
+            'tokens_generated': 0,
+            'tokens_kept': 0,
+            'early_stops': 0,
+        }
+        # Timings/token counts of the latest generation (pool workers report it back)
+        self.last_generation = None
+
+    def _record_generation(self, watcher, messages, called):
+        with self._metrics_lock:
+            self.metrics['calls'] += 1
+            self.metrics['tokens_generated'] += watcher.tokens_generated
+            self.metrics['tokens_kept'] += watcher.tokens_kept
+            if watcher.stop_offset is not None:
+                self.metrics['early_stops'] += 1
+        if tracing.TRACING_ENABLED:
+            self.last_generation = tracing.generation_record(
+                'gpt4all', _prompt_tokenizer.count(self._build_prompt(messages)), watcher.tokens_generated,
+                called, watcher.started_at, watcher.first_token_at, watcher.last_token_at)
+            tracing.record_generation(self.last_generation)
+
+    def generation_stats(self):
+        """Tokens decoded vs kept across all calls; the difference is decode time spent on discarded text."""
+        with self._metrics_lock:
+            stats = dict(self.metrics)
+        stats['tokens_discarded'] = stats['tokens_generated'] - stats['tokens_kept']
+        return stats
+
+    def _build_prompt(self, messages):
+        # Llama 3 template construction
+        full_prompt = "<|begin_of_text|>"
+        for msg in messages:
+            role = msg['role']
+            content = msg['content']
+            full_prompt += f"<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>"
+        
+        full_prompt += "<|start_header_id|>assistant<|end_header_id|>\n\n"
+        return full_prompt
+
+    def _split_prefix(self, messages, prefix):
         """
-        Manually formats the prompt for Llama 3 and uses generate().
-        messages: list of dicts [{'role': 'system', 'content': '...'}, {'role': 'user', 'content': '...'}]
+        Splits the rendered prompt into (static_prefix, suffix) when the first
+        message's content starts with `prefix`, else returns (None, prompt).
         """
-        try:
-            # Llama 3 template construction
-            full_prompt = "<|begin_of_text|>"
-            for msg in messages:
-                role = msg['role']
-                content = msg['content']
-                full_prompt += f"<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>"
-            
-            full_prompt += "<|start_header_id|>assistant<|end_header_id|>\n\n"
-            
-            stop_tokens = ["<|eot_id|>", "<|start_header_id|>"]
-            
-            response = self.llm.generate(
+        full_prompt = self._build_prompt(messages)
+        if not prefix or not messages or not messages[0]['content'].startswith(prefix):
+            return None, full_prompt
+        head = f"<|begin_of_text|><|start_header_id|>{messages[0]['role']}<|end_header_id|>\n\n{prefix}"
+        return head, full_prompt[len(head):]
+
+    def _generate_tokens(self, messages, prefix, max_tokens, temperature, watcher):
+        """Yields raw tokens, reusing the cached KV state for `prefix` when possible."""
+        static_prefix, suffix = self._split_prefix(messages, prefix)
+        full_prompt = static_prefix + suffix if static_prefix else suffix
+        with self._model_lock:
+            watcher.started_at = time.perf_counter()
+            if self.prefix_cache is not None and static_prefix is not None:
+                yielded = False
+                try:
+                    for token in self._generate_from_prefix(static_prefix, suffix, max_tokens, temperature, watcher):
+                        yielded = True
+                        yield token
+                    return
+                except Exception as e:
+                    print(f"Prompt-prefix cache disabled after error: {e}")
+                    self.prefix_cache = None
+                    if yielded:
+                        raise
+
+            yield from self.llm.generate(
                 full_prompt,
                 max_tokens=max_tokens,
-                temp=temperature
+                temp=temperature,
+                streaming=True,
+                callback=watcher
             )
-            
-            # Post-processing to stop at eot_id if the model didn't stop
-            for stop in stop_tokens:
-                if stop in response:
-                    response = response.split(stop)[0]
-            
-            # Aggressive safety stops for hallucinated conversations
-            # Llama 3 sometimes leaks "User:" or "assistant:" patterns textually
-            heuristic_stops = ["\nUser:", "\nuser:", "\nAssistant:", "\nassistant:", "User:", "user:"]
-            for h_stop in heuristic_stops:
-                if h_stop in response:
-                     response = response.split(h_stop)[0]
-                
-            return response.strip()
+
+    def _generate_from_prefix(self, static_prefix, suffix, max_tokens, temperature, watcher):
+        # The low-level prompt call blocks, so run it in a thread and stream its callback output
+        tokens = queue.Queue()
+        cancelled = threading.Event()
+
+        def on_token(token_id, response):
+            if cancelled.is_set():
+                return False
+            # Like GPT4All.generate: the token that completes a stop string is not emitted
+            keep = watcher(token_id, response)
+            if keep:
+                tokens.put(response)
+            return keep
+
+        def run():
+            try:
+                self.prefix_cache.generate(static_prefix, suffix, on_token, max_tokens, temperature)
+            except Exception as e:
+                tokens.put(e)
+            finally:
+                tokens.put(None)
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        try:
+            while (item := tokens.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Consumer stopped early (stop string found or client went away): end decoding now
+            cancelled.set()
+            worker.join()
+
+    def chat(self, messages, max_tokens=1024, temperature=0.1, prefix=None):
+        """
+        Manually formats the prompt for Llama 3 and uses generate().
+        messages: list of dicts [{'role': 'system', 'content': '...'}, {'role': 'user', 'content': '...'}]
+        prefix: static leading text of messages[0]['content'] whose prefilled state can be reused
+        """
+        return "".join(self.chat_stream(messages, max_tokens=max_tokens, temperature=temperature, prefix=prefix)).strip()
+
+    def chat_stream(self, messages, max_tokens=1024, temperature=0.1, prefix=None):
+        """
+        Streaming variant of chat(): yields the response text piece by piece as
+        the model produces it. Stop strings abort decoding through the token
+        callback; the last few characters are held back until they can no
+        longer start a stop string, so no part of one is ever shown.
+        """
+        stops = STOP_TOKENS + HEURISTIC_STOPS
+        holdback = max(len(stop) for stop in stops) - 1
+        watcher = StopSequenceWatcher(stops)
+        called = time.perf_counter()
+        buffer = ""
+        consumed = 0  # characters of the raw token stream released from the buffer
+        emitted = False
+        try:
+            for token in self._generate_tokens(messages, prefix, max_tokens, temperature, watcher):
+                buffer += token
+                cut = _find_stop(buffer, stops)
+                if cut is not None:
+                    buffer = buffer[:cut]
+                    break
+                if len(buffer) > holdback:
+                    out, buffer = buffer[:-holdback], buffer[-holdback:]
+                    consumed += len(out)
+                    if not emitted:
+                        out = out.lstrip()
+                    if out:
+                        emitted = True
+                        yield out
+
+            if watcher.stop_offset is not None:
+                # The token completing a multi-token stop string never reaches the
+                # loop, so the buffer may still hold the start of it ("\nUser")
+                buffer = buffer[:max(0, watcher.stop_offset - consumed)]
+            tail = buffer.rstrip() if emitted else buffer.strip()
+            if tail:
+                yield tail
         except Exception as e:
             print(f"Error in LLM Generation: {e}")
-            return "I apologize, but I encountered an error generating the response."
+            if not emitted:
+                yield ERROR_RESPONSE
+        finally:
+            self._record_generation(watcher, messages, called)
+
+_STUB_WORDS = ("policy employees leave days approval manager request year salary claim documents notice "
+               "period eligible benefits company portal working submit within confirmed").split()
+
+class StubLLM:
+    """
+    Deterministic stand-in for LocalLLM. Needs no model file. Output depends
+    only on the prompt. Prefill and decode are simulated with sleeps. One lock
+    serializes calls the way the single GPT4All context does.
+    """
+    prefix_cache = None
+
+    def __init__(self, token_latency_ms=STUB_TOKEN_LATENCY_MS, prefill_ms_per_token=STUB_PREFILL_MS_PER_TOKEN,
+                 answer_tokens=STUB_ANSWER_TOKENS):
+        self.token_latency = token_latency_ms / 1000.0
+        self.prefill_per_token = prefill_ms_per_token / 1000.0
+        self.answer_tokens = answer_tokens
+        self._model_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.metrics = {'calls': 0, 'tokens_generated': 0, 'tokens_kept': 0, 'early_stops': 0,
+                        'prompt_tokens': 0, 'busy_seconds': 0.0}
+
+    def chat_stream(self, messages, max_tokens=1024, temperature=0.1, prefix=None):
+        prompt = "".join(msg['content'] for msg in messages)
+        # ~4 characters per token, like the Llama 3 tokenizer on English text
+        prompt_tokens = len(prompt) // 4 + 1
+        seed = sum(prompt.encode('utf-8')) % len(_STUB_WORDS)
+        n = min(max_tokens, self.answer_tokens)
+        called = time.perf_counter()
+        first_token = None
+        with self._model_lock:
+            start = time.time()
+            started = time.perf_counter()
+            time.sleep(prompt_tokens * self.prefill_per_token)
+            for i in range(n):
+                time.sleep(self.token_latency)
+                first_token = first_token or time.perf_counter()
+                word = _STUB_WORDS[(seed + 7 * i) % len(_STUB_WORDS)]
+                yield word if i == 0 else " " + word
+            busy = time.time() - start
+        tracing.record_generation(tracing.generation_record(
+            'stub', prompt_tokens, n, called, started, first_token, time.perf_counter()))
+        with self._metrics_lock:
+            self.metrics['calls'] += 1
+            self.metrics['tokens_generated'] += n
+            self.metrics['tokens_kept'] += n
+            self.metrics['prompt_tokens'] += prompt_tokens
+            self.metrics['busy_seconds'] += busy
+
+    def chat(self, messages, max_tokens=1024, temperature=0.1, prefix=None):
+        return "".join(self.chat_stream(messages, max_tokens=max_tokens, temperature=temperature, prefix=prefix)).strip()
+
+    def generation_stats(self):
+        with self._metrics_lock:
+            stats = dict(self.metrics)
+        stats['tokens_discarded'] = 0
+        return stats
+
+def _find_stop(text, stops):
+    """Index of the earliest stop string in text, or None."""
+    positions = [text.find(stop) for stop in stops]
+    positions = [p for p in positions if p != -1]
+    return min(positions) if positions else None
+
+class LLMQueueFull(Exception):
+    """The generation queue is at capacity; the caller should retry later."""
+
+class LLMTimeout(Exception):
+    """A queued generation did not produce output in time."""
+
+class _TokenChannel:
+    """Hands tokens from the LLM worker to the thread that submitted the job."""
+    def __init__(self):
+        self.items = queue.Queue()
+        self.cancelled = threading.Event()
+        # Generation timings reported by a pool worker process
+        self.generation = None
+
+    def iterate(self, timeout):
+        try:
+            while True:
+                try:
+                    item = self.items.get(timeout=timeout)
+                except queue.Empty:
+                    raise LLMTimeout(f"No output from the LLM worker within {timeout}s")
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Consumer stopped early or timed out: let the worker drop the job
+            self.cancelled.set()
+
+class QueuedLLM:
+    """
+    Drop-in for LocalLLM.chat/chat_stream that runs every generation on
+    dedicated worker threads fed by a bounded queue. Submitting to a full queue
+    raises LLMQueueFull immediately instead of piling up waiting requests.
+    Use one worker per model instance (one for LocalLLM, pool size for LLMPool).
+    Other attributes (generation_stats, prefix_cache, ...) pass through.
+    """
+    def __init__(self, llm, max_queue=8, timeout=300, workers=1):
+        self.llm = llm
+        self.timeout = timeout
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.active = 0
+        self._active_lock = threading.Lock()
+        self.workers = [threading.Thread(target=self._run, name=f"llm-worker-{i}", daemon=True)
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def is_alive(self):
+        return any(worker.is_alive() for worker in self.workers)
+
+    def _set_active(self, delta):
+        with self._active_lock:
+            self.active += delta
+
+    def _run(self):
+        while True:
+            messages, kwargs, channel, context, queued_at = self.jobs.get()
+            if channel.cancelled.is_set():
+                continue
+            # Run in the submitter's context so the generation lands in its trace
+            context.run(self._serve, messages, kwargs, channel, queued_at)
+
+    def _serve(self, messages, kwargs, channel, queued_at):
+        current = tracing.current_trace()
+        if current is not None:
+            current.add_span('llm_queue', queued_at, time.perf_counter() - queued_at)
+        self._set_active(1)
+        try:
+            for piece in self.llm.chat_stream(messages, **kwargs):
+                if channel.cancelled.is_set():
+                    break
+                channel.items.put(piece)
+        except Exception as e:
+            channel.items.put(e)
+        finally:
+            channel.items.put(None)
+            self._set_active(-1)
+
+    def queue_depth(self):
+        return self.jobs.qsize()
+
+    def chat_stream(self, messages, max_tokens=1024, temperature=0.1, prefix=None):
+        channel = _TokenChannel()
+        try:
+            self.jobs.put_nowait((messages, dict(max_tokens=max_tokens, temperature=temperature, prefix=prefix), channel,
+                                  contextvars.copy_context(), time.perf_counter()))
+        except queue.Full:
+            raise LLMQueueFull(f"LLM queue is full ({self.jobs.maxsize} waiting)")
+        return channel.iterate(self.timeout)
+
+    def chat(self, messages, max_tokens=1024, temperature=0.1, prefix=None):
+        return "".join(self.chat_stream(messages, max_tokens=max_tokens, temperature=temperature, prefix=prefix)).strip()
 
 _llm_instance = None
+_llm_lock = threading.Lock()
+# Prompt token counts for traces
+_prompt_tokenizer = PromptTokenizer()
 
 def get_llm():
+    """
+    The process-wide LLM. With HR_LLM_WORKERS > 1 this is an LLMPool of worker
+    processes (each with HR_LLM_THREADS threads); otherwise one in-process LocalLLM.
+    HR_LLM_BACKEND=stub swaps in StubLLM for benchmarks.
+    """
     global _llm_instance
     if _llm_instance is None:
-        _llm_instance = LocalLLM()
+        # Startup phases run on parallel threads; load the model only once
+        with _llm_lock:
+            if _llm_instance is None:
+                if LLM_BACKEND == 'stub':
+                    _llm_instance = StubLLM()
+                elif LLM_WORKERS > 1:
+                    from llm_pool import LLMPool
+                    _llm_instance = LLMPool(workers=LLM_WORKERS, threads_per_worker=LLM_THREADS)
+                else:
+                    _llm_instance = LocalLLM(n_threads=LLM_THREADS)
     return _llm_instance
@@ -0,0 +1,277 @@
+import os
+import time
+import queue
+import itertools
+import threading
+import multiprocessing as mp
+
+import tracing
+from llm_client import LocalLLM, LLMTimeout, _TokenChannel
+
+# Config
+POOL_START_TIMEOUT = int(os.environ.get('HR_LLM_POOL_START_TIMEOUT', 120))
+HEALTH_CHECK_INTERVAL = 5.0
+# An idle worker that does not answer a ping within this many seconds is restarted
+PING_TIMEOUT = 30.0
+# A busy worker with no output (prefill or a token) for this long is restarted
+JOB_STALL_TIMEOUT = int(os.environ.get('HR_LLM_POOL_JOB_TIMEOUT', 180))
+ACQUIRE_TIMEOUT = 300
+
+_PING = "ping"
+
+
+def _worker_main(worker_id, n_threads, jobs, results, cancel):
+    """
+    Entry point of a pool process: load a private model, then serve jobs until
+    None arrives. `cancel` holds the id of the job the caller abandoned.
+    """
+    llm = LocalLLM(n_threads=n_threads)
+    results.put((worker_id, None, 'ready', None))
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, messages, kwargs = job
+        if job_id == _PING:
+            results.put((worker_id, _PING, 'pong', None))
+            continue
+
+        start = time.time()
+        try:
+            for piece in llm.chat_stream(messages, **kwargs):
+                if cancel.value == job_id:
+                    break
+                results.put((worker_id, job_id, 'token', piece))
+        except Exception as e:
+            results.put((worker_id, job_id, 'error', str(e)))
+        stats = llm.generation_stats()
+        stats['seconds'] = time.time() - start
+        stats['generation'] = llm.last_generation
+        results.put((worker_id, job_id, 'done', stats))
+
+
+class _Worker:
+    def __init__(self, worker_id):
+        self.id = worker_id
+        self.process = None
+        self.jobs = None
+        self.cancel = None
+        self.current_job = None
+        # Dispatch or last output time of the current job, for stall detection
+        self.last_activity = None
+        self.ready = False
+        self.ping_sent_at = None
+        self.restarts = -1
+        # Generation stats reported by the current process, plus totals of replaced ones
+        self.stats = {}
+        self.retired = {'calls': 0, 'tokens_generated': 0, 'tokens_kept': 0, 'early_stops': 0}
+        self.busy_seconds = 0.0
+
+
+class LLMPool:
+    """
+    N worker processes, each holding its own GPT4All model with a fixed
+    thread count, behind the LocalLLM chat/chat_stream interface.
+
+    Calls go to the first idle worker. A monitor thread restarts workers whose
+    process died, that stopped answering pings, or that stalled mid-job; the
+    job running on such a worker fails with an error instead of hanging. generation_stats() reports
+    tokens/sec per worker so N and threads-per-worker can be tuned.
+    """
+    # No shared KV state across processes; each worker keeps its own prefix cache
+    prefix_cache = None
+
+    def __init__(self, workers=2, threads_per_worker=None, timeout=ACQUIRE_TIMEOUT):
+        self.size = workers
+        self.threads_per_worker = threads_per_worker
+        self.timeout = timeout
+        # spawn: forking a process that already runs threads (and llama.cpp) is unsafe
+        self._ctx = mp.get_context('spawn')
+        self._results = self._ctx.Queue()
+        self._idle = queue.Queue()
+        self._channels = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._workers = [_Worker(i) for i in range(workers)]
+
+        print(f"Starting LLM pool: {workers} workers x {threads_per_worker or 'auto'} threads...")
+        for worker in self._workers:
+            self._start(worker)
+
+        threading.Thread(target=self._route, name="llm-pool-router", daemon=True).start()
+        threading.Thread(target=self._monitor, name="llm-pool-monitor", daemon=True).start()
+
+        deadline = time.time() + POOL_START_TIMEOUT
+        while not all(w.ready for w in self._workers) and time.time() < deadline:
+            time.sleep(0.2)
+        ready = sum(w.ready for w in self._workers)
+        if not ready:
+            raise RuntimeError("No LLM pool worker became ready.")
+        print(f"LLM pool ready ({ready}/{workers} workers).")
+
+    def _start(self, worker):
+        worker.jobs = self._ctx.Queue()
+        worker.cancel = self._ctx.Value('q', -1)
+        worker.ready = False
+        worker.current_job = None
+        worker.ping_sent_at = None
+        worker.restarts += 1
+        if worker.stats:
+            for key in worker.retired:
+                worker.retired[key] += worker.stats.get(key, 0)
+            worker.stats = {}
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker.id, self.threads_per_worker, worker.jobs, self._results, worker.cancel),
+            name=f"llm-pool-worker-{worker.id}",
+            daemon=True
+        )
+        worker.process.start()
+
+    def _route(self):
+        """Forwards worker output to the waiting callers and returns finished workers to the idle set."""
+        while True:
+            worker_id, job_id, kind, payload = self._results.get()
+            worker = self._workers[worker_id]
+            if kind == 'ready':
+                worker.ready = True
+                self._idle.put(worker)
+            elif kind == 'pong':
+                worker.ping_sent_at = None
+                self._idle.put(worker)
+            else:
+                with self._lock:
+                    channel = self._channels.get(job_id)
+                if kind == 'token':
+                    worker.last_activity = time.time()
+                    if channel:
+                        channel.items.put(payload)
+                elif kind == 'error' and channel:
+                    channel.items.put(RuntimeError(payload))
+                elif kind == 'done':
+                    worker.busy_seconds += payload.pop('seconds', 0.0)
+                    generation = payload.pop('generation', None)
+                    worker.stats = payload
+                    if channel:
+                        channel.generation = generation
+                        channel.items.put(None)
+                    with self._lock:
+                        self._channels.pop(job_id, None)
+                        if worker.current_job == job_id:
+                            worker.current_job = None
+                            self._idle.put(worker)
+
+    def _monitor(self):
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            for worker in self._workers:
+                if worker.process.is_alive():
+                    now = time.time()
+                    if worker.ping_sent_at and now - worker.ping_sent_at > PING_TIMEOUT:
+                        print(f"LLM worker {worker.id} stopped responding; restarting.")
+                    elif (worker.current_job is not None and worker.last_activity
+                          and now - worker.last_activity > JOB_STALL_TIMEOUT):
+                        print(f"LLM worker {worker.id} produced no output for {JOB_STALL_TIMEOUT}s; restarting.")
+                    else:
+                        continue
+                    worker.process.terminate()
+                    worker.process.join(5)
+                else:
+                    print(f"LLM worker {worker.id} exited (code {worker.process.exitcode}); restarting.")
+                self._fail_current(worker, "LLM worker crashed during generation")
+                self._start(worker)
+            self._ping_idle()
+
+    def _ping_idle(self):
+        """Health check: round-trip a ping through every idle worker."""
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for worker in idle:
+            if worker.process.is_alive() and worker.ready:
+                worker.ping_sent_at = time.time()
+                worker.jobs.put((_PING, None, None))
+
+    def _fail_current(self, worker, message):
+        with self._lock:
+            job_id, worker.current_job = worker.current_job, None
+            channel = self._channels.pop(job_id, None)
+        if channel:
+            channel.items.put(RuntimeError(message))
+            channel.items.put(None)
+
+    def _acquire(self, job_id, channel):
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                worker = self._idle.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                raise LLMTimeout(f"No LLM pool worker free within {self.timeout}s")
+            with self._lock:
+                # Skip stale entries for workers that died, were restarted or got claimed meanwhile
+                if worker.ready and worker.process.is_alive() and worker.current_job is None and not worker.ping_sent_at:
+                    worker.current_job = job_id
+                    worker.last_activity = time.time()
+                    self._channels[job_id] = channel
+                    return worker, worker.restarts
+
+    def _dispatch(self, job_id, job):
+        """Acquires a worker and queues the job on it; returns (worker, channel)."""
+        while True:
+            channel = _TokenChannel()
+            worker, generation = self._acquire(job_id, channel)
+            with self._lock:
+                # The monitor may have restarted the worker since it was acquired; the
+                # fresh process is already back in the idle queue, so pick another one
+                if worker.restarts == generation and worker.current_job == job_id:
+                    worker.jobs.put((job_id,) + job)
+                    return worker, channel
+                self._channels.pop(job_id, None)
+
+    def chat_stream(self, messages, max_tokens=1024, temperature=0.1, prefix=None):
+        job_id = next(self._job_ids)
+        worker, channel = self._dispatch(job_id, (messages, dict(max_tokens=max_tokens, temperature=temperature, prefix=prefix)))
+        try:
+            yield from channel.iterate(self.timeout)
+            if channel.generation:
+                # Recorded in the caller's process, so it joins the caller's trace
+                tracing.record_generation(dict(channel.generation, worker=worker.id))
+        finally:
+            # Caller stopped early: stop decoding so the worker frees up. Keyed by
+            # job id, so a late cancel can never stop the worker's next job
+            with self._lock:
+                if worker.current_job == job_id:
+                    worker.cancel.value = job_id
+
+    def chat(self, messages, max_tokens=1024, temperature=0.1, prefix=None):
+        return "".join(self.chat_stream(messages, max_tokens=max_tokens, temperature=temperature, prefix=prefix)).strip()
+
+    def generation_stats(self):
+        """Aggregate LocalLLM-style stats plus a per-worker breakdown with tokens/sec."""
+        totals = {'calls': 0, 'tokens_generated': 0, 'tokens_kept': 0, 'early_stops': 0}
+        per_worker = []
+        for worker in self._workers:
+            merged = {key: worker.retired[key] + worker.stats.get(key, 0) for key in totals}
+            for key in totals:
+                totals[key] += merged[key]
+            per_worker.append({
+                'worker': worker.id,
+                'alive': worker.process.is_alive(),
+                'busy': worker.current_job is not None,
+                'restarts': worker.restarts,
+                'busy_seconds': round(worker.busy_seconds, 2),
+                'tokens_per_sec': round(merged['tokens_generated'] / worker.busy_seconds, 2) if worker.busy_seconds else 0.0,
+                **merged,
+            })
+        totals['tokens_discarded'] = totals['tokens_generated'] - totals['tokens_kept']
+        totals['workers'] = per_worker
+        return totals
+
+    def close(self):
+        for worker in self._workers:
+            worker.jobs.put(None)
+        for worker in self._workers:
+            worker.process.join(10)
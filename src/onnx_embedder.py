@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from embeddings import EMBEDDING_MODEL_NAME, ENCODE_BATCH_SIZE
+
+# Config
+ONNX_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'models', 'minilm-onnx')
+FP32_FILE = 'model.onnx'
+INT8_FILE = 'model.int8.onnx'
+# Tokens per input; matches SentenceTransformer's max_seq_length for all-MiniLM-L6-v2
+MAX_SEQ_LENGTH = 256
+ONNX_THREADS = int(os.environ['HR_ONNX_THREADS']) if os.environ.get('HR_ONNX_THREADS') else None
+# Mean cosine between int8 ONNX and fp32 PyTorch vectors required by `parity`
+PARITY_MIN_MEAN_COSINE = 0.99
+PARITY_MIN_COSINE = 0.95
+PARITY_SAMPLE = 512
+
+
+def export(out_dir=ONNX_DIR, model_name=EMBEDDING_MODEL_NAME, opset=14):
+    """
+    Exports the locally cached MiniLM transformer to ONNX, then writes an int8
+    dynamically quantized copy. Pooling and normalization run in NumPy.
+    """
+    # Never reach the Hugging Face Hub; the weights must already be cached
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(out_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    tokenizer.save_pretrained(out_dir)
+
+    sample = tokenizer(["Export sample for the HR policy embedder."], return_tensors='pt')
+    fp32_path = os.path.join(out_dir, FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (sample['input_ids'], sample['attention_mask'], sample['token_type_ids']),
+            fp32_path,
+            input_names=['input_ids', 'attention_mask', 'token_type_ids'],
+            output_names=['last_hidden_state'],
+            dynamic_axes={name: {0: 'batch', 1: 'sequence'}
+                          for name in ('input_ids', 'attention_mask', 'token_type_ids', 'last_hidden_state')},
+            opset_version=opset,
+        )
+    int8_path = os.path.join(out_dir, INT8_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    with open(os.path.join(out_dir, 'export.json'), 'w', encoding='utf-8') as f:
+        json.dump({'model': model_name, 'max_seq_length': st_model.max_seq_length, 'opset': opset}, f, indent=2)
+    print(f"Exported {model_name}: {fp32_path} ({os.path.getsize(fp32_path) / 1e6:.1f} MB), "
+          f"{int8_path} ({os.path.getsize(int8_path) / 1e6:.1f} MB)")
+    return int8_path
+
+
+def is_exported(model_dir=ONNX_DIR, quantized=True):
+    return os.path.exists(os.path.join(model_dir, INT8_FILE if quantized else FP32_FILE))
+
+
+class OnnxEmbeddingModel:
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime (int8 by default): tokenizer -> transformer
+    -> mean pooling -> L2 normalize, the same pipeline as the SentenceTransformer.
+    Exposes the encode/tokenizer/max_seq_length surface EmbeddingService uses.
+    """
+    def __init__(self, model_dir=ONNX_DIR, quantized=True, n_threads=ONNX_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = os.path.join(model_dir, INT8_FILE if quantized else FP32_FILE)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"ONNX embedder not found at {path}. Run: python src/onnx_embedder.py export")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if n_threads:
+            options.intra_op_num_threads = n_threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = MAX_SEQ_LENGTH
+        self.path = path
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts, batch_size=ENCODE_BATCH_SIZE):
+        texts = list(texts)
+        out = []
+        for start in range(0, len(texts), batch_size):
+            batch = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                   max_length=self.max_seq_length, return_tensors='np')
+            feeds = {name: batch[name].astype(np.int64) for name in batch if name in self._inputs}
+            hidden = self.session.run(None, feeds)[0]
+            mask = batch['attention_mask'][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            out.append(pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None))
+        return np.vstack(out) if out else np.zeros((0, 384), dtype=np.float32)
+
+
+def sample_corpus(limit=PARITY_SAMPLE):
+    """
+    Chunk texts spread over the whole corpus (every n-th chunk), from the
+    vector index ingest wrote, else from the Chroma collection.
+    """
+    from vector_index import CHROMA_PATH, NumpyVectorIndex
+    if NumpyVectorIndex.exists():
+        index = NumpyVectorIndex(verbose=False)
+        step = max(1, index.count() // limit)
+        documents = [index.document(i) for i in range(0, index.count(), step)]
+    else:
+        import chromadb
+        collection = chromadb.PersistentClient(path=CHROMA_PATH).get_collection(name="hr_policies")
+        # IDs only for the whole collection, then the texts of the sampled ones
+        ids = collection.get(include=[])['ids']
+        sampled = ids[::max(1, len(ids) // limit)][:limit]
+        documents = collection.get(ids=sampled, include=["documents"])['documents'] if sampled else []
+    return [d for d in documents if d][:limit]
+
+
+def parity(texts, quantized=True):
+    """Cosine agreement between ONNX and fp32 SentenceTransformer vectors."""
+    from sentence_transformers import SentenceTransformer
+    reference = SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu').encode(texts, batch_size=ENCODE_BATCH_SIZE)
+    candidate = OnnxEmbeddingModel(quantized=quantized).encode(texts)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+    return {
+        'texts': len(texts),
+        'mean_cosine': float(cosines.mean()),
+        'min_cosine': float(cosines.min()),
+        'p01_cosine': float(np.percentile(cosines, 1)),
+        'passed': bool(cosines.mean() >= PARITY_MIN_MEAN_COSINE and cosines.min() >= PARITY_MIN_COSINE),
+    }
+
+
+def _time_encode(model, texts, batch_size, repeats):
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.encode(texts, batch_size=batch_size)
+    return (time.perf_counter() - start) / repeats
+
+
+def benchmark(texts, batch_size=ENCODE_BATCH_SIZE, repeats=3):
+    """Texts/sec for corpus batches and latency for single queries, per backend."""
+    from sentence_transformers import SentenceTransformer
+    backends = {'torch_fp32': SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu')}
+    if is_exported(quantized=False):
+        backends['onnx_fp32'] = OnnxEmbeddingModel(quantized=False)
+    backends['onnx_int8'] = OnnxEmbeddingModel(quantized=True)
+
+    queries = [t[:80] for t in texts[:32]]
+    results = {}
+    for name, model in backends.items():
+        seconds = _time_encode(model, texts, batch_size, repeats)
+        single = _time_encode(model, queries, 1, 1) / max(1, len(queries))
+        results[name] = {'texts_per_sec': round(len(texts) / seconds, 1),
+                         'query_latency_ms': round(single * 1000, 2)}
+        print(f"{name:>11}: {results[name]['texts_per_sec']:8.1f} texts/s (batch {batch_size}), "
+              f"{results[name]['query_latency_ms']:6.2f} ms/query")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ONNX int8 backend for the MiniLM embedder.")
+    parser.add_argument('command', choices=['export', 'parity', 'benchmark'])
+    parser.add_argument('--sample', type=int, default=PARITY_SAMPLE, help="Corpus chunks used by parity/benchmark.")
+    parser.add_argument('--batch-size', type=int, default=ENCODE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        export()
+        return 0
+
+    texts = sample_corpus(args.sample)
+    if not texts:
+        print("No indexed chunks found; run ingest_policies.py first.")
+        return 1
+    if args.command == 'parity':
+        report = parity(texts)
+        print(json.dumps(report, indent=2))
+        return 0 if report['passed'] else 1
+    print(json.dumps(benchmark(texts, batch_size=args.batch_size), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,223 @@
+import os
+import re
+import threading
+
+# Config
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'models')
+# Llama 3 tokenizer.json (from the model's Hugging Face repo). Without it,
+# counts fall back to a characters-per-token estimate.
+TOKENIZER_PATH = os.environ.get('HR_LLM_TOKENIZER', os.path.join(MODEL_DIR, 'tokenizer.json'))
+CHARS_PER_TOKEN = 3.6
+# GPT4All context window (n_ctx); it holds the prompt and the answer
+CONTEXT_WINDOW_TOKENS = int(os.environ.get('HR_LLM_CONTEXT_TOKENS', 2048))
+# Longest answer a tool asks for; shortened further if the prompt leaves less room
+ANSWER_MAX_TOKENS = int(os.environ.get('HR_ANSWER_MAX_TOKENS', 768))
+# Prompt tokens allowed per request: whatever the window has left after the answer
+PROMPT_TOKEN_BUDGET = int(os.environ.get('HR_PROMPT_TOKEN_BUDGET', CONTEXT_WINDOW_TOKENS - ANSWER_MAX_TOKENS))
+# Share of that budget conversation history may take (newest turns, summary, older turns)
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HR_HISTORY_TOKEN_BUDGET', 256))
+# Newest messages served before the summary, so a long summary never crowds them out
+HISTORY_TURNS = 2
+# A context passage cut shorter than this is dropped rather than sent
+MIN_PASSAGE_TOKENS = 32
+# <|start_header_id|>role<|end_header_id|>\n\n ... <|eot_id|>
+MESSAGE_OVERHEAD_TOKENS = 5
+PASSAGE_SEPARATOR = "\n\n"
+# The conversation summary goes after the context, outside the cached static prefix
+SUMMARY_HEADING = "\n\nEARLIER IN THIS CONVERSATION:\n"
+SUMMARY_OVERHEAD_TOKENS = 8
+
+_SENTENCE_END = re.compile(r"(?<=[.!?:;])\s+|\n+")
+
+
+class PromptTokenizer:
+    """Counts tokens with the LLM's own tokenizer when its tokenizer.json is available."""
+    def __init__(self, path=TOKENIZER_PATH):
+        self.path = path
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def exact(self):
+        return self._load() is not None
+
+    def _load(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    if os.path.exists(self.path):
+                        try:
+                            from tokenizers import Tokenizer
+                            self._tokenizer = Tokenizer.from_file(self.path)
+                        except Exception as e:
+                            print(f"Could not load LLM tokenizer {self.path}: {e}")
+                    else:
+                        print(f"No LLM tokenizer at {self.path}; estimating prompt tokens.")
+                    self._loaded = True
+        return self._tokenizer
+
+    def count(self, text):
+        if not text:
+            return 0
+        tokenizer = self._load()
+        if tokenizer is not None:
+            return len(tokenizer.encode(text, add_special_tokens=False).ids)
+        return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def trim_to_tokens(text, max_tokens, tokenizer):
+    """
+    Longest leading run of whole sentences that fits in max_tokens. Falls back
+    to whole words when even the first sentence is too long.
+    """
+    if max_tokens <= 0:
+        return ""
+    if tokenizer.count(text) <= max_tokens:
+        return text
+
+    kept = ""
+    pos = 0
+    for match in _SENTENCE_END.finditer(text):
+        candidate = text[:match.start()]
+        if tokenizer.count(candidate) > max_tokens:
+            break
+        kept, pos = candidate, match.end()
+    if kept:
+        return kept
+
+    words = text[pos:].split(" ")
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if tokenizer.count(" ".join(words[:mid])) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return " ".join(words[:lo])
+
+
+class PromptBuilder:
+    """
+    Assembles [system + context, history..., user] within a token budget.
+
+    The system prompt and the query are always sent. History gets up to
+    history_budget tokens: the newest HISTORY_TURNS messages first, then a
+    leading {"role": "system"} conversation summary (see ConversationMemory),
+    then older messages newest first, each trimmed at a sentence boundary. Context passages (a list, one per retrieved chunk) fill
+    what is left in rank order; the last one that does not fit is cut at a
+    sentence boundary and the rest dropped. report['max_tokens'] is the answer
+    length that still fits the context window after the prompt.
+    """
+    def __init__(self, tokenizer=None, budget=PROMPT_TOKEN_BUDGET, history_budget=HISTORY_TOKEN_BUDGET):
+        self.tokenizer = tokenizer or PromptTokenizer()
+        self.budget = budget
+        self.history_budget = history_budget
+        self._lock = threading.Lock()
+        self.totals = {'requests': 0, 'prompt_tokens': 0, 'max_prompt_tokens': 0, 'trimmed': 0}
+
+    def _fit_messages(self, messages, budget):
+        """Newest first; returns (messages kept, budget left, whether anything was cut)."""
+        fitted = []
+        cut = False
+        for msg in reversed(messages):
+            content = trim_to_tokens(msg['content'], budget - MESSAGE_OVERHEAD_TOKENS, self.tokenizer)
+            if not content:
+                break
+            cut = cut or content != msg['content']
+            fitted.insert(0, {'role': msg['role'], 'content': content})
+            budget -= self.tokenizer.count(content) + MESSAGE_OVERHEAD_TOKENS
+        return fitted, budget, cut or len(fitted) < len(messages)
+
+    def _fit_history(self, history, budget):
+        """Returns (summary text, messages, whether anything was cut)."""
+        summaries = [m['content'] for m in history if m['role'] == 'system']
+        messages = [m for m in history if m['role'] != 'system']
+        split = max(0, len(messages) - HISTORY_TURNS)
+        window, budget, cut = self._fit_messages(messages[split:], budget)
+        summary = ""
+        if summaries:
+            summary = trim_to_tokens(summaries[-1], budget - SUMMARY_OVERHEAD_TOKENS, self.tokenizer)
+            cut = cut or summary != summaries[-1]
+            if summary:
+                budget -= self.tokenizer.count(summary) + SUMMARY_OVERHEAD_TOKENS
+        older = []
+        if len(window) == len(messages) - split:
+            # Not yet summarized (see ConversationMemory.history); the newest of them first
+            older, budget, older_cut = self._fit_messages(messages[:split], budget)
+            cut = cut or older_cut
+        else:
+            cut = True
+        return summary, older + window, cut
+
+    def _fit_context(self, context, budget):
+        """Returns (passages kept, passages offered, whether anything was cut)."""
+        passages = [p for p in context if p.strip()]
+        fitted = []
+        for passage in passages:
+            separator = self.tokenizer.count(PASSAGE_SEPARATOR) if fitted else 0
+            tokens = self.tokenizer.count(passage)
+            if tokens + separator <= budget:
+                fitted.append(passage)
+                budget -= tokens + separator
+                continue
+            if budget - separator >= MIN_PASSAGE_TOKENS:
+                cut = trim_to_tokens(passage, budget - separator, self.tokenizer)
+                if self.tokenizer.count(cut) >= MIN_PASSAGE_TOKENS:
+                    fitted.append(cut)
+            return fitted, len(passages), True
+        return fitted, len(passages), False
+
+    def build(self, static_prefix, context, user_query, history=()):
+        """
+        Returns (messages, report). context is a list of passages. static_prefix (system prompt and the
+        context heading) stays intact so its prefilled KV state can be reused.
+        """
+        count = self.tokenizer.count
+        fixed = count(static_prefix) + count(user_query) + 2 * MESSAGE_OVERHEAD_TOKENS + 1
+        remaining = max(0, self.budget - fixed)
+
+        summary, history_messages, history_cut = self._fit_history(list(history), min(self.history_budget, remaining))
+        history_tokens = sum(count(m['content']) + MESSAGE_OVERHEAD_TOKENS for m in history_messages)
+        if summary:
+            history_tokens += count(summary) + SUMMARY_OVERHEAD_TOKENS
+        remaining -= history_tokens
+
+        passages, passages_in, context_cut = self._fit_context(context, remaining)
+        context_text = PASSAGE_SEPARATOR.join(passages)
+        context_tokens = count(context_text)
+
+        system_content = f"{static_prefix}{context_text}"
+        if summary:
+            system_content += f"{SUMMARY_HEADING}{summary}"
+        messages = [{"role": "system", "content": system_content}]
+        messages.extend(history_messages)
+        messages.append({"role": "user", "content": user_query})
+
+        report = {
+            'system': count(static_prefix),
+            'context': context_tokens,
+            'passages': f"{len(passages)}/{passages_in}",
+            'history': history_tokens,
+            'query': count(user_query),
+            'total': fixed + history_tokens + context_tokens,
+            'budget': self.budget,
+            'max_tokens': max(0, min(ANSWER_MAX_TOKENS, CONTEXT_WINDOW_TOKENS - (fixed + history_tokens + context_tokens))),
+            'exact': self.tokenizer.exact,
+        }
+        with self._lock:
+            self.totals['requests'] += 1
+            self.totals['prompt_tokens'] += report['total']
+            self.totals['max_prompt_tokens'] = max(self.totals['max_prompt_tokens'], report['total'])
+            self.totals['trimmed'] += int(history_cut or context_cut)
+        print(f"Prompt tokens: {report['total']}/{self.budget} (system {report['system']}, "
+              f"context {report['context']} [{report['passages']} passages], history {report['history']}, "
+              f"query {report['query']}){'' if report['exact'] else ' ~estimated'}")
+        return messages, report
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.totals)
+        stats['avg_prompt_tokens'] = stats['prompt_tokens'] / stats['requests'] if stats['requests'] else 0.0
+        stats['budget'] = self.budget
+        return stats
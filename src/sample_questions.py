@@ -0,0 +1,26 @@
+# Question sets shared by stress_test.py and benchmark.py. No imports, so the
+# benchmark can load it before configure() without pulling in the agent.
+
+# Mix of greetings, policy questions, general knowledge and tricky negations
+STRESS_TEST_QUESTIONS = [
+    "Hiii", "Good morning",
+    "What is casual leave?", "How to claim travel expenses?",
+    "What is the notice period?", "Can I do freelance work?",
+    "Explain my salary structure", "What is the maternity leave policy?",
+    "Does apple color is blue?", "Sky is brown in color",
+    "What is the capital of France?",
+    "I am NOT asking about leave, just saying hi",
+    "Don't tell me about reimbursement, tell me about gym",
+    "Who are you?", "Help me",
+    "What is my bonus?", "What happens if I get fired?",
+    "sky is brown is also chitchat not hr info"
+]
+
+# Plain policy lookups that reach retrieval
+POLICY_QUESTIONS = [
+    "What is the notice period for confirmed employees?", "How many casual leaves per year?",
+    "What is the daily food allowance on business travel?", "Who approves expense claims?",
+    "When is the appraisal cycle?", "Is there a creche facility?", "What does PF deduction cover?",
+    "How do I report harassment to the POSH committee?", "What is covered under GHI?",
+    "Which documents are required on the first day?",
+]
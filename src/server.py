@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import tracing
+from startup import WarmStart
+from llm_client import QueuedLLM, LLMQueueFull, LLMTimeout
+
+# Config
+HOST = os.environ.get('HR_SERVER_HOST', '127.0.0.1')
+PORT = int(os.environ.get('HR_SERVER_PORT', 8000))
+# Requests allowed inside the server at once (classifying, retrieving, queued or generating)
+MAX_IN_FLIGHT = int(os.environ.get('HR_SERVER_MAX_IN_FLIGHT', 32))
+# Generations allowed to wait for the LLM worker
+LLM_QUEUE_SIZE = int(os.environ.get('HR_SERVER_LLM_QUEUE', 8))
+REQUEST_TIMEOUT = int(os.environ.get('HR_SERVER_TIMEOUT', 300))
+RETRY_AFTER_SECONDS = 5
+MAX_BODY_BYTES = 64 * 1024
+
+
+class AgentServer(ThreadingHTTPServer):
+    """
+    HTTP/JSON front end for HRAgent.
+
+    Each request runs on its own thread, so classification, cache lookups and
+    retrieval for different users overlap. All LLM calls go through a
+    QueuedLLM: worker threads drain a bounded queue. A full queue answers
+    429; too many requests in flight, or an agent that is not ready, 503.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, agent, max_in_flight=MAX_IN_FLIGHT):
+        super().__init__(address, AgentRequestHandler)
+        self.agent = agent
+        self.admission = threading.BoundedSemaphore(max_in_flight)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.counters = {'ok': 0, 'rejected_429': 0, 'rejected_503': 0, 'timeouts': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    def count(self, key, delta=1):
+        with self._lock:
+            self.counters[key] += delta
+
+    def status(self):
+        llm = self.agent.llm
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'status': 'ok' if llm.is_alive() else 'degraded',
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'llm_queue_depth': llm.queue_depth(),
+            'llm_queue_capacity': llm.jobs.maxsize,
+            'llm_busy': llm.active,
+            'llm_workers': len(llm.workers),
+            'requests': counters,
+            'generation': llm.generation_stats(),
+        }
+
+    def metrics_text(self):
+        """Prometheus exposition: the tracing metrics plus server gauges and counters."""
+        status = self.status()
+        lines = [
+            "# HELP hr_server_in_flight Requests inside the server.", "# TYPE hr_server_in_flight gauge",
+            f"hr_server_in_flight {status['in_flight']}",
+            "# HELP hr_server_llm_queue_depth Generations waiting for the LLM.", "# TYPE hr_server_llm_queue_depth gauge",
+            f"hr_server_llm_queue_depth {status['llm_queue_depth']}",
+            "# HELP hr_server_responses_total Responses by outcome.", "# TYPE hr_server_responses_total counter",
+        ]
+        lines += [f'hr_server_responses_total{{outcome="{key}"}} {value}' for key, value in sorted(status['requests'].items())]
+        return tracing.metrics.render() + "\n".join(lines) + "\n"
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    server_version = "HRAgentServer/1.0"
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(f"[server] {self.address_string()} {format % args}")
+
+    def do_GET(self):
+        if self.path in ('/health', '/stats'):
+            self._send_json(200, self.server.status())
+        elif self.path == '/metrics':
+            body = self.server.metrics_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/query':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._send_json(400, {'error': f'body must be 1..{MAX_BODY_BYTES} bytes of JSON'})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length))
+            query = str(payload['query']).strip()
+            history = payload.get('history') or []
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'error': 'expected JSON {"query": str, "history": [..]}'})
+            return
+        if not query:
+            self._send_json(400, {'error': 'query is empty'})
+            return
+
+        server = self.server
+        if not server.agent.llm.is_alive():
+            server.count('rejected_503')
+            self._send_json(503, {'error': 'LLM worker is not running'})
+            return
+        if not server.admission.acquire(blocking=False):
+            server.count('rejected_503')
+            self._send_json(503, {'error': 'server busy'}, {'Retry-After': str(RETRY_AFTER_SECONDS)})
+            return
+
+        with server._lock:
+            server.in_flight += 1
+        start = time.time()
+        try:
+            result = server.agent.handle_query(query, history)
+            result['duration_ms'] = round((time.time() - start) * 1000, 1)
+            server.count('ok')
+            self._send_json(200, result)
+        except LLMQueueFull as e:
+            server.count('rejected_429')
+            self._send_json(429, {'error': str(e)}, {'Retry-After': str(RETRY_AFTER_SECONDS)})
+        except LLMTimeout as e:
+            server.count('timeouts')
+            self._send_json(504, {'error': str(e)})
+        except Exception as e:
+            server.count('errors')
+            print(f"[server] Error handling query: {e}")
+            self._send_json(500, {'error': 'internal error'})
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+            server.admission.release()
+
+
+def build_agent(llm_queue_size=LLM_QUEUE_SIZE, timeout=REQUEST_TIMEOUT):
+    # Loads components in parallel and warms them before the port opens
+    agent = WarmStart().start().wait()
+    # Route every generation (classifier fallback and tools) through the queue;
+    # one worker thread per model instance (LLMPool exposes its size)
+    queued = QueuedLLM(agent.llm, max_queue=llm_queue_size, timeout=timeout,
+                       workers=getattr(agent.llm, 'size', 1))
+    agent.llm = queued
+    agent.tools.llm = queued
+    return agent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the HR agent over HTTP/JSON.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument('--llm-queue', type=int, default=LLM_QUEUE_SIZE)
+    args = parser.parse_args(argv)
+
+    print("Loading agent...")
+    agent = build_agent(llm_queue_size=args.llm_queue)
+    server = AgentServer((args.host, args.port), agent, max_in_flight=args.max_in_flight)
+    print(f"HR Agent API listening on http://{args.host}:{args.port} (POST /query, GET /health, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import threading
+
+# Config
+CACHE_DIR = os.environ.get('HR_CACHE_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'cache'))
+# One JSON line per start, to compare cold-start times across deploys
+STARTUP_LOG_PATH = os.path.join(CACHE_DIR, 'startup_times.jsonl')
+WARMUP_QUERY = "How many sick leaves do I get?"
+
+
+class StartupReport:
+    """Wall-clock timing of each startup phase; phases may run on different threads."""
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at = None
+        self.phases = {}
+        self.current = set()
+        self._lock = threading.Lock()
+
+    def timed(self, name, fn, *args, **kwargs):
+        start = time.time()
+        with self._lock:
+            self.current.add(name)
+        error = None
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            with self._lock:
+                self.current.discard(name)
+                self.phases[name] = {
+                    'offset_s': round(start - self.started_at, 3),
+                    'seconds': round(time.time() - start, 3),
+                    'thread': threading.current_thread().name,
+                    'error': error,
+                }
+
+    def elapsed(self):
+        return time.time() - self.started_at
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    @property
+    def total(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def rows(self):
+        with self._lock:
+            return [{'phase': name, **phase} for name, phase in
+                    sorted(self.phases.items(), key=lambda item: item[1]['offset_s'])]
+
+    def format(self):
+        lines = [f"Startup: {self.total:.1f}s total"]
+        for row in self.rows():
+            status = f"  FAILED: {row['error']}" if row['error'] else ""
+            lines.append(f"  {row['phase']:<26} +{row['offset_s']:>6.2f}s  {row['seconds']:>6.2f}s{status}")
+        return "\n".join(lines)
+
+    def save(self, path=STARTUP_LOG_PATH, **extra):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'timestamp': self.started_at, 'total_s': round(self.total, 3),
+                                    'phases': {row.pop('phase'): row for row in self.rows()}, **extra}) + "\n")
+        except OSError as e:
+            print(f"Could not write startup report: {e}")
+
+
+def warm_up(agent, report):
+    """
+    One query embedding and one short classification generation, so weights
+    are paged in and the classifier prompt's KV state is cached before the
+    first real question.
+    """
+    def run(name, fn):
+        try:
+            report.timed(name, fn, WARMUP_QUERY)
+        except Exception as e:
+            # The agent works without a warm cache; the first query just pays for it
+            print(f"Warm-up step {name} failed: {e}")
+
+    threads = [
+        threading.Thread(target=run, args=('warmup_embedding', agent.tools.query_cache.get), name="warmup-embedding"),
+        threading.Thread(target=run, args=('warmup_generation', agent._llm_intent), name="warmup-generation"),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def _import_agent():
+    from agent import HRAgent
+    return HRAgent
+
+
+class WarmStart:
+    """
+    Builds the HRAgent and warms it up on a background thread. state moves
+    pending -> loading -> warming -> ready (or failed) and can be polled by
+    the UI; wait() blocks until the agent is usable.
+    """
+    def __init__(self, warm=True):
+        self.warm = warm
+        self.state = 'pending'
+        self.agent = None
+        self.error = None
+        self.report = StartupReport()
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="warm-start", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.state = 'loading'
+            # chromadb, gpt4all and torch imports are a visible share of a cold start
+            HRAgent = self.report.timed('imports', _import_agent)
+            agent = HRAgent(report=self.report)
+            if self.warm:
+                self.state = 'warming'
+                warm_up(agent, self.report)
+            self.agent = agent
+            self.state = 'ready'
+        except Exception as e:
+            self.error = e
+            self.state = 'failed'
+        finally:
+            self.report.finish()
+            print(self.report.format())
+            self.report.save(state=self.state)
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def wait(self, timeout=None):
+        """Returns the agent once ready; re-raises the startup error if loading failed."""
+        self.start()
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f"Agent not ready after {timeout}s (state: {self.state})")
+        if self.error is not None:
+            raise self.error
+        return self.agent
@@ -1,73 +1,264 @@
 from datetime import datetime
 import chromadb
-from chromadb.utils import embedding_functions
-from sentence_transformers import SentenceTransformer
 import os
+import json
+import tracing
 from llm_client import get_llm
+from embeddings import get_embedding_function, QueryEmbeddingCache
+from lexical_index import LexicalIndexLoader, reciprocal_rank_fusion
+from diversify import mmr_order, merge_adjacent
+from prompt_builder import PromptBuilder
+from vector_index import NumpyVectorIndex
 
 # Config
-CHROMA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'chroma_db')
-EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+CHROMA_PATH = os.environ.get('HR_CHROMA_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'chroma_db'))
+# Fuse BM25 (exact terms like CTC, PF, POSH) with the dense ranking
+HYBRID_RETRIEVAL = os.environ.get('HR_HYBRID_RETRIEVAL', '1') == '1'
+# Candidates taken from each ranking before fusion
+HYBRID_CANDIDATES = int(os.environ.get('HR_HYBRID_CANDIDATES', 20))
+RRF_K = 60
+# Dense search backend: 'chroma' (HNSW via PersistentClient) or 'numpy'
+# (exact search over the memory-mapped matrix ingest writes; no Chroma startup)
+RETRIEVAL_BACKEND = os.environ.get('HR_RETRIEVAL_BACKEND', 'chroma')
+# Over-fetch k * this many candidates, then pick k distinct ones by MMR and
+# merge neighbouring chunks of the same file
+DIVERSIFY = os.environ.get('HR_DIVERSIFY', '1') == '1'
+DIVERSIFY_FETCH_MULTIPLIER = int(os.environ.get('HR_DIVERSIFY_FETCH', 4))
+
+# Ingest records the embedding backend it used here; queries embedded by another
+# backend get a warning, or an error with HR_EMBEDDING_BACKEND_STRICT=1
+MANIFEST_PATH = os.path.join(CHROMA_PATH, 'ingest_manifest.json')
+EMBEDDING_BACKEND_STRICT = os.environ.get('HR_EMBEDDING_BACKEND_STRICT', '0') == '1'
+
+# Chroma category each RAG intent retrieves from (None = unfiltered)
+RAG_INTENT_CATEGORIES = {
+    "leave_policy": "leave",
+    "reimbursement": "reimbursement",
+    "onboarding": "onboarding",
+    "offboarding": "offboarding",
+    "performance": "performance",
+    "code_of_conduct": "code_of_conduct",
+    "grievance_safety": "grievance",
+    "salary_policy": "salary",
+    "compliance_policy": "compliance",
+    "welfare_benefits": "welfare",
+    "general_hr_info": None,
+}
+# Intents answered without retrieval
+NON_RAG_INTENTS = {"chitchat", "general_knowledge"}
+
+def open_collection(embedding_func=None):
+    """The dense search backend: the NumPy vector index or the Chroma collection."""
+    if RETRIEVAL_BACKEND == 'numpy':
+        try:
+            # Same query/get interface as the Chroma collection
+            return NumpyVectorIndex()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"NumPy vector index unavailable ({e}); falling back to ChromaDB.")
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    return client.get_or_create_collection(
+        name="hr_policies",
+        embedding_function=embedding_func or get_embedding_function()
+    )
+
+def check_embedding_backend(service, manifest_path=MANIFEST_PATH):
+    """Compares the backend embedding queries with the one the index was built with."""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            indexed = (json.load(f).get('settings') or {}).get('embedding_backend')
+    except (OSError, ValueError):
+        return
+    if indexed is None:
+        return
+    backend = service.effective_backend
+    if backend != indexed:
+        message = (f"Queries are embedded with the {backend} backend but the index was built with {indexed}; "
+                   f"set HR_EMBEDDING_BACKEND={indexed} or re-run ingest_policies.py.")
+        if EMBEDDING_BACKEND_STRICT:
+            raise RuntimeError(message)
+        print(f"Warning: {message}")
 
 class RAGTools:
-    def __init__(self):
-        self.embedding_func = self._get_embedding_func()
-        self.client = chromadb.PersistentClient(path=CHROMA_PATH)
-        self.collection = self.client.get_or_create_collection(
-            name="hr_policies",
-            embedding_function=self.embedding_func
-        )
-        self.llm = get_llm()
-
-    def _get_embedding_func(self):
-        class LocalEmbeddingFunction(chromadb.EmbeddingFunction):
-            def __init__(self, model_name):
-                self.model = SentenceTransformer(model_name)
-            def __call__(self, input):
-                return self.model.encode(input).tolist()
-        return LocalEmbeddingFunction(EMBEDDING_MODEL_NAME)
+    def __init__(self, llm=None, collection=None):
+        # llm/collection may be loaded ahead of time (HRAgent opens them in parallel)
+        self.embedding_func = get_embedding_function()
+        self.query_cache = QueryEmbeddingCache(self.embedding_func.service)
+        check_embedding_backend(self.embedding_func.service)
+        self.collection = collection if collection is not None else open_collection(self.embedding_func)
+        self.lexical_index = LexicalIndexLoader()
+        self.prompt_builder = PromptBuilder()
+        self.llm = llm if llm is not None else get_llm()
 
     def _retrieve(self, query, category=None, k=3):
+        return self.retrieve_many([query], category=category, k=k)[0]
+
+    def retrieve_many(self, queries, category=None, k=3):
+        """
+        Retrieves for several queries with one embedding batch and one
+        collection.query call. Returns a (context, sources) pair per query.
+        """
+        return [self.format_hits(hits) for hits in self.search_many(queries, category=category, k=k)]
+
+    def search_many(self, queries, category=None, k=3):
+        """
+        Raw hits per query: a list of (document, metadata) in rank order.
+        With the BM25 index on disk, dense and lexical candidates are merged
+        by reciprocal rank fusion. With DIVERSIFY, candidates are over-fetched
+        and the k returned carry distinct text (see _diversify).
+        """
+        candidates = self.search_candidates(queries, category, self.candidate_count(k))
+        return [self.select(query, found, k) for query, (found, _) in zip(queries, candidates)]
+
+    @staticmethod
+    def candidate_count(k):
+        return k * DIVERSIFY_FETCH_MULTIPLIER if DIVERSIFY else k
+
+    def search_candidates(self, queries, category=None, n=3):
+        """
+        Up to n fused candidates per query, before diversification, as
+        (candidates, exhaustive) pairs. candidates are (document, metadata,
+        embedding) in rank order; exhaustive means the dense search came back
+        short, so they hold every chunk matching the filter.
+        """
+        lexical = self.lexical_index.get() if HYBRID_RETRIEVAL else None
+        requested = max(n, HYBRID_CANDIDATES) if lexical else n
+        dense = self._dense_search(queries, category, requested)
+        known = {hit[0]: hit[1:] for hits in dense for hit in hits}
+
+        if lexical is None:
+            ranked_ids = [[hit[0] for hit in hits] for hits in dense]
+        else:
+            ranked_ids = []
+            with tracing.span('lexical_search'):
+                for query, hits in zip(queries, dense):
+                    lexical_ids = [chunk_id for chunk_id, _ in lexical.search(query, k=max(n, HYBRID_CANDIDATES), category=category)]
+                    ranked_ids.append(reciprocal_rank_fusion([[hit[0] for hit in hits], lexical_ids], k=RRF_K)[:n])
+
+            # Chunks only the lexical side found: fetch their text in one call
+            missing = list({chunk_id for ids in ranked_ids for chunk_id in ids if chunk_id not in known})
+            if missing:
+                include = ["documents", "metadatas"] + (["embeddings"] if DIVERSIFY else [])
+                try:
+                    with tracing.span('lexical_fetch'):
+                        page = self.collection.get(ids=missing, include=include)
+                    embeddings = page.get('embeddings') if DIVERSIFY else None
+                    for i, chunk_id in enumerate(page['ids']):
+                        known[chunk_id] = (page['documents'][i], page['metadatas'][i],
+                                           embeddings[i] if embeddings is not None else None)
+                except Exception as e:
+                    print(f"Retrieval Error (lexical hits): {e}")
+
+        return [([known[chunk_id] for chunk_id in ids if chunk_id in known], len(hits) < requested)
+                for ids, hits in zip(ranked_ids, dense)]
+
+    def select(self, query, candidates, k):
+        """The k passages (document, metadata) sent for a query, from its ranked candidates."""
+        if not DIVERSIFY:
+            return [candidate[:2] for candidate in candidates[:k]]
+        with tracing.span('diversify'):
+            return self._diversify(self.query_cache.get(query), candidates, k)
+
+    def _diversify(self, query_embedding, candidates, k):
+        """
+        Picks candidates (document, metadata, embedding) in maximal-marginal-
+        relevance order, skipping near-duplicates, and merges neighbouring
+        chunks of one file so their overlap is sent once. Stops at k passages.
+        """
+        if any(embedding is None for _, _, embedding in candidates):
+            return merge_adjacent([(doc, meta) for doc, meta, _ in candidates[:k]])
+        selected = []
+        merged = []
+        for i in mmr_order(query_embedding, [embedding for _, _, embedding in candidates]):
+            selected.append(candidates[i][:2])
+            merged = merge_adjacent(selected)
+            if len(merged) >= k:
+                break
+        return merged
+
+    def _dense_search(self, queries, category=None, k=3):
+        """Vector search per query: a list of (id, document, metadata, embedding) in rank order."""
         where_filter = {"category": category} if category else None
+        include = ["documents", "metadatas"] + (["embeddings"] if DIVERSIFY else [])
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=k,
-                where=where_filter
-            )
+            # Embed through the LRU so repeat questions (and the retry below) skip the model
+            with tracing.span('embedding'):
+                query_embeddings = self.query_cache.get_many(queries)
+            with tracing.span('vector_search'):
+                results = self.collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=k,
+                    where=where_filter,
+                    include=include
+                )
         except Exception as e:
             print(f"Retrieval Error: {e}")
             # Fallback without filter if filter fails (e.g. wrong category name)
             if category:
                 print("Retrying without category filter...")
-                return self._retrieve(query, category=None, k=k)
-            return "", []
-        
+                return self._dense_search(queries, category=None, k=k)
+            return [[] for _ in queries]
+
+        embeddings = results.get('embeddings') if DIVERSIFY else None
+        hits = []
+        for q in range(len(queries)):
+            if results['documents'] and q < len(results['documents']):
+                vectors = embeddings[q] if embeddings is not None else [None] * len(results['ids'][q])
+                hits.append(list(zip(results['ids'][q], results['documents'][q], results['metadatas'][q], vectors)))
+            else:
+                hits.append([])
+        return hits
+
+    def format_hits(self, hits):
         chunks = []
         sources = []
-        if results['documents']:
-            for i, doc in enumerate(results['documents'][0]):
-                meta = results['metadatas'][0][i]
-                chunks.append(doc)
-                sources.append(f"{meta.get('source', 'Unknown')} (Category: {meta.get('category', 'N/A')})")
-        
-        return "\n\n".join(chunks), sources
+        for doc, meta in hits:
+            chunks.append(doc)
+            sources.append(f"{meta.get('source', 'Unknown')} (Category: {meta.get('category', 'N/A')})")
+        return chunks, sources
 
-    def _generate_response(self, system_prompt, user_query, context, history=[]):
-        # Build messages with history
-        messages = [{"role": "system", "content": f"{system_prompt}\n\nCONTEXT FROM POLICIES:\n{context}"}]
-        
-        # Add recent history (last 2 turns to save tokens)
-        for msg in history[-2:]:
-            messages.append(msg)
-            
-        messages.append({"role": "user", "content": user_query})
-        
-        return self.llm.chat(messages)
+    def narrow_hits(self, query, prefetched, category=None, k=3):
+        """
+        Picks k passages of a category from unfiltered, over-fetched
+        candidates (a search_candidates pair). They are filtered before
+        diversification, so a copy of a chunk in another category cannot
+        suppress the one this category needs. Returns (context, sources), or
+        None when a filtered query is needed instead: fewer than k passages
+        of the category came back and the candidates were not exhaustive.
+        """
+        candidates, exhaustive = prefetched
+        if category:
+            candidates = [c for c in candidates if c[1].get('category') == category]
+        hits = self.select(query, candidates, k)
+        if len(hits) < k and not exhaustive:
+            return None
+        return self.format_hits(hits)
+
+    def _chat(self, messages, max_tokens, stream=False, prefix=None):
+        # stream=True returns a token iterator instead of the finished answer.
+        # prefix: static start of the system prompt, whose prefilled KV state the LLM reuses
+        if stream:
+            return self.llm.chat_stream(messages, max_tokens=max_tokens, prefix=prefix)
+        return self.llm.chat(messages, max_tokens=max_tokens, prefix=prefix)
+
+    def _build_messages(self, static_prefix, context, user_query, history):
+        """Returns (messages, answer max_tokens that fit the window after them)."""
+        with tracing.span('prompt_build'):
+            messages, report = self.prompt_builder.build(static_prefix, context, user_query, history)
+        tracing.annotate(prompt_parts=report)
+        return messages, report['max_tokens']
+
+    def _generate_response(self, system_prompt, user_query, context, history=[], stream=False):
+        # Context passages (by rank) and recent history are trimmed to the prompt token budget
+        static_prefix = f"{system_prompt}\n\nCONTEXT FROM POLICIES:\n"
+        messages, max_tokens = self._build_messages(static_prefix, context, user_query, history)
+        return self._chat(messages, max_tokens, stream, prefix=static_prefix)
 
     # --- Tools ---
+    # Every tool returns (answer, sources). With stream=True the answer is an
+    # iterator of text pieces; sources are known up front since retrieval runs first.
+    # retrieved: a (context, sources) pair fetched ahead of time (batch or prefetch).
 
-    def handle_chitchat(self, query, history=[]):
+    def handle_chitchat(self, query, history=[], stream=False, retrieved=None):
         # Sanitize "hiii", "heya", etc to standard "Hello" to prevent LLM hallucination
         import re
         if re.search(r"^(h+i+|h+e+y+a?|h+e+l+o+|who\s+are\s+you|help)$", query.lower().strip()):
@@ -75,22 +266,18 @@ class RAGTools:
         else:
              sanitized_query = query
         
-        messages = [{"role": "system", "content": "You are a helpful and friendly HR Assistant. Answer questions politely. If the user asks about specific policies, suggest they ask that directly."}]
-        for msg in history[-2:]:
-            messages.append(msg)
-        messages.append({"role": "user", "content": sanitized_query})
-        return self.llm.chat(messages), []
+        system_prompt = "You are a helpful and friendly HR Assistant. Answer questions politely. If the user asks about specific policies, suggest they ask that directly."
+        messages, max_tokens = self._build_messages(system_prompt, [], sanitized_query, history)
+        return self._chat(messages, max_tokens, stream, prefix=system_prompt), []
 
-    def handle_general_knowledge(self, query, history=[]):
+    def handle_general_knowledge(self, query, history=[], stream=False, retrieved=None):
         # Direct LLM call without RAG context to avoid HR hallucinations
-        messages = [{"role": "system", "content": "You are a helpful assistant. Answer the user's general knowledge or logic question directly and concisely. Do NOT mention HR policies or corporate context unless explicitly asked."}]
-        for msg in history[-2:]:
-            messages.append(msg)
-        messages.append({"role": "user", "content": query})
-        return self.llm.chat(messages), []
-
-    def lookup_leave_policy(self, query, history=[]):
-        context, sources = self._retrieve(query, category="leave")
+        system_prompt = "You are a helpful assistant. Answer the user's general knowledge or logic question directly and concisely. Do NOT mention HR policies or corporate context unless explicitly asked."
+        messages, max_tokens = self._build_messages(system_prompt, [], query, history)
+        return self._chat(messages, max_tokens, stream, prefix=system_prompt), []
+
+    def lookup_leave_policy(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="leave")
         prompt = """Role: HR policy assistant.
 Provide a short answer plus key points and conditions.
 Include types of leave, eligibility, documents, limitations.
@@ -99,11 +286,11 @@ Format:
 - Rules list
 - Important conditions
 - Source references"""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def generate_reimbursement_checklist(self, query, history=[]):
-        context, sources = self._retrieve(query, category="reimbursement")
+    def generate_reimbursement_checklist(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="reimbursement")
         prompt = """Extract required documents, steps in order, and approval flow.
 Output Format:
 ### Documents required
@@ -112,64 +299,64 @@ Output Format:
 ...
 ### Approvals
 ..."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def lookup_onboarding_steps(self, query, history=[]):
-        context, sources = self._retrieve(query, category="onboarding")
+    def lookup_onboarding_steps(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="onboarding")
         prompt = """Extract Pre joining requirements, Day 1 steps, and IT/HR tasks.
 Output as a clear checklist."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def lookup_offboarding_policy(self, query, history=[]):
-        context, sources = self._retrieve(query, category="offboarding")
+    def lookup_offboarding_policy(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="offboarding")
         prompt = """Explain notice period rules, exit clearance checklist, and FNF timeline."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def summarize_performance_guidelines(self, query, history=[]):
-        context, sources = self._retrieve(query, category="performance")
+    def summarize_performance_guidelines(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="performance")
         prompt = """Summarize Appraisal cycle, Rating model, and Criteria."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def extract_conduct_rule(self, query, history=[]):
-        context, sources = self._retrieve(query, category="code_of_conduct")
+    def extract_conduct_rule(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="code_of_conduct")
         prompt = """Answer with a clear Yes or No if possible, then cite the policy section."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def grievance_and_safety_steps(self, query, history=[]):
-        context, sources = self._retrieve(query, category="grievance")
+    def grievance_and_safety_steps(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="grievance")
         prompt = """Explain how to report issues, contact points, and confidentiality rules."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def generic_rag_answer(self, query, history=[]):
-        context, sources = self._retrieve(query) # No category filter
+    def generic_rag_answer(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query) # No category filter
         prompt = """Answer the user question based on the context provided. If unsure, say so."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def lookup_salary_policy(self, query, history=[]):
-        context, sources = self._retrieve(query, category="salary")
+    def lookup_salary_policy(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="salary")
         prompt = """Role: HR Compensation Expert.
 Explain salary components (Basic, HRA), deductions (PF, Tax), and payout cycle.
 If asked about benefits, mention the flexible benefit plan."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def lookup_compliance_policy(self, query, history=[]):
-        context, sources = self._retrieve(query, category="compliance")
+    def lookup_compliance_policy(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="compliance")
         prompt = """Role: Corporate Governance Officer.
 Explain the statutory framework, acts (Maternity, Minimum Wage), and Data Privacy (DPDP)."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
 
-    def lookup_welfare_benefits(self, query, history=[]):
-        context, sources = self._retrieve(query, category="welfare")
+    def lookup_welfare_benefits(self, query, history=[], stream=False, retrieved=None):
+        context, sources = retrieved or self._retrieve(query, category="welfare")
         prompt = """Role: HR Wellness Coordinator.
 Explain insurance coverage (GHI, GPA), wellness benefits (Gym, EAP), and office perks."""
-        answer = self._generate_response(prompt, query, context, history)
+        answer = self._generate_response(prompt, query, context, history, stream)
         return answer, sources
@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextlib
+import contextvars
+
+# Config
+CACHE_DIR = os.environ.get('HR_CACHE_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'cache'))
+TRACING_ENABLED = os.environ.get('HR_TRACING', '1') == '1'
+# One JSON line per request: stage spans, LLM generations and token counts
+TRACE_PATH = os.environ.get('HR_TRACE_PATH', os.path.join(CACHE_DIR, 'traces.jsonl'))
+# Past this size the file is rotated to traces.jsonl.1 (.1 -> .2, ...); older files are deleted
+TRACE_MAX_BYTES = int(os.environ.get('HR_TRACE_MAX_BYTES', 50 * 1024 * 1024))
+TRACE_BACKUPS = int(os.environ.get('HR_TRACE_BACKUPS', 3))
+# Prometheus text exposition of the counters/histograms below, for node_exporter's
+# textfile collector; server.py also serves it at GET /metrics
+METRICS_PATH = os.environ.get('HR_METRICS_PATH', os.path.join(CACHE_DIR, 'metrics.prom'))
+METRICS_WRITE_INTERVAL = 15.0
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 100, 200)
+
+METRIC_HELP = {
+    'hr_requests_total': ('counter', "Handled queries by intent, decision path and outcome."),
+    'hr_request_seconds': ('histogram', "End-to-end query latency."),
+    'hr_stage_seconds': ('histogram', "Time spent per query stage."),
+    'hr_llm_generations_total': ('counter', "LLM generations by calling stage."),
+    'hr_llm_prompt_tokens_total': ('counter', "Prompt tokens sent to the LLM."),
+    'hr_llm_completion_tokens_total': ('counter', "Tokens decoded by the LLM."),
+    'hr_llm_wait_seconds': ('histogram', "Time a generation waited for the model."),
+    'hr_llm_prefill_seconds': ('histogram', "Prompt prefill time (until the first token)."),
+    'hr_llm_decode_seconds': ('histogram', "Decode time (first to last token)."),
+    'hr_llm_decode_tokens_per_second': ('histogram', "Decode speed per generation."),
+}
+
+_current_trace = contextvars.ContextVar('hr_trace', default=None)
+_current_stage = contextvars.ContextVar('hr_stage', default=None)
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Metrics:
+    """Process-wide counters and histograms, rendered in the Prometheus text format."""
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._written_at = 0.0
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            key = (name, _labels(labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        with self._lock:
+            key = (name, _labels(labels))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets),
+                                                    'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(h, counts=list(h['counts'])) for key, h in self.histograms.items()}
+        lines = []
+        for name in sorted({key[0] for key in counters} | {key[0] for key in histograms}):
+            kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{fmt(labels)} {value}")
+            for (metric, labels), h in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(h['buckets'], h['counts']):
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {h['count']}")
+                lines.append(f"{name}_sum{fmt(labels)} {round(h['sum'], 6)}")
+                lines.append(f"{name}_count{fmt(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=METRICS_PATH, force=False):
+        """Rewrites the metrics file, at most every METRICS_WRITE_INTERVAL seconds unless forced."""
+        now = time.time()
+        if not force and now - self._written_at < METRICS_WRITE_INTERVAL:
+            return
+        self._written_at = now
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write metrics file: {e}")
+
+
+metrics = Metrics()
+_trace_file_lock = threading.Lock()
+
+
+class Trace:
+    """Spans and LLM generations of one request; spans may be added from several threads."""
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.error = None
+        self.spans = []
+        self.generations = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, seconds, error=None):
+        with self._lock:
+            self.spans.append({'name': name, 'offset_s': round(start - self.start, 4), 'seconds': round(seconds, 4),
+                               'thread': threading.current_thread().name, 'error': error})
+
+    def add_generation(self, generation):
+        with self._lock:
+            self.generations.append(generation)
+
+    def stage_seconds(self):
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span['name']] = totals.get(span['name'], 0.0) + span['seconds']
+        return {name: round(seconds, 4) for name, seconds in totals.items()}
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['offset_s'])
+            generations = list(self.generations)
+        return {
+            'trace_id': self.id,
+            'name': self.name,
+            'timestamp': self.started_at,
+            'seconds': round(self.seconds, 4) if self.seconds is not None else None,
+            'error': self.error,
+            **self.attrs,
+            'stages': self.stage_seconds(),
+            'prompt_tokens': sum(g['prompt_tokens'] for g in generations),
+            'completion_tokens': sum(g['completion_tokens'] for g in generations),
+            'spans': spans,
+            'generations': generations,
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def trace(name, **attrs):
+    """
+    Traces one request: spans and generations recorded in this context (and
+    in functions run through `propagate`) are attached to it. On exit the
+    trace is appended to TRACE_PATH (rotated at TRACE_MAX_BYTES) and the
+    request metrics are updated.
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    current = Trace(name, **attrs)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_trace.reset(token)
+        _finish(current)
+
+
+def trace_stream(name, events, **attrs):
+    """
+    Traces a streaming request. The events generator runs in a context of
+    its own, entered for each step, so the trace is current while it runs
+    but never leaks into the consumer's context between events.
+    """
+    if not TRACING_ENABLED:
+        yield from events
+        return
+    current = Trace(name, **attrs)
+    context = contextvars.copy_context()
+    context.run(_current_trace.set, current)
+    try:
+        while True:
+            try:
+                event = context.run(next, events)
+            except StopIteration:
+                return
+            yield event
+    except BaseException as e:
+        # GeneratorExit: the consumer stopped reading
+        current.error = type(e).__name__ if isinstance(e, GeneratorExit) else f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        context.run(events.close)
+        _finish(current)
+
+
+def _rotate(path):
+    if TRACE_BACKUPS <= 0:
+        os.remove(path)
+        return
+    for i in range(TRACE_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _finish(current):
+    current.seconds = time.perf_counter() - current.start
+    intent = current.attrs.get('intent', 'unknown')
+    metrics.inc('hr_requests_total', intent=intent, path=current.attrs.get('intent_path', 'unknown'),
+                status='error' if current.error else ('cached' if current.attrs.get('cached') else 'ok'))
+    metrics.observe('hr_request_seconds', current.seconds, intent=intent)
+    for stage, seconds in current.stage_seconds().items():
+        metrics.observe('hr_stage_seconds', seconds, stage=stage)
+    try:
+        os.makedirs(os.path.dirname(TRACE_PATH), exist_ok=True)
+        line = json.dumps(current.to_dict(), default=str)
+        with _trace_file_lock:
+            if os.path.exists(TRACE_PATH) and os.path.getsize(TRACE_PATH) >= TRACE_MAX_BYTES:
+                _rotate(TRACE_PATH)
+            with open(TRACE_PATH, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"Could not write trace: {e}")
+    metrics.write()
+
+
+def annotate(**attrs):
+    """Sets attributes (intent, cached, ...) on the current trace, if any."""
+    current = _current_trace.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Times a stage of the current trace; a no-op outside one."""
+    current = _current_trace.get()
+    if current is None:
+        yield
+        return
+    token = _current_stage.set(name)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.add_span(name, start, time.perf_counter() - start, error)
+        try:
+            _current_stage.reset(token)
+        except ValueError:
+            _current_stage.set(None)
+
+
+def propagate(fn):
+    """Wraps fn to run in a copy of the caller's context, so executor threads record into its trace."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def generation_record(backend, prompt_tokens, completion_tokens, called, started, first_token, last_token):
+    """Per-generation timings from perf_counter() marks: call, model acquired, first and last token."""
+    started = started if started is not None else called
+    first_token = first_token if first_token is not None else started
+    last_token = last_token if last_token is not None else first_token
+    decode = last_token - first_token
+    return {
+        'backend': backend,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'wait_s': round(started - called, 4),
+        'prefill_s': round(first_token - started, 4),
+        'decode_s': round(decode, 4),
+        # The first token comes out of prefill; the rest are decode steps
+        'tokens_per_s': round((completion_tokens - 1) / decode, 2) if completion_tokens > 1 and decode > 0 else None,
+    }
+
+
+def record_generation(generation):
+    """Adds an LLM generation to the current trace (tagged with the enclosing stage) and the metrics."""
+    stage = _current_stage.get() or 'untraced'
+    generation = dict(generation, stage=stage)
+    current = _current_trace.get()
+    if current is not None:
+        current.add_generation(generation)
+    if not TRACING_ENABLED:
+        return
+    metrics.inc('hr_llm_generations_total', stage=stage)
+    metrics.inc('hr_llm_prompt_tokens_total', generation['prompt_tokens'], stage=stage)
+    metrics.inc('hr_llm_completion_tokens_total', generation['completion_tokens'], stage=stage)
+    metrics.observe('hr_llm_wait_seconds', generation['wait_s'], stage=stage)
+    metrics.observe('hr_llm_prefill_seconds', generation['prefill_s'], stage=stage)
+    metrics.observe('hr_llm_decode_seconds', generation['decode_s'], stage=stage)
+    if generation['tokens_per_s'] is not None:
+        metrics.observe('hr_llm_decode_tokens_per_second', generation['tokens_per_s'],
+                        buckets=TOKENS_PER_SECOND_BUCKETS, stage=stage)
@@ -0,0 +1,299 @@
+import os
+import json
+import threading
+import contextlib
+import numpy as np
+
+from vector_math import normalize
+
+# Config
+CHROMA_PATH = os.environ.get('HR_CHROMA_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'chroma_db'))
+VECTOR_INDEX_DIR = os.path.join(CHROMA_PATH, 'vectors')
+EMBEDDINGS_FILE = 'embeddings.npy'
+CATEGORIES_FILE = 'categories.npy'
+# Chunk texts, UTF-8 back to back, and where each row's text starts; mapped, not loaded
+TEXTS_FILE = 'texts.bin'
+TEXT_OFFSETS_FILE = 'text_offsets.npy'
+# One [id, metadata] JSON line per row
+METADATA_FILE = 'metadata.jsonl'
+# Written last: row count and category names
+CHUNKS_FILE = 'chunks.json'
+# float16 halves the file and page-cache footprint; scores are computed in float32 either way
+VECTOR_DTYPE = os.environ.get('HR_VECTOR_DTYPE', 'float32')
+# Rows scored per block, bounds the float32 copy made from a float16 file
+SCORE_BLOCK_ROWS = 16384
+
+
+class VectorIndexWriter:
+    """
+    Streams rows into a new vector index of a known size: the embedding
+    matrix and per-row arrays are preallocated .npy memmaps, texts and
+    metadata are appended to their files, so memory does not grow with the
+    corpus. commit() swaps the files in; the chunk file goes last and
+    records the row count, so a reader never pairs a new matrix with old chunks.
+    """
+    def __init__(self, rows, path=VECTOR_INDEX_DIR, dtype=VECTOR_DTYPE):
+        os.makedirs(path, exist_ok=True)
+        self.rows = rows
+        self.path = path
+        self.dtype = dtype
+        self.written = 0
+        self.category_names = []
+        self._matrix = None  # allocated by the first add(), once the dimension is known
+        self._codes = self._allocate(CATEGORIES_FILE, np.int16, (rows,))
+        self._offsets = self._allocate(TEXT_OFFSETS_FILE, np.int64, (rows + 1,))
+        self._offsets[0] = 0
+        self._texts = open(self._tmp(TEXTS_FILE), 'wb')
+        self._metadata = open(self._tmp(METADATA_FILE), 'w', encoding='utf-8')
+
+    def _tmp(self, name):
+        return os.path.join(self.path, name + '.tmp')
+
+    def _allocate(self, name, dtype, shape):
+        if 0 in shape:
+            with open(self._tmp(name), 'wb') as f:
+                np.save(f, np.zeros(shape, dtype=dtype))
+            return np.zeros(shape, dtype=dtype)
+        return np.lib.format.open_memmap(self._tmp(name), mode='w+', dtype=dtype, shape=shape)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        n = len(ids)
+        if not n:
+            return
+        if self.written + n > self.rows:
+            raise ValueError(f"Vector index was sized for {self.rows} rows")
+        vectors = normalize(embeddings)
+        if self._matrix is None:
+            self._matrix = self._allocate(EMBEDDINGS_FILE, self.dtype, (self.rows, vectors.shape[1]))
+        rows = slice(self.written, self.written + n)
+        self._matrix[rows] = vectors
+        position = int(self._offsets[self.written])
+        for i, (chunk_id, text, meta) in enumerate(zip(ids, documents, metadatas)):
+            meta = meta or {}
+            category = meta.get('category') or ''
+            if category not in self.category_names:
+                self.category_names.append(category)
+            self._codes[self.written + i] = self.category_names.index(category)
+            data = (text or "").encode('utf-8')
+            self._texts.write(data)
+            position += len(data)
+            self._offsets[self.written + i + 1] = position
+            self._metadata.write(json.dumps([chunk_id, meta], separators=(',', ':')) + "\n")
+        self.written += n
+
+    def _close(self):
+        for array in (self._matrix, self._codes, self._offsets):
+            if isinstance(array, np.memmap):
+                array.flush()
+        self._matrix = self._codes = self._offsets = None
+        self._texts.close()
+        self._metadata.close()
+
+    def abort(self):
+        self._close()
+        for name in (EMBEDDINGS_FILE, CATEGORIES_FILE, TEXT_OFFSETS_FILE, TEXTS_FILE, METADATA_FILE):
+            with contextlib.suppress(OSError):
+                os.remove(self._tmp(name))
+
+    def commit(self):
+        """Swaps the new files in; returns the matrix size in bytes."""
+        if self.written != self.rows:
+            self.abort()
+            raise ValueError(f"Vector index expected {self.rows} rows, got {self.written}")
+        if self._matrix is None:
+            self._matrix = self._allocate(EMBEDDINGS_FILE, self.dtype, (0, 0))
+        matrix_bytes = self._matrix.nbytes
+        self._close()
+        for name in (EMBEDDINGS_FILE, CATEGORIES_FILE, TEXT_OFFSETS_FILE, TEXTS_FILE, METADATA_FILE):
+            os.replace(self._tmp(name), os.path.join(self.path, name))
+        with open(self._tmp(CHUNKS_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'rows': self.rows, 'categories': self.category_names}, f)
+        os.replace(self._tmp(CHUNKS_FILE), os.path.join(self.path, CHUNKS_FILE))
+        return matrix_bytes
+
+
+def write_vector_index(pages, rows, path=VECTOR_INDEX_DIR, dtype=VECTOR_DTYPE):
+    """Writes a new index from (ids, embeddings, documents, metadatas) pages holding `rows` chunks."""
+    writer = VectorIndexWriter(rows, path, dtype)
+    try:
+        for page in pages:
+            writer.add(*page)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
+
+
+def update_vector_index(pages, added_rows, removed_ids=(), path=VECTOR_INDEX_DIR, dtype=VECTOR_DTYPE):
+    """
+    Rewrites the index on disk without removed_ids and with the added pages
+    appended. Kept rows are copied block by block from the mapped files, so
+    only the changed chunks are read from the collection.
+    """
+    old = NumpyVectorIndex(path, verbose=False)
+    removed = set(removed_ids)
+    kept = [i for i, chunk_id in enumerate(old.ids) if chunk_id not in removed]
+    writer = VectorIndexWriter(len(kept) + added_rows, path, dtype)
+    try:
+        for start in range(0, len(kept), SCORE_BLOCK_ROWS):
+            block = kept[start:start + SCORE_BLOCK_ROWS]
+            writer.add([old.ids[i] for i in block], np.asarray(old.matrix[block], dtype=np.float32),
+                       [old.document(i) for i in block], [old.metadatas[i] for i in block])
+        # Release the mapped files before they are replaced
+        del old
+        for page in pages:
+            writer.add(*page)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
+
+
+def vector_index_rows(path=VECTOR_INDEX_DIR):
+    """Row count recorded by the last completed write, or None without a (current-layout) index."""
+    if not all(os.path.exists(os.path.join(path, name)) for name in (TEXTS_FILE, TEXT_OFFSETS_FILE, METADATA_FILE)):
+        return None
+    try:
+        with open(os.path.join(path, CHUNKS_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)['rows']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class NumpyVectorIndex:
+    """
+    Exact in-process vector search over the files ingest writes next to Chroma.
+
+    Answers the subset of the Chroma collection API that RAGTools and the
+    intent classifier use (query/get with a category `where` filter and
+    documents/metadatas/embeddings), so it can stand in for the collection.
+    The matrix and the chunk texts are memory-mapped: pool workers and server
+    processes share their pages through the OS cache, and only ids and
+    metadata live on each process's heap. Reloads when ingest rewrites the files.
+    """
+    def __init__(self, path=VECTOR_INDEX_DIR, verbose=True):
+        self.path = path
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._load()
+
+    def _load(self):
+        chunks_path = os.path.join(self.path, CHUNKS_FILE)
+        mtime = os.path.getmtime(chunks_path)
+        with open(chunks_path, 'r', encoding='utf-8') as f:
+            chunks = json.load(f)
+        matrix = np.load(os.path.join(self.path, EMBEDDINGS_FILE), mmap_mode='r')
+        codes = np.load(os.path.join(self.path, CATEGORIES_FILE))
+        offsets = np.load(os.path.join(self.path, TEXT_OFFSETS_FILE), mmap_mode='r')
+        texts_path = os.path.join(self.path, TEXTS_FILE)
+        texts = np.memmap(texts_path, dtype=np.uint8, mode='r') if os.path.getsize(texts_path) else np.zeros(0, np.uint8)
+        ids, metadatas = [], []
+        with open(os.path.join(self.path, METADATA_FILE), 'r', encoding='utf-8') as f:
+            for line in f:
+                chunk_id, meta = json.loads(line)
+                ids.append(chunk_id)
+                metadatas.append(meta)
+        if {len(matrix), len(codes), len(offsets) - 1, len(ids)} != {chunks['rows']}:
+            raise ValueError(f"Vector index at {self.path} is incomplete; re-run ingest_policies.py")
+        self.ids = ids
+        self.metadatas = metadatas
+        self.category_names = chunks['categories']
+        self.matrix = matrix
+        self.codes = codes
+        self._offsets = offsets
+        self._texts = texts
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        self._mtime = mtime
+        if self.verbose:
+            print(f"Loaded vector index: {len(self.ids)} chunks, {self.matrix.dtype} ({self.matrix.nbytes / 1e6:.1f} MB mapped).")
+
+    def document(self, row):
+        return self._texts[self._offsets[row]:self._offsets[row + 1]].tobytes().decode('utf-8')
+
+    def _refresh(self):
+        try:
+            mtime = os.path.getmtime(os.path.join(self.path, CHUNKS_FILE))
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        self._load()
+                    except (OSError, ValueError, KeyError) as e:
+                        print(f"Keeping previous vector index: {e}")
+
+    @staticmethod
+    def exists(path=VECTOR_INDEX_DIR):
+        return os.path.exists(os.path.join(path, CHUNKS_FILE))
+
+    def count(self):
+        return len(self.ids)
+
+    def _rows(self, where):
+        """Row positions matching a {"category": name} filter (None = all rows)."""
+        if not where:
+            return None
+        category = where.get('category')
+        if category not in self.category_names:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.codes == self.category_names.index(category))
+
+    def _scores(self, rows, queries):
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if not len(matrix):
+            # Empty index ((0, 0) matrix) or no rows in the category
+            return np.zeros((len(queries), 0), dtype=np.float32)
+        if matrix.dtype == np.float32:
+            return queries @ np.asarray(matrix).T
+        return np.hstack([queries @ np.asarray(matrix[i:i + SCORE_BLOCK_ROWS], dtype=np.float32).T
+                          for i in range(0, len(matrix), SCORE_BLOCK_ROWS)])
+
+    def _result(self, positions, include):
+        result = {'ids': [self.ids[i] for i in positions]}
+        if 'documents' in include:
+            result['documents'] = [self.document(i) for i in positions]
+        if 'metadatas' in include:
+            result['metadatas'] = [self.metadatas[i] for i in positions]
+        if 'embeddings' in include:
+            result['embeddings'] = np.asarray(self.matrix[positions], dtype=np.float32) if len(positions) else []
+        return result
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("documents", "metadatas")):
+        self._refresh()
+        queries = normalize(query_embeddings)
+        rows = self._rows(where)
+        scores = self._scores(rows, queries)
+
+        out = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        if 'embeddings' in include:
+            out['embeddings'] = []
+        for q in range(len(queries)):
+            row_scores = scores[q]
+            k = min(n_results, len(row_scores))
+            top = np.argpartition(-row_scores, k - 1)[:k] if k else np.zeros(0, dtype=np.int64)
+            top = top[np.argsort(-row_scores[top])]
+            positions = top if rows is None else rows[top]
+            result = self._result(positions, include)
+            out['ids'].append(result['ids'])
+            out['documents'].append(result.get('documents'))
+            out['metadatas'].append(result.get('metadatas'))
+            out['distances'].append((1.0 - row_scores[top]).tolist())
+            if 'embeddings' in include:
+                out['embeddings'].append(result['embeddings'])
+        return out
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=0):
+        self._refresh()
+        if ids is not None:
+            positions = [self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions]
+        else:
+            rows = self._rows(where)
+            positions = list(range(len(self.ids))) if rows is None else rows.tolist()
+            end = None if limit is None else offset + limit
+            positions = positions[offset:end]
+        result = self._result(positions, include)
+        if 'embeddings' in include and not len(positions):
+            result['embeddings'] = None
+        return result
@@ -0,0 +1,8 @@
+import numpy as np
+
+
+def normalize(vectors):
+    """Rows (or a single vector) scaled to unit length as float32; zero vectors are left as is."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
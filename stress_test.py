@@ -3,22 +3,18 @@ import os
 sys.path.append(os.path.join(os.getcwd(), 'src'))
 
 from src.agent import HRAgent
+from latency_stats import latency_summary
+from sample_questions import STRESS_TEST_QUESTIONS
 import time
+import json
+import random
+import argparse
+import threading
+import itertools
+from collections import Counter
 
 def get_stress_test_questions():
-    return [
-        "Hiii", "Good morning", 
-        "What is casual leave?", "How to claim travel expenses?", 
-        "What is the notice period?", "Can I do freelance work?", 
-        "Explain my salary structure", "What is the maternity leave policy?", 
-        "Does apple color is blue?", "Sky is brown in color",
-        "What is the capital of France?",
-        "I am NOT asking about leave, just saying hi", 
-        "Don't tell me about reimbursement, tell me about gym",
-        "Who are you?", "Help me",
-        "What is my bonus?", "What happens if I get fired?",
-        "sky is brown is also chitchat not hr info"
-    ]
+    return list(STRESS_TEST_QUESTIONS)
 
 def run_stress_test_logic(agent):
     questions = get_stress_test_questions()
@@ -35,6 +31,7 @@ def run_stress_test_logic(agent):
                 "ID": i,
                 "Question": q,
                 "Intent": res['intent'],
+                "Intent Path": res.get('intent_path', ''),
                 "Answer": res['answer'],
                 "Duration": f"{duration:.2f}s"
             })
@@ -43,26 +40,198 @@ def run_stress_test_logic(agent):
                 "ID": i,
                 "Question": q,
                 "Intent": "ERROR",
+                "Intent Path": "",
                 "Answer": str(e),
                 "Duration": "0s"
             })
     return results
 
-def run_stress_test_cli():
+def run_batch_test_logic(agent):
+    """Same questions through HRAgent.handle_queries (independent, no history)."""
+    questions = get_stress_test_questions()
+    start = time.time()
+    answers = agent.handle_queries(questions)
+    duration = time.time() - start
+    print(f"Batch of {len(questions)} questions took {duration:.2f}s ({duration / len(questions):.2f}s/question)")
+    return [{
+        "ID": i,
+        "Question": q,
+        "Intent": res['intent'],
+        "Intent Path": res.get('intent_path', ''),
+        "Answer": res['answer'],
+        "Duration": "batch"
+    } for i, (q, res) in enumerate(zip(questions, answers), 1)]
+
+def parse_questions(text):
+    """One question per line (blank lines and # comments skipped), or a JSON list of strings."""
+    if text.strip().startswith('['):
+        return [str(q).strip() for q in json.loads(text) if str(q).strip()]
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+
+def load_question_sets(paths):
+    """{file name: questions} for each question file; the load test mixes the sets."""
+    sets = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            questions = parse_questions(f.read())
+        if questions:
+            sets[os.path.basename(path)] = questions
+    return sets
+
+def percentiles(samples):
+    """p50/p95/p99 (nearest rank), mean and max of durations in seconds."""
+    summary = latency_summary(samples)
+    return {key: round(summary[key], 4) if summary[key] is not None else None
+            for key in ('p50', 'p95', 'p99', 'mean', 'max')}
+
+class _Pacer:
+    """Hands out send times at a fixed total rate, shared by all virtual users."""
+    def __init__(self, rate, start):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = start
+        self._lock = threading.Lock()
+
+    def wait(self):
+        now = time.time()
+        if not self.interval:
+            return now
+        with self._lock:
+            # Missed slots are not made up in a burst when every user was busy
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+        return slot
+
+def _timed_query(agent, question, set_name, user, t0):
+    record = {"user": user, "set": set_name, "question": question, "sent_at": round(time.time() - t0, 4),
+              "ttft": None, "latency": None, "intent": None, "cached": False, "error": None}
+    start = time.time()
+    try:
+        for event in agent.handle_query_stream(question, []):
+            if event["type"] == "token" and record["ttft"] is None:
+                record["ttft"] = round(time.time() - start, 4)
+            elif event["type"] == "done":
+                record["intent"] = event["intent"]
+                record["cached"] = event.get("cached", False)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["latency"] = round(time.time() - start, 4)
+    return record
+
+def summarize_load(records, wall_seconds, config):
+    ok = [r for r in records if not r["error"]]
+    errors = Counter(r["error"].split(":")[0] for r in records if r["error"])
+    return {
+        **config,
+        "requests": len(records),
+        "succeeded": len(ok),
+        "errors": sum(errors.values()),
+        "error_rate": round(sum(errors.values()) / len(records), 4) if records else 0.0,
+        "errors_by_type": dict(errors),
+        "cached": sum(1 for r in ok if r["cached"]),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_s": percentiles([r["latency"] for r in ok]),
+        "ttft_s": percentiles([r["ttft"] for r in ok if r["ttft"] is not None]),
+    }
+
+def run_load_test(agent, question_sets=None, users=4, rate=None, ramp_up=0.0, duration=30.0,
+                  max_requests=None, seed=0, use_cache=False):
+    """
+    Virtual users send streamed queries concurrently until `duration` seconds
+    (or `max_requests`) are used up. User n starts after ramp_up * n / users
+    seconds; with `rate`, sends are paced to that many requests/s in total.
+    Each request picks a question set, then a question, at random.
+    Unless use_cache, answer cache lookups miss for the duration, so repeated
+    questions measure the retrieval + LLM path rather than cache replays.
+    Returns {"summary": ..., "requests": [per-request records]}.
+    """
+    threshold = agent.answer_cache.threshold
+    if not use_cache:
+        # Cosine similarity never exceeds 1 (same trick as benchmark.py)
+        agent.answer_cache.threshold = 2.0
+    try:
+        return _run_load_test(agent, question_sets, users, rate, ramp_up, duration, max_requests, seed, use_cache)
+    finally:
+        agent.answer_cache.threshold = threshold
+
+def _run_load_test(agent, question_sets, users, rate, ramp_up, duration, max_requests, seed, use_cache):
+    question_sets = question_sets or {"stress_test": get_stress_test_questions()}
+    names = sorted(question_sets)
+    records = []
+    issued = itertools.count()
+    start = time.time()
+    deadline = start + duration
+    pacer = _Pacer(rate, start)
+
+    def user(n):
+        rng = random.Random(seed * 1000 + n)
+        time.sleep(ramp_up * n / users)
+        while time.time() < deadline:
+            if max_requests is not None and next(issued) >= max_requests:
+                break
+            if pacer.wait() >= deadline:
+                break
+            set_name = rng.choice(names)
+            records.append(_timed_query(agent, rng.choice(question_sets[set_name]), set_name, n, start))
+
+    threads = [threading.Thread(target=user, args=(n,), name=f"vuser-{n}") for n in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.time() - start
+
+    config = {"users": users, "target_rps": rate, "ramp_up_s": ramp_up, "duration_s": duration,
+              "answer_cache": use_cache, "question_sets": {name: len(question_sets[name]) for name in names}}
+    records.sort(key=lambda r: r["sent_at"])
+    return {"summary": summarize_load(records, wall_seconds, config), "requests": records}
+
+def run_load_test_cli(args):
+    print("Initializing Agent...")
+    agent = HRAgent()
+    question_sets = load_question_sets(args.questions) if args.questions else None
+    print(f"Load test: {args.users} users, rate {args.rate or 'unpaced'}, ramp-up {args.ramp_up}s, {args.duration}s...")
+    results = run_load_test(agent, question_sets, users=args.users, rate=args.rate, ramp_up=args.ramp_up,
+                            duration=args.duration, max_requests=args.requests, seed=args.seed,
+                            use_cache=args.use_cache)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Per-request results written to {args.output}")
+    print(json.dumps(results["summary"], indent=2))
+
+def run_stress_test_cli(batch=False):
     print("Initializing Agent...")
     try:
         agent = HRAgent()
-        results = run_stress_test_logic(agent)
+        results = run_batch_test_logic(agent) if batch else run_stress_test_logic(agent)
         
         print(f"\nRunning {len(results)} Question Stress Test...\n")
-        print(f"{'ID':<3} | {'Question':<35} | {'Intent':<20} | {'Duration'}")
-        print("-" * 80)
+        print(f"{'ID':<3} | {'Question':<35} | {'Intent':<20} | {'Path':<9} | {'Duration'}")
+        print("-" * 92)
         
         for r in results:
-            print(f"{r['ID']:<3} | {r['Question']:<35} | {r['Intent']:<20} | {r['Duration']}")
+            print(f"{r['ID']:<3} | {r['Question']:<35} | {r['Intent']:<20} | {r['Intent Path']:<9} | {r['Duration']}")
             
     except Exception as e:
         print(f"Failed: {e}")
 
 if __name__ == "__main__":
-    run_stress_test_cli()
+    parser = argparse.ArgumentParser(description="Agent stress and load tests.")
+    parser.add_argument("--batch", action="store_true", help="Run the stress questions through handle_queries.")
+    parser.add_argument("--users", type=int, help="Load test with this many concurrent virtual users.")
+    parser.add_argument("--rate", type=float, help="Target total requests/second (default: unpaced).")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which users are started.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Load test length in seconds.")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests.")
+    parser.add_argument("--questions", nargs="+", help="Question files (.txt one per line, or a JSON list).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--use-cache", action="store_true",
+                        help="Let the answer cache replay repeated questions (default: bypassed).")
+    parser.add_argument("--output", help="Write summary and per-request records as JSON.")
+    args = parser.parse_args()
+    if args.users:
+        run_load_test_cli(args)
+    else:
+        run_stress_test_cli(batch=args.batch)